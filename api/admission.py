@@ -0,0 +1,197 @@
+"""
+流入制御（同時処理数の上限とクライアントごとのレート制限）
+
+- 同時に処理するリクエストを ADMISSION_MAX_CONCURRENCY 件までにし、超えた分は
+  ADMISSION_MAX_QUEUE 件まで最大 ADMISSION_QUEUE_TIMEOUT 秒待たせる
+  待ち行列が一杯・待ち時間切れなら 503 + Retry-After
+- クライアント（IP）ごとのトークンバケットで、API（/api/）と音声（/audio/）を別々に制限する
+  使い切ったら 429 + Retry-After
+  RATE_LIMIT_API_RATE / RATE_LIMIT_AUDIO_RATE を設定したときのみ有効（プロキシの後ろでは
+  RATE_LIMIT_TRUST_FORWARDED=1 にしないと全員が同じクライアントになるため、既定では無効）
+
+いずれもメモリ上で処理し、1リクエストあたり O(1)
+ヘルスチェック・メトリクスと OPTIONS（CORSのプリフライト）は制限しない
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional, Tuple
+
+from api import metrics
+
+# レート制限の対象外にするパス
+EXEMPT_PATHS = ("/api/health", "/metrics")
+
+# バケットを保持するクライアント数の上限（古いものから捨てる）
+MAX_TRACKED_CLIENTS = 100000
+
+rejected_total = metrics.registry.counter(
+    "tori_admission_rejected_total", "流入制御で拒否したリクエスト数", ("reason",))
+
+
+def client_address(scope, trust_forwarded: bool) -> str:
+    """リクエストの接続元（trust_forwarded なら X-Forwarded-For の末尾）"""
+    if trust_forwarded:
+        for name, value in scope.get("headers", ()):
+            if name == b"x-forwarded-for":
+                # 末尾がリバースプロキシの付けた接続元（先頭はクライアントが偽装できる）
+                return value.decode("latin-1").rsplit(",", 1)[-1].strip()
+    client = scope.get("client")
+    return client[0] if client else ""
+
+
+class TokenBucket:
+    """クライアントごとのトークンバケット（rate 件/秒、最大 burst 件）"""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = MAX_TRACKED_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        # クライアント -> (残りトークン, 最終更新時刻)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def take(self, client: str, now: float) -> float:
+        """トークンを1つ使う。足りなければ次に使えるまでの秒数を返す（使えたら 0）"""
+        tokens, updated = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[client] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class ConcurrencyLimiter:
+    """同時処理数の上限と、上限を超えた分の待ち行列"""
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> Optional[str]:
+        """処理枠を確保する（確保できなければ理由を返す）"""
+        if self.active < self.max_concurrency and not self.waiting:
+            self.active += 1
+            return None
+        if self.waiting >= self.max_queue:
+            return "queue_full"
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.waiting += 1
+        try:
+            # 処理枠は release() から直接引き渡される（active は増減しない）
+            await asyncio.wait_for(waiter, self.queue_timeout)
+            return None
+        except asyncio.TimeoutError:
+            return "queue_timeout"
+        except asyncio.CancelledError:
+            # 枠を引き渡された直後に切断された場合は返す
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class AdmissionMiddleware:
+    """同時処理数の制限とクライアントごとのレート制限を行うASGIミドルウェア"""
+
+    def __init__(self, app, max_concurrency: Optional[int] = None, max_queue: Optional[int] = None,
+                 queue_timeout: Optional[float] = None,
+                 api_rate: Optional[float] = None, api_burst: Optional[float] = None,
+                 audio_rate: Optional[float] = None, audio_burst: Optional[float] = None,
+                 trust_forwarded: Optional[bool] = None):
+        self.app = app
+        env = os.environ.get
+        max_concurrency = max_concurrency if max_concurrency is not None else int(env("ADMISSION_MAX_CONCURRENCY", 100))
+        self.limiter: Optional[ConcurrencyLimiter] = None
+        if max_concurrency > 0:
+            self.limiter = ConcurrencyLimiter(
+                max_concurrency,
+                max_queue if max_queue is not None else int(env("ADMISSION_MAX_QUEUE", 50)),
+                queue_timeout if queue_timeout is not None else float(env("ADMISSION_QUEUE_TIMEOUT", 1.0)),
+            )
+            metrics.registry.gauge_callback(
+                "tori_admission_waiting", "処理枠を待っているリクエスト数", lambda: {(): self.limiter.waiting})
+
+        api_rate = api_rate if api_rate is not None else float(env("RATE_LIMIT_API_RATE", 0))
+        audio_rate = audio_rate if audio_rate is not None else float(env("RATE_LIMIT_AUDIO_RATE", 0))
+        self.buckets: Dict[str, TokenBucket] = {}
+        if api_rate > 0:
+            self.buckets["api"] = TokenBucket(
+                api_rate, api_burst if api_burst is not None else float(env("RATE_LIMIT_API_BURST", 40)))
+        if audio_rate > 0:
+            self.buckets["audio"] = TokenBucket(
+                audio_rate, audio_burst if audio_burst is not None else float(env("RATE_LIMIT_AUDIO_BURST", 30)))
+        self.trust_forwarded = (trust_forwarded if trust_forwarded is not None
+                                else env("RATE_LIMIT_TRUST_FORWARDED") == "1")
+
+    @staticmethod
+    def _bucket_name(path: str) -> Optional[str]:
+        if path.startswith("/audio/"):
+            return "audio"
+        if path.startswith("/api/"):
+            return "api"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        bucket_name = self._bucket_name(scope["path"])
+        bucket = self.buckets.get(bucket_name) if bucket_name else None
+        if bucket is not None:
+            wait = bucket.take(client_address(scope, self.trust_forwarded), time.monotonic())
+            if wait > 0:
+                rejected_total.inc(f"rate_limit_{bucket_name}")
+                await self._reject(send, 429, wait, "リクエストが多すぎます。しばらくしてから再度お試しください")
+                return
+
+        if self.limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        reason = await self.limiter.acquire()
+        if reason is not None:
+            rejected_total.inc(reason)
+            await self._reject(send, 503, self.limiter.queue_timeout, "サーバーが混雑しています。しばらくしてから再度お試しください")
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.release()
+
+    @staticmethod
+    async def _reject(send, status: int, retry_after: float, detail: str):
+        body = ('{"detail":"' + detail + '"}').encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("ascii")),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode("ascii")),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
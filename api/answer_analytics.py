@@ -0,0 +1,241 @@
+"""
+回答の分析（種ごとの回答数・正答率・回答にかかった時間）
+
+回答ごとに種別の集計を更新するだけで、回答の履歴は保存しない
+- 回答時間は対数の区切り（相対誤差 ±2%）のヒストグラムで持ち、分位点はヒストグラムから求める（DDSketch と同じ考え方）
+  MIN_LATENCY〜MAX_LATENCY 秒の範囲を区切るため、種あたりの区切りは最大 ~350 個で、回答数によらない
+- 集計は足し合わせられるため、各ワーカーは前回のチェックポイント以降の差分だけをメモリに持ち、
+  ANALYTICS_CHECKPOINT_INTERVAL 秒ごとにファイル（aggregates.json）の集計へロックを取って足し込む
+- API はファイルの集計と自分の差分を合わせて返す（他のワーカーの差分は次のチェックポイントで反映される）
+"""
+
+import json
+import logging
+import math
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:
+    # Windows ではファイルロックを取らない（ワーカーは1つのため）
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# ヒストグラムの相対誤差
+RELATIVE_ACCURACY = 0.02
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+# 集計する回答時間の範囲（秒）。範囲外（日替わりチャレンジを翌日に回答した場合など）は回答時間を集計しない
+MIN_LATENCY = 0.1
+MAX_LATENCY = 600.0
+
+# 集計する種の数の上限
+MAX_SPECIES = 10000
+
+
+class LatencySketch:
+    """回答時間の対数ヒストグラム（区切りの番号 -> 件数）"""
+
+    __slots__ = ("buckets", "count", "total")
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds: float):
+        index = math.ceil(math.log(max(seconds, MIN_LATENCY)) / _LOG_GAMMA)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+
+    def merge(self, other: "LatencySketch"):
+        for index, n in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + n
+        self.count += other.count
+        self.total += other.total
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # 区切りの中央（相対誤差が最小になる値）
+                return 2 * _GAMMA ** index / (_GAMMA + 1)
+        return None
+
+    def to_dict(self) -> Dict:
+        return {"buckets": {str(i): n for i, n in self.buckets.items()}, "count": self.count, "total": self.total}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LatencySketch":
+        sketch = cls()
+        sketch.buckets = {int(i): n for i, n in data.get("buckets", {}).items()}
+        sketch.count = data.get("count", 0)
+        sketch.total = data.get("total", 0.0)
+        return sketch
+
+
+class SpeciesStats:
+    """1種の集計"""
+
+    __slots__ = ("answers", "correct", "latency")
+
+    def __init__(self):
+        self.answers = 0
+        self.correct = 0
+        self.latency = LatencySketch()
+
+    def merge(self, other: "SpeciesStats"):
+        self.answers += other.answers
+        self.correct += other.correct
+        self.latency.merge(other.latency)
+
+    def to_dict(self) -> Dict:
+        return {"answers": self.answers, "correct": self.correct, "latency": self.latency.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "SpeciesStats":
+        stats = cls()
+        stats.answers = data.get("answers", 0)
+        stats.correct = data.get("correct", 0)
+        stats.latency = LatencySketch.from_dict(data.get("latency", {}))
+        return stats
+
+
+def _merge_into(target: Dict[str, SpeciesStats], source: Dict[str, SpeciesStats]):
+    for species, stats in source.items():
+        if species not in target:
+            if len(target) >= MAX_SPECIES:
+                continue
+            target[species] = SpeciesStats()
+        target[species].merge(stats)
+
+
+class AnswerAnalytics:
+    """種ごとの回答の集計（差分をメモリに持ち、定期的にファイルへ足し込む）"""
+
+    def __init__(self, data_dir: Path, checkpoint_interval: float = 60.0):
+        self.data_dir = data_dir
+        self.path = data_dir / "aggregates.json"
+        self.lock_path = data_dir / "aggregates.lock"
+        self.checkpoint_interval = checkpoint_interval
+        # 前回のチェックポイント以降の差分
+        self._delta: Dict[str, SpeciesStats] = {}
+        # ファイルの集計（更新時刻が変わったら読み直す）
+        self._base: Dict[str, SpeciesStats] = {}
+        self._base_mtime: Optional[float] = None
+        self._checkpointed_at: Optional[float] = None
+        self._last_checkpoint = time.monotonic()
+
+    def record(self, species: str, is_correct: bool, latency: Optional[float] = None):
+        """1件の回答を集計する（回答時間が範囲外・不明なら回答数と正誤のみ）"""
+        stats = self._delta.get(species)
+        if stats is None:
+            if len(self._delta) >= MAX_SPECIES:
+                return
+            stats = self._delta[species] = SpeciesStats()
+        stats.answers += 1
+        if is_correct:
+            stats.correct += 1
+        if latency is not None and 0 <= latency <= MAX_LATENCY:
+            stats.latency.add(latency)
+
+    def _read(self) -> Dict[str, SpeciesStats]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        self._checkpointed_at = data.get("updated_at")
+        return {species: SpeciesStats.from_dict(stats) for species, stats in data.get("species", {}).items()}
+
+    def _refresh_base(self):
+        try:
+            mtime = self.path.stat().st_mtime
+        except FileNotFoundError:
+            return
+        if mtime != self._base_mtime:
+            try:
+                self._base = self._read()
+                self._base_mtime = mtime
+            except (OSError, ValueError) as e:
+                logger.warning("failed to read answer analytics", extra={"error": str(e)})
+
+    def checkpoint_due(self) -> bool:
+        return time.monotonic() - self._last_checkpoint >= self.checkpoint_interval
+
+    def take_delta(self) -> Dict[str, SpeciesStats]:
+        """チェックポイントで書き込む差分（書き込みは別スレッドで行えるよう、ここで取り出す）"""
+        self._last_checkpoint = time.monotonic()
+        delta, self._delta = self._delta, {}
+        return delta
+
+    def write_checkpoint(self, delta: Dict[str, SpeciesStats]):
+        """ファイルの集計に差分を足し込む（他のワーカーと同時に書き込まないようロックを取る）"""
+        if not delta:
+            return
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            merged = self._read()
+            _merge_into(merged, delta)
+            updated_at = time.time()
+            tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"updated_at": updated_at,
+                           "species": {species: stats.to_dict() for species, stats in merged.items()}},
+                          f, ensure_ascii=False, separators=(",", ":"))
+            tmp.replace(self.path)
+        self._base = merged
+        self._base_mtime = self.path.stat().st_mtime
+        self._checkpointed_at = updated_at
+
+    def species_stats(self) -> Dict[str, SpeciesStats]:
+        """ファイルの集計と自分の差分を合わせたもの"""
+        self._refresh_base()
+        combined: Dict[str, SpeciesStats] = {}
+        _merge_into(combined, self._base)
+        _merge_into(combined, self._delta)
+        return combined
+
+    def summary(self, min_answers: int = 1, limit: int = 50) -> Dict:
+        """正答率の低い順（難しい順）の種ごとの集計"""
+        combined = self.species_stats()
+        rows: List[Dict] = []
+        for species, stats in combined.items():
+            if stats.answers < min_answers:
+                continue
+            latency = stats.latency
+            rows.append({
+                "species_name": species,
+                "answers": stats.answers,
+                "correct": stats.correct,
+                "accuracy": round(stats.correct / stats.answers, 4),
+                "response_time": {
+                    "count": latency.count,
+                    "mean": round(latency.total / latency.count, 2) if latency.count else None,
+                    "p50": _round(latency.quantile(0.5)),
+                    "p90": _round(latency.quantile(0.9)),
+                },
+            })
+        rows.sort(key=lambda r: (r["accuracy"], -r["answers"]))
+        return {
+            "species": rows[:limit],
+            "species_count": len(rows),
+            "total_answers": sum(stats.answers for stats in combined.values()),
+            "checkpointed_at": self._checkpointed_at,
+        }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 2) if value is not None else None
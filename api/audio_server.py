@@ -0,0 +1,341 @@
+"""
+音声ファイルの配信（/audio）
+StaticFiles はリクエストのたびにファイルを開いて stat し、Pythonで読み込んでいるため、
+カタログの録音について起動時に一度だけ以下を用意しておく
+
+- ファイルディスクリプタ（fork したワーカーにも引き継がれる）
+- レスポンスヘッダー（Content-Type / Content-Length / ETag / Last-Modified）
+- 小さいファイルの内容（合計 AUDIO_CACHE_BYTES までのLRUキャッシュ）
+
+キャッシュにないファイルは、サーバーが ASGI の zerocopy 拡張に対応していれば sendfile で、
+対応していなければスレッドプールで os.pread したチャンクを送る（イベントループでは読み込まない）
+Range リクエスト（シーク再生）と If-None-Match にも対応する
+
+ファイルは保存先（api/storage.py）から読む。S3互換の保存先でディスクキャッシュにないファイルは、
+必要な範囲をリモートから読みながら送り、裏でディスクキャッシュに取得しておく
+ディスクキャッシュのファイルは削除されることがあるため、ディスクリプタを開いたままにせずリクエストごとに開く
+"""
+
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+from collections import OrderedDict
+from email.utils import formatdate
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from api.storage import LocalStorage
+
+logger = logging.getLogger(__name__)
+
+# キャッシュの対象にするファイルの上限（バイト）
+DEFAULT_SMALL_FILE_LIMIT = 1024 * 1024
+# キャッシュ全体の上限（バイト）
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+# キャッシュにないファイルを送るときの1回の読み込みサイズ
+CHUNK_SIZE = 256 * 1024
+# 起動時に開いておくファイル数の上限（超えた分はリクエストごとに開く）
+DEFAULT_MAX_OPEN_FILES = 512
+
+ZEROCOPY_EXTENSION = "http.response.zerocopy"
+
+
+class _AudioFile:
+    """1ファイル分の事前計算した情報"""
+
+    __slots__ = ("name", "size", "headers", "etag", "fd")
+
+    def __init__(self, name: str, size: int, headers: List[Tuple[bytes, bytes]], etag: bytes):
+        self.name = name
+        self.size = size
+        self.headers = headers
+        self.etag = etag
+        self.fd: Optional[int] = None
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Range ヘッダー（単一範囲のみ）を (開始, 終了+1) にする
+    複数範囲や解釈できない値は None（全体を返す）、範囲外は ValueError
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_s, _, end_s = spec.strip().partition("-")
+    try:
+        if not start_s:
+            # bytes=-500: 末尾500バイト
+            length = int(end_s)
+            if length <= 0:
+                raise ValueError(header)
+            return max(0, size - length), size
+        start = int(start_s)
+        end = int(end_s) + 1 if end_s else size
+    except ValueError:
+        return None
+    if start >= size or end <= start:
+        raise ValueError(header)
+    return start, min(end, size)
+
+
+class AudioServer:
+    """カタログの録音を配信するASGIアプリ（/audio にマウントする。/visuals の画像・波形の配信にも使う）"""
+
+    def __init__(self, storage, filenames: Iterable[str],
+                 small_file_limit: int = DEFAULT_SMALL_FILE_LIMIT,
+                 cache_bytes: int = DEFAULT_CACHE_BYTES,
+                 max_open_files: int = DEFAULT_MAX_OPEN_FILES,
+                 cache_control: Optional[str] = None):
+        self.storage = storage
+        self.small_file_limit = small_file_limit
+        self.cache_bytes = cache_bytes
+        self.max_open_files = max_open_files
+        self.files: Dict[str, _AudioFile] = {}
+        self._cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._cached_bytes = 0
+        self._open_files = 0
+        self._background_fetches = set()
+
+        # 保存先の一覧を1回だけ取得する（S3互換ならファイルごとに問い合わせない）
+        listing = storage.list()
+        for name in dict.fromkeys(filenames):
+            info = listing.get(name)
+            if info is None:
+                continue
+            media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            etag = ('"' + hashlib.md5(f"{info.mtime}-{info.size}".encode()).hexdigest() + '"').encode("ascii")
+            headers = [
+                (b"content-type", media_type.encode("ascii")),
+                (b"accept-ranges", b"bytes"),
+                (b"etag", etag),
+                (b"last-modified", formatdate(info.mtime, usegmt=True).encode("ascii")),
+            ]
+            if cache_control:
+                headers.append((b"cache-control", cache_control.encode("ascii")))
+            self.files[name] = _AudioFile(name, info.size, headers, etag)
+
+        for audio in self.files.values():
+            if self._open_files >= max_open_files:
+                break
+            self._open_local(audio)
+
+    @classmethod
+    def from_env(cls, storage, filenames: Iterable[str]) -> "AudioServer":
+        return cls(
+            storage,
+            filenames,
+            small_file_limit=int(os.environ.get("AUDIO_SMALL_FILE_LIMIT", DEFAULT_SMALL_FILE_LIMIT)),
+            cache_bytes=int(os.environ.get("AUDIO_CACHE_BYTES", DEFAULT_CACHE_BYTES)),
+            max_open_files=int(os.environ.get("AUDIO_MAX_OPEN_FILES", DEFAULT_MAX_OPEN_FILES)),
+        )
+
+    def preload(self):
+        """
+        ローカルで読めるファイルを、小さいものから順にキャッシュの上限まで読み込む
+        fork 前に呼ぶと、読み込んだ内容はワーカー間で共有される
+        """
+        for name, audio in sorted(self.files.items(), key=lambda item: item[1].size):
+            if audio.size > self.small_file_limit or self._cached_bytes + audio.size > self.cache_bytes:
+                break
+            if audio.fd is None and self.storage.local_path(name) is None:
+                continue
+            try:
+                self._put_cache(name, self._read(audio, 0, audio.size))
+            except OSError:
+                continue
+
+    @property
+    def cached_bytes(self) -> int:
+        return self._cached_bytes
+
+    def close(self):
+        for audio in self.files.values():
+            if audio.fd is not None:
+                os.close(audio.fd)
+                audio.fd = None
+        self._open_files = 0
+        self._cache.clear()
+        self._cached_bytes = 0
+
+    # ------------------------------------------------------------------
+    # 読み込み
+    # ------------------------------------------------------------------
+
+    def _open_local(self, audio: _AudioFile):
+        """
+        ローカルの保存先のファイルならディスクリプタを開いておく（開いているファイル数の上限まで）
+        ディスクキャッシュのファイルは開いたままにすると削除してもディスクが空かないため、開いておかない
+        """
+        if audio.fd is not None or self._open_files >= self.max_open_files or not isinstance(self.storage, LocalStorage):
+            return
+        path = self.storage.local_path(audio.name)
+        if path is None:
+            return
+        try:
+            audio.fd = os.open(path, os.O_RDONLY)
+            self._open_files += 1
+        except OSError as e:
+            logger.warning("failed to open audio file", extra={"path": str(path), "error": str(e)})
+
+    def _open_for_request(self, audio: _AudioFile) -> Optional[int]:
+        """開いておいていないファイルを、ローカルで読めればこのリクエストのために開く（呼び出し側で閉じる）"""
+        path = self.storage.local_path(audio.name)
+        if path is None:
+            return None
+        try:
+            return os.open(path, os.O_RDONLY)
+        except OSError:
+            # 他のワーカーがディスクキャッシュから削除した
+            return None
+
+    def _read(self, audio: _AudioFile, offset: int, length: int) -> bytes:
+        if audio.fd is not None:
+            return os.pread(audio.fd, length, offset)
+        return b"".join(self.storage.read_range(audio.name, offset, offset + length))
+
+    def _fetch_in_background(self, name: str):
+        """ディスクキャッシュのある保存先なら、裏でファイル全体を取得しておく"""
+        fetch = getattr(self.storage, "fetch", None)
+        if fetch is None or isinstance(self.storage, LocalStorage) or name in self._background_fetches:
+            return
+        self._background_fetches.add(name)
+
+        def run():
+            try:
+                fetch(name)
+            except Exception as e:
+                logger.warning("failed to fetch audio file", extra={"file": name, "error": str(e)})
+
+        future = asyncio.get_running_loop().run_in_executor(None, run)
+        future.add_done_callback(lambda _: self._background_fetches.discard(name))
+
+    def _put_cache(self, name: str, data: bytes):
+        if len(data) > self.small_file_limit:
+            return
+        while self._cache and self._cached_bytes + len(data) > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+        if self._cached_bytes + len(data) <= self.cache_bytes:
+            self._cache[name] = data
+            self._cached_bytes += len(data)
+
+    async def _cached_content(self, name: str, audio: _AudioFile) -> Optional[bytes]:
+        """キャッシュ対象のファイルならキャッシュから（なければ読み込んで追加して）返す"""
+        data = self._cache.get(name)
+        if data is not None:
+            self._cache.move_to_end(name)
+            return data
+        if audio.size > self.small_file_limit or audio.size > self.cache_bytes:
+            return None
+        data = await asyncio.to_thread(self._read, audio, 0, audio.size)
+        if len(data) != audio.size:
+            # 起動後にファイルが差し替えられた
+            return None
+        self._put_cache(name, data)
+        return data
+
+    # ------------------------------------------------------------------
+    # ASGI
+    # ------------------------------------------------------------------
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        if scope["method"] not in ("GET", "HEAD"):
+            await self._send_status(send, 405, [(b"allow", b"GET, HEAD")])
+            return
+
+        name = scope["path"].rpartition("/")[2]
+        audio = self.files.get(name)
+        if audio is None:
+            await self._send_status(send, 404)
+            return
+
+        request_headers = dict(scope.get("headers", ()))
+        if_none_match = request_headers.get(b"if-none-match")
+        if if_none_match and audio.etag in [t.strip() for t in if_none_match.split(b",")]:
+            await self._send_status(send, 304, audio.headers)
+            return
+
+        status = 200
+        start, end = 0, audio.size
+        extra_headers: List[Tuple[bytes, bytes]] = []
+        range_header = request_headers.get(b"range")
+        if range_header:
+            try:
+                byte_range = parse_range(range_header.decode("latin-1"), audio.size)
+            except ValueError:
+                await self._send_status(send, 416, [(b"content-range", f"bytes */{audio.size}".encode("ascii"))])
+                return
+            if byte_range is not None:
+                start, end = byte_range
+                status = 206
+                extra_headers.append((b"content-range", f"bytes {start}-{end - 1}/{audio.size}".encode("ascii")))
+
+        headers = audio.headers + extra_headers + [(b"content-length", str(end - start).encode("ascii"))]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        if scope["method"] == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        data = await self._cached_content(name, audio)
+        if data is not None:
+            await send({"type": "http.response.body", "body": data[start:end] if status == 206 else data})
+            return
+
+        if audio.fd is not None:
+            await self._send_file(scope, send, audio.fd, start, end)
+            return
+
+        # ディスクキャッシュにあるファイル・開いておく上限を超えたファイルは、送り終わったら閉じる
+        fd = self._open_for_request(audio)
+        if fd is None:
+            await self._send_remote(send, audio, start, end)
+            return
+        try:
+            await self._send_file(scope, send, fd, start, end)
+        finally:
+            os.close(fd)
+
+    async def _send_file(self, scope, send, fd: int, start: int, end: int):
+        """ディスクリプタから範囲を送る（zerocopy 拡張があれば sendfile）"""
+        if ZEROCOPY_EXTENSION in (scope.get("extensions") or {}):
+            # ディスクリプタを閉じないファイルオブジェクトとして渡す
+            with open(fd, "rb", closefd=False) as f:
+                await send({"type": ZEROCOPY_EXTENSION, "file": f, "offset": start, "count": end - start})
+            return
+
+        offset = start
+        while offset < end:
+            chunk = await asyncio.to_thread(os.pread, fd, min(CHUNK_SIZE, end - offset), offset)
+            if not chunk:
+                break
+            offset += len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": offset < end})
+        if offset < end:
+            # ファイルが途中で短くなった場合も応答を終わらせる
+            await send({"type": "http.response.body", "body": b""})
+
+    async def _send_remote(self, send, audio: _AudioFile, start: int, end: int):
+        """ローカルにないファイルの範囲を、保存先から読みながら送る"""
+        self._fetch_in_background(audio.name)
+        chunks = self.storage.read_range(audio.name, start, end)
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        finally:
+            try:
+                chunks.close()
+            except ValueError:
+                # 切断時、スレッドで読み込み中のチャンクは読み終わったあとに捨てられる
+                pass
+        await send({"type": "http.response.body", "body": b""})
+
+    @staticmethod
+    async def _send_status(send, status: int, headers: Optional[List[Tuple[bytes, bytes]]] = None):
+        await send({"type": "http.response.start", "status": status, "headers": headers or []})
+        await send({"type": "http.response.body", "body": b""})
@@ -0,0 +1,126 @@
+"""
+目録・Suntory・Bird Research・soundフォルダの録音を1つのカタログファイルにまとめるスクリプト
+出力: birdVoiceSearch/catalog.arrow（Streamlitアプリ・APIの両方が読み込む。環境変数 CATALOG_PATH で変更可）
+
+事前に以下を実行しておくこと
+  python api/parse_mokuroku.py
+  python api/parse_sound_files.py
+"""
+
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+import pandas as pd
+
+# `python api/build_catalog.py` として実行しても api パッケージを参照できるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from api.catalog import Catalog, normalize_name, sound_file_record, write_catalog
+
+
+def _none_if_na(value):
+    """pandasの欠損値をNoneに変換"""
+    return None if pd.isna(value) else value
+
+
+def build_records(
+    mokuroku: pd.DataFrame,
+    suntory: pd.DataFrame,
+    bird_research: pd.DataFrame,
+    mokuroku_parsed: List[Dict],
+    sound_files: Dict,
+) -> List[Dict]:
+    """各データソースをカタログのレコードに変換"""
+    # 目録（解析済み）から分類情報を引けるようにする
+    taxonomy: Dict[str, Dict] = {}
+    for bird in mokuroku_parsed:
+        key = normalize_name(bird['japanese_name'])
+        # 種の情報を亜種より優先する
+        if key not in taxonomy or not bird.get('is_subspecies', False):
+            taxonomy[key] = bird
+
+    records: List[Dict] = []
+
+    for row in mokuroku.itertuples(index=False):
+        name = row.種名
+        bird = taxonomy.get(normalize_name(name), {})
+        records.append({
+            "japanese_name": name,
+            "source": "mokuroku",
+            "scientific_name": row.学名,
+            "genus": bird.get('genus'),
+            "genus_jp": bird.get('genus_jp'),
+            "family": bird.get('family'),
+            "family_jp": bird.get('family_jp'),
+            "order": bird.get('order'),
+            "order_jp": bird.get('order_jp'),
+            "is_subspecies": bird.get('is_subspecies'),
+        })
+
+    for row in suntory.itertuples(index=False):
+        records.append({
+            "japanese_name": row.名前,
+            "source": "suntory",
+            "page_url": _none_if_na(row.URL),
+            "has_call": bool(row.地鳴き),
+            "has_song": bool(row.さえずり),
+        })
+
+    for row in bird_research.itertuples(index=False):
+        records.append({
+            "japanese_name": row.名前,
+            "source": "bird_research",
+            "voice_type": _none_if_na(row.種類),
+            "recorded_on": _none_if_na(row.日付),
+            "location": _none_if_na(row.場所),
+            "file_url": _none_if_na(row.ファイルURL),
+        })
+
+    for f in sound_files.get('success', []):
+        records.append(sound_file_record(f))
+
+    return records
+
+
+def build_species_names(mokuroku: pd.DataFrame, suntory: pd.DataFrame, bird_research: pd.DataFrame) -> List[str]:
+    """選択肢に表示する種名一覧（目録 → Suntory → Bird Research の順で重複を除く）"""
+    all_names = pd.concat([mokuroku["種名"], suntory["名前"], bird_research["名前"]])
+    return [str(name) for name in all_names.unique()]
+
+
+def main():
+    """メイン処理"""
+    base_dir = Path(__file__).resolve().parent.parent
+    data_dir = base_dir / "birdVoiceSearch"
+    output_path = Path(os.environ.get("CATALOG_PATH", data_dir / "catalog.arrow"))
+
+    print(f"Data directory: {data_dir}")
+    print(f"Output: {output_path}")
+    print()
+
+    mokuroku = pd.read_pickle(data_dir / "mokuroku.pickle")
+    suntory = pd.read_pickle(data_dir / "output_suntory.pickle")
+    bird_research = pd.read_pickle(data_dir / "output_bird_research.pickle")
+    with open(data_dir / "mokuroku_parsed.json", 'r', encoding='utf-8') as f:
+        mokuroku_parsed = json.load(f)
+    with open(base_dir / "api" / "sound_files.json", 'r', encoding='utf-8') as f:
+        sound_files = json.load(f)
+
+    records = build_records(mokuroku, suntory, bird_research, mokuroku_parsed, sound_files)
+    species_names = build_species_names(mokuroku, suntory, bird_research)
+    write_catalog(records, species_names, output_path)
+
+    catalog = Catalog.open(output_path)
+    print(f"レコード数: {catalog.table.num_rows}")
+    for source in ["mokuroku", "suntory", "bird_research", "sound"]:
+        print(f"  - {source}: {len(catalog.rows(source))}件")
+    print(f"種名一覧: {len(catalog.species_names)}件")
+    print(f"出題可能な鳥: {len(catalog.available_birds)}種")
+    print(f"\n結果を保存しました: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+録音の音響フィンガープリント（api/fingerprint.py）を作り、同じ録音の重複と種名の付け間違いを検出するスクリプト
+出力: data/fingerprints/（index.npz / files.json / report.json）
+
+- 追加・内容が変わった録音だけを読み込んでフィンガープリントを作り、索引の全録音と照合する（--all で全録音を照合し直す）
+  内容が同じ録音（名前の変更・コピー）は以前のフィンガープリントを使う
+- 検出した組（report.json）
+    near_duplicate 同じ種で音が一致（コピー・ノイズ除去・音量の変更・切り出しなど）
+    cross_species  別の種で音が一致（どちらかの種名の付け間違いの疑い）
+  内容がまったく同じ（content_hash が一致）組は identical を true にする
+- 変更のない録音同士の組は前回の report.json から引き継ぐ
+MP3 などの読み込みには ffmpeg が必要（build_visuals.py と同じ）
+
+事前に以下を実行しておくこと
+  python api/parse_sound_files.py
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+# `python api/build_fingerprints.py` として実行しても api パッケージを参照できるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from api.build_visuals import decode_audio
+from api.fingerprint import FingerprintIndex, fingerprint
+from api.storage import open_storage
+
+REPORT_NAME = "report.json"
+# 重複とみなす一致数（関係のない録音同士の一致数は、2,000件の総当たりで最大3件）
+MIN_MATCHES = 10
+# 一致数が偶然の一致の期待値（照合結果の background）の何倍以上なら重複とみなすか
+# 長い録音・同じ節を繰り返す録音はハッシュが多く一致し、時刻差が揃わなくても一致数が増えるため、その分を除く
+# 関係のない録音は期待値の数倍程度、加工したコピーは数百倍になる
+# 類似度（一致数 / 短い方のハッシュ数）は雑音を加えたコピーで0.05程度まで下がるため、判定に使わない
+MIN_BACKGROUND_RATIO = 20
+
+
+def _identical(a: Dict, b: Dict) -> bool:
+    return bool(a.get('content_hash')) and a.get('content_hash') == b.get('content_hash')
+
+
+def is_duplicate(match: Dict) -> bool:
+    """照合結果（FingerprintIndex.query）の録音が同じ録音を加工したものか"""
+    return match['matches'] >= MIN_MATCHES and match['matches'] >= MIN_BACKGROUND_RATIO * match['background']
+
+
+def _read_report(data_dir: Path) -> List[Dict]:
+    try:
+        with open(data_dir / REPORT_NAME, "r", encoding="utf-8") as f:
+            return json.load(f).get("pairs", [])
+    except (OSError, ValueError):
+        return []
+
+
+def build_index(sound_files: List[Dict], storage, previous: FingerprintIndex) -> Tuple[FingerprintIndex, Set[str]]:
+    """sound_files の索引を作る（(索引, フィンガープリントを作り直した録音) を返す）"""
+    reusable = {}
+    for number, entry in enumerate(previous.files):
+        if entry.get('content_hash'):
+            reusable[entry['content_hash']] = previous.fingerprint_of(number)
+    index = FingerprintIndex()
+    changed: Set[str] = set()
+    failed = 0
+    for f in sound_files:
+        filename = f['filename']
+        entry = {'filename': filename, 'content_hash': f.get('content_hash'), 'bird_name': f['bird_name']}
+        old = previous.get(filename)
+        if f.get('content_hash') and f['content_hash'] in reusable:
+            hashes, times = reusable[f['content_hash']]
+            if old is None or previous.files[old].get('content_hash') != f['content_hash']:
+                changed.add(filename)
+            index.add(entry, hashes, times)
+            continue
+        started = time.perf_counter()
+        try:
+            hashes, times = fingerprint(decode_audio(storage.fetch(filename)))
+        except (RuntimeError, OSError, ValueError, subprocess.CalledProcessError) as e:
+            print(f"  ✗ {filename}: {e}")
+            failed += 1
+            continue
+        print(f"  + {filename}: {len(hashes)}件のハッシュ（{(time.perf_counter() - started) * 1000:.0f}ms）")
+        index.add(entry, hashes, times)
+        changed.add(filename)
+    index.build()
+    print(f"録音: {len(index)}件 / 作成・変更: {len(changed)}件 / 失敗: {failed}件")
+    return index, changed
+
+
+def find_pairs(index: FingerprintIndex, targets: Set[str]) -> List[Dict]:
+    """targets の録音を索引の他の録音と照合し、一致した組を返す"""
+    pairs: Dict[Tuple[str, str], Dict] = {}
+    started = time.perf_counter()
+    for filename in sorted(targets):
+        number = index.get(filename)
+        if number is None:
+            continue
+        hashes, times = index.fingerprint_of(number)
+        for match in index.query(hashes, times, exclude=number):
+            other = index.files[match['number']]
+            identical = _identical(index.files[number], other)
+            if not identical and not is_duplicate(match):
+                continue
+            key = tuple(sorted((filename, other['filename'])))
+            if key in pairs:
+                continue
+            a, b = (index.files[index.get(name)] for name in key)
+            pairs[key] = {
+                "kind": "near_duplicate" if a['bird_name'] == b['bird_name'] else "cross_species",
+                "identical": identical,
+                "files": list(key),
+                "bird_names": [a['bird_name'], b['bird_name']],
+                "matches": match['matches'],
+                "similarity": match['similarity'],
+                "background": match['background'],
+                "offset_seconds": match['offset_seconds'] if key[0] == filename else -match['offset_seconds'],
+            }
+    if targets:
+        elapsed = time.perf_counter() - started
+        print(f"照合: {len(targets)}件（1件あたり {elapsed / len(targets) * 1000:.1f}ms）")
+    return list(pairs.values())
+
+
+def build_report(sound_files: List[Dict], storage, data_dir: Path, check_all: bool = False) -> List[Dict]:
+    """索引を更新し、検出した組を report.json に書く"""
+    previous = FingerprintIndex.load(data_dir)
+    index, changed = build_index(sound_files, storage, previous)
+    targets = {f['filename'] for f in index.files} if check_all else changed
+
+    # 変更のない録音同士の組は前回の結果を使う
+    pairs = []
+    if not check_all:
+        for pair in _read_report(data_dir):
+            if all(index.get(name) is not None and name not in changed for name in pair["files"]):
+                pairs.append(pair)
+    pairs += find_pairs(index, targets)
+    pairs.sort(key=lambda p: (p["kind"] != "cross_species", p["files"]))
+
+    index.save(data_dir)
+    with open(data_dir / REPORT_NAME, "w", encoding="utf-8") as f:
+        json.dump({"files": len(index), "pairs": pairs}, f, ensure_ascii=False, indent=1)
+    return pairs
+
+
+def main():
+    """メイン処理"""
+    base_dir = Path(__file__).resolve().parent.parent
+    parser = argparse.ArgumentParser(description="録音の重複・種名の付け間違いの検出")
+    parser.add_argument("--sound-files", type=Path, default=base_dir / "api" / "sound_files.json")
+    parser.add_argument("--all", action="store_true", help="変更のない録音も照合し直す")
+    parser.add_argument("--strict", action="store_true", help="別の種で一致した組があれば終了コード1で終わる")
+    args = parser.parse_args()
+
+    storage = open_storage(base_dir / "sound", base_dir / "data" / "audio_cache")
+    data_dir = Path(os.environ.get("FINGERPRINTS_DIR", base_dir / "data" / "fingerprints"))
+
+    print(f"Sound files: {args.sound_files}")
+    print(f"Sound storage: {storage}")
+    print(f"Output: {data_dir}")
+    print()
+
+    with open(args.sound_files, "r", encoding="utf-8") as f:
+        sound_files = json.load(f).get('success', [])
+    pairs = build_report(sound_files, storage, data_dir, check_all=args.all)
+
+    labels = {"cross_species": "別の種で一致", "near_duplicate": "同じ種で一致"}
+    print()
+    print(f"検出: {len(pairs)}組")
+    for pair in pairs:
+        a, b = pair["files"]
+        identical = "・内容が同じ" if pair["identical"] else ""
+        print(f"  [{labels[pair['kind']]}{identical}] {a}（{pair['bird_names'][0]}） / {b}（{pair['bird_names'][1]}）"
+              f" 一致 {pair['matches']}件・類似度 {pair['similarity']:.2f}・ずれ {pair['offset_seconds']}秒")
+    if args.strict and any(p["kind"] == "cross_species" for p in pairs):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
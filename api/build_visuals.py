@@ -0,0 +1,147 @@
+"""
+カタログの録音ごとにスペクトログラム画像と波形データを作るスクリプト
+出力: visuals/（<hash>.png / <hash>.json と manifest.json）
+
+内容が変わっていない録音（ハッシュが同じ）は作り直さない
+MP3 などの読み込みには ffmpeg が必要（WAV は標準ライブラリで読み込む）
+録音は音声の保存先（api/storage.py）から読む。S3互換の場合はディスクキャッシュに取得してから読み込む
+
+事前に以下を実行しておくこと
+  python api/build_catalog.py
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import wave
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+
+# `python api/build_visuals.py` として実行しても api パッケージを参照できるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from api.catalog import Catalog
+from api.storage import open_storage
+from api.visuals import (
+    MANIFEST_NAME, SAMPLE_RATE, content_hash, encode_png, read_manifest, spectrogram, waveform_peaks, write_manifest,
+)
+
+
+def _read_wav(path: Path) -> np.ndarray:
+    """PCMのWAVをモノラル・SAMPLE_RATE の float32 にする（周波数の変換は線形補間）"""
+    with wave.open(str(path), "rb") as w:
+        width, channels, rate = w.getsampwidth(), w.getnchannels(), w.getframerate()
+        raw = w.readframes(w.getnframes())
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 3:
+        bytes_ = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        ints = (bytes_[:, 0].astype(np.int32) | (bytes_[:, 1].astype(np.int32) << 8)
+                | (bytes_[:, 2].astype(np.int8).astype(np.int32) << 16))
+        samples = ints.astype(np.float32) / (1 << 23)
+    else:
+        dtype = {2: np.int16, 4: np.int32}[width]
+        samples = np.frombuffer(raw, dtype=dtype).astype(np.float32) / np.iinfo(dtype).max
+    samples = samples.reshape(-1, channels).mean(axis=1)
+    if rate != SAMPLE_RATE:
+        positions = np.arange(0, len(samples), rate / SAMPLE_RATE)
+        samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+    return samples
+
+
+def _read_with_ffmpeg(path: Path) -> np.ndarray:
+    result = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", str(path), "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "f32le", "-"],
+        capture_output=True, check=True,
+    )
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
+def decode_audio(path: Path) -> np.ndarray:
+    """録音をモノラル・SAMPLE_RATE の float32 にする"""
+    if path.suffix.lower() == ".wav":
+        try:
+            return _read_wav(path)
+        except (wave.Error, KeyError):
+            pass
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("ffmpeg が見つかりません")
+    return _read_with_ffmpeg(path)
+
+
+def render(audio_path: Path, visuals_dir: Path, digest: str) -> Dict:
+    """1つの録音のスペクトログラムと波形を書き出し、マニフェストの項目を返す"""
+    samples = decode_audio(audio_path)
+    png_name = f"{digest}.png"
+    peaks_name = f"{digest}.json"
+    (visuals_dir / png_name).write_bytes(encode_png(spectrogram(samples)))
+    with open(visuals_dir / peaks_name, "w", encoding="utf-8") as f:
+        json.dump(waveform_peaks(samples), f, separators=(",", ":"))
+    return {
+        "hash": digest,
+        "spectrogram": png_name,
+        "peaks": peaks_name,
+        "duration": round(len(samples) / SAMPLE_RATE, 2),
+    }
+
+
+def build_visuals(catalog: Catalog, storage, visuals_dir: Path) -> Dict[str, Dict]:
+    """カタログの録音のうち、未作成・内容が変わったものだけを作る"""
+    visuals_dir.mkdir(parents=True, exist_ok=True)
+    previous = read_manifest(visuals_dir)
+    files: Dict[str, Dict] = {}
+    rendered = skipped = failed = 0
+
+    for f in catalog.sound_files:
+        filename = f['filename']
+        try:
+            audio_path = storage.fetch(filename)
+        except FileNotFoundError:
+            continue
+        digest = content_hash(audio_path)
+        entry = previous.get(filename)
+        if (entry and entry.get("hash") == digest
+                and (visuals_dir / entry["spectrogram"]).exists() and (visuals_dir / entry["peaks"]).exists()):
+            files[filename] = entry
+            skipped += 1
+            continue
+        try:
+            files[filename] = render(audio_path, visuals_dir, digest)
+            rendered += 1
+        except (RuntimeError, OSError, ValueError, subprocess.CalledProcessError) as e:
+            print(f"  ✗ {filename}: {e}")
+            failed += 1
+
+    # マニフェストから外れた古いファイルを削除する
+    keep = {name for entry in files.values() for name in (entry["spectrogram"], entry["peaks"])}
+    for path in visuals_dir.iterdir():
+        if path.suffix in (".png", ".json") and path.name not in keep and path.name != MANIFEST_NAME:
+            path.unlink()
+
+    write_manifest(visuals_dir, files)
+    print(f"作成: {rendered}件 / 変更なし: {skipped}件 / 失敗: {failed}件")
+    return files
+
+
+def main():
+    """メイン処理"""
+    base_dir = Path(__file__).resolve().parent.parent
+    catalog_path = Path(os.environ.get("CATALOG_PATH", base_dir / "birdVoiceSearch" / "catalog.arrow"))
+    storage = open_storage(base_dir / "sound", base_dir / "data" / "audio_cache")
+    visuals_dir = Path(os.environ.get("VISUALS_DIR", base_dir / "visuals"))
+
+    print(f"Catalog: {catalog_path}")
+    print(f"Sound storage: {storage}")
+    print(f"Output: {visuals_dir}")
+    print()
+
+    catalog = Catalog.open(catalog_path)
+    build_visuals(catalog, storage, visuals_dir)
+
+
+if __name__ == "__main__":
+    main()
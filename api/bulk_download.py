@@ -0,0 +1,207 @@
+"""
+複数の録音ファイルを1つのZIPにまとめてストリーミング配信するモジュール
+録音の取得は並列数を制限したスレッドプールで行い、取得できたものから順にZIPへ書き込む
+ZIP全体をメモリに保持したり、共有ファイルに書き出したりはしない
+"""
+
+import tempfile
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Tuple, Union
+from urllib.parse import unquote, urlparse
+
+import requests
+
+# ダウンロードを許可する外部ホスト（任意URLの取得によるSSRFを防ぐ）
+ALLOWED_REMOTE_HOSTS = {
+    "xeno-canto.org",
+    "www.xeno-canto.org",
+    "bird-research.jp",
+    "www.bird-research.jp",
+}
+
+# 同時に取得する録音の最大数
+DEFAULT_MAX_WORKERS = 4
+# 1回のZIPに含められる録音の最大数
+MAX_BULK_FILES = 100
+# 読み書きの単位
+CHUNK_SIZE = 64 * 1024
+# 取得中の録音1件あたりのメモリ上限（超えた分はプライベートな一時ファイルに退避）
+SPOOL_MAX_MEMORY = 1024 * 1024
+# 外部ホストへのリクエストのタイムアウト（秒）
+REMOTE_TIMEOUT = 30
+
+# (ZIP内のファイル名, 取得元) の組
+# 取得元はローカルのPath、http(s)のURL、またはファイルを開く関数（音声の保存先から読む場合）
+ZipSource = Tuple[str, Union[Path, str, Callable[[], BinaryIO]]]
+
+
+class _ZipSink:
+    """
+    zipfileの書き込み先
+    シーク不可のストリームとして振る舞い、書き込まれたバイト列を取り出されるまで保持する
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def is_allowed_url(url: str) -> bool:
+    """ダウンロードを許可するURLかどうか"""
+    parsed = urlparse(url)
+    return parsed.scheme in ("http", "https") and parsed.hostname in ALLOWED_REMOTE_HOSTS
+
+
+def arcname_from_url(url: str) -> str:
+    """URLからZIP内のファイル名を決める"""
+    path = urlparse(url).path.rstrip("/")
+    segments = [unquote(s) for s in path.split("/") if s]
+    if not segments:
+        return "recording.mp3"
+    # xeno-cantoは /<XC番号>/download の形式
+    if segments[-1] == "download" and len(segments) >= 2:
+        return f"XC{segments[-2]}.mp3"
+    return segments[-1]
+
+
+def _fetch(location: Union[Path, str, Callable[[], BinaryIO]]) -> BinaryIO:
+    """
+    録音を取得して読み出し可能なファイルオブジェクトを返す
+    外部URLは一定サイズまでメモリ、それを超えると本スレッド専用の一時ファイルに退避する
+    """
+    if isinstance(location, Path):
+        return open(location, "rb")
+    if callable(location):
+        return location()
+
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    try:
+        with requests.get(location, stream=True, timeout=REMOTE_TIMEOUT) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                spool.write(chunk)
+        spool.seek(0)
+        return spool
+    except Exception:
+        spool.close()
+        raise
+
+
+def _unique_arcname(arcname: str, used: Dict[str, int]) -> str:
+    """ZIP内でファイル名が重複しないように連番を付ける"""
+    count = used.get(arcname, 0)
+    used[arcname] = count + 1
+    if count == 0:
+        return arcname
+    stem, dot, ext = arcname.rpartition(".")
+    if not dot:
+        return f"{arcname}_{count}"
+    return f"{stem}_{count}.{ext}"
+
+
+def iter_zip(sources: Iterable[ZipSource], max_workers: int = DEFAULT_MAX_WORKERS) -> Iterator[bytes]:
+    """
+    録音をまとめたZIPをチャンク単位で生成する
+    取得は最大max_workers件を並列に行い、完了した順にZIPへ書き込む
+    取得に失敗した録音はスキップし、ZIP末尾の _failed.txt に記録する
+    """
+    sink = _ZipSink()
+    used_names: Dict[str, int] = {}
+    failed: List[str] = []
+    source_iter = iter(sources)
+
+    # 録音はmp3など圧縮済みのため、再圧縮せずに格納する
+    zf = zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED)
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    pending: Dict[Future, ZipSource] = {}
+
+    def submit_next() -> bool:
+        for source in source_iter:
+            pending[pool.submit(_fetch, source[1])] = source
+            return True
+        return False
+
+    try:
+        for _ in range(max_workers):
+            if not submit_next():
+                break
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                arcname, location = pending.pop(future)
+                # 空いた枠で次の録音の取得を始めておく
+                submit_next()
+
+                try:
+                    src = future.result()
+                except Exception as e:
+                    failed.append(f"{arcname if callable(location) else location}\t{e}")
+                    continue
+
+                with src, zf.open(_unique_arcname(arcname, used_names), mode="w") as dst:
+                    while True:
+                        chunk = src.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                yield sink.drain()
+
+        if failed:
+            zf.writestr("_failed.txt", "\n".join(failed) + "\n")
+        zf.close()
+        yield sink.drain()
+    finally:
+        # クライアント切断時などは取得中の録音を破棄する
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
+        for future in pending:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                future.result().close()
+
+
+def copy_zip_to(sources: Iterable[ZipSource], fileobj: BinaryIO, max_workers: int = DEFAULT_MAX_WORKERS):
+    """ZIPを任意のファイルオブジェクトに書き出す（CLIなどからの利用向け）"""
+    for data in iter_zip(sources, max_workers=max_workers):
+        fileobj.write(data)
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="録音URL/ファイルをまとめてZIPに書き出す")
+    parser.add_argument("sources", nargs="+", help="録音のURLまたはファイルパス")
+    parser.add_argument("-o", "--output", default="-", help="出力先（既定: 標準出力）")
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_MAX_WORKERS, help="同時取得数")
+    args = parser.parse_args()
+
+    zip_sources: List[ZipSource] = []
+    for s in args.sources:
+        if s.startswith(("http://", "https://")):
+            zip_sources.append((arcname_from_url(s), s))
+        else:
+            zip_sources.append((Path(s).name, Path(s)))
+
+    if args.output == "-":
+        copy_zip_to(zip_sources, sys.stdout.buffer, max_workers=args.jobs)
+    else:
+        with open(args.output, "wb") as out:
+            copy_zip_to(zip_sources, out, max_workers=args.jobs)
@@ -0,0 +1,158 @@
+"""
+鳥のデータ（目録・Suntory・Bird Research・soundフォルダの録音）をまとめたカタログ
+Arrow IPC形式の1ファイルに保存し、読み込み時はメモリマップで参照する
+"""
+
+import json
+import unicodedata
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# カタログのスキーマ
+# source: "mokuroku"（目録）/ "suntory" / "bird_research" / "sound"（soundフォルダの録音）
+CATALOG_SCHEMA = pa.schema([
+    ("name_key", pa.string()),         # 正規化した和名（検索キー）
+    ("japanese_name", pa.string()),
+    ("source", pa.string()),
+    ("scientific_name", pa.string()),
+    ("genus", pa.string()),
+    ("genus_jp", pa.string()),
+    ("family", pa.string()),
+    ("family_jp", pa.string()),
+    ("order", pa.string()),
+    ("order_jp", pa.string()),
+    ("is_subspecies", pa.bool_()),
+    ("page_url", pa.string()),         # Suntory: 図鑑ページのURL
+    ("has_call", pa.bool_()),          # Suntory: 地鳴きの有無
+    ("has_song", pa.bool_()),          # Suntory: さえずりの有無
+    ("voice_type", pa.string()),       # Bird Research: 声の種類
+    ("recorded_on", pa.string()),      # Bird Research: 録音日
+    ("location", pa.string()),         # Bird Research: 録音場所
+    ("file_url", pa.string()),         # Bird Research: 音声ファイルのURL
+    ("filename", pa.string()),         # sound: ファイル名
+    ("filepath", pa.string()),         # sound: BASE_DIRからの相対パス
+    ("content_hash", pa.string()),     # sound: ファイルの内容のsha256（シャーディングに使う）
+])
+
+# スキーマのメタデータに保存する種名一覧のキー
+SPECIES_NAMES_KEY = b"species_names"
+
+
+# ひらがな（ぁ〜ゖ）をカタカナ（ァ〜ヶ）に変換するテーブル
+_HIRAGANA_TO_KATAKANA = {code: code + 0x60 for code in range(0x3041, 0x3097)}
+
+
+def fold_kana(text: str) -> str:
+    """
+    NFKCで半角カナ・全角英数を統一し、ひらがなをカタカナに揃える
+    例: "ｶﾜﾗﾋﾜ" -> "カワラヒワ", "めじろ" -> "メジロ"
+    """
+    return unicodedata.normalize("NFKC", text).translate(_HIRAGANA_TO_KATAKANA)
+
+
+def normalize_name(name: str) -> str:
+    """和名を検索キー用に正規化する（fold_kana に加えて空白を取り除く）"""
+    return "".join(fold_kana(name).split())
+
+
+def write_catalog(records: List[Dict], species_names: List[str], path: Path):
+    """
+    レコードをカタログファイルに書き出す
+    メモリマップで読めるように非圧縮のArrow IPCファイルとして保存する
+    """
+    for record in records:
+        record.setdefault("name_key", normalize_name(record["japanese_name"]))
+
+    table = pa.Table.from_pylist(records, schema=CATALOG_SCHEMA)
+    table = table.sort_by([("name_key", "ascending"), ("source", "ascending")])
+    table = table.replace_schema_metadata({
+        SPECIES_NAMES_KEY: json.dumps(species_names, ensure_ascii=False).encode("utf-8"),
+    })
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    with pa.OSFile(str(tmp_path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    # 読み込み中のプロセスがあっても壊れないように置き換える
+    tmp_path.replace(path)
+
+
+class Catalog:
+    """メモリマップしたカタログと、APIが使う索引"""
+
+    def __init__(self, table: pa.Table):
+        self.table = table
+
+        metadata = table.schema.metadata or {}
+        self.species_names: List[str] = json.loads(metadata.get(SPECIES_NAMES_KEY, b"[]"))
+
+        # soundフォルダの録音（API用）を種名ごとにまとめておく
+        self.sound_files: List[Dict] = [
+            {
+                'filename': row['filename'],
+                'filepath': row['filepath'],
+                'bird_name': row['japanese_name'],
+                'scientific_name': row['scientific_name'],
+                'family': row['family'],
+                'family_jp': row['family_jp'],
+                'order': row['order'],
+                'order_jp': row['order_jp'],
+                'genus': row['genus'],
+                'genus_jp': row['genus_jp'],
+                # 内容のハッシュのない古いカタログでは None
+                'content_hash': row.get('content_hash'),
+            }
+            for row in self.rows("sound")
+        ]
+        self.audio_files_by_bird: Dict[str, List[Dict]] = {}
+        for f in self.sound_files:
+            self.audio_files_by_bird.setdefault(f['bird_name'], []).append(f)
+        self.available_birds: List[str] = sorted(self.audio_files_by_bird)
+        self._bird_by_key: Dict[str, str] = {normalize_name(b): b for b in self.available_birds}
+
+    @classmethod
+    def open(cls, path: Path) -> "Catalog":
+        """カタログファイルをメモリマップで開く"""
+        source = pa.memory_map(str(path), "r")
+        return cls(pa.ipc.open_file(source).read_all())
+
+    @classmethod
+    def from_sound_files(cls, sound_files_data: Dict) -> "Catalog":
+        """sound_files.json（従来形式）からカタログを作る"""
+        records = [sound_file_record(f) for f in sound_files_data.get('success', [])]
+        for record in records:
+            record["name_key"] = normalize_name(record["japanese_name"])
+        table = pa.Table.from_pylist(records, schema=CATALOG_SCHEMA)
+        return cls(table)
+
+    def resolve_bird_name(self, name: str) -> Optional[str]:
+        """表記ゆれ（半角カナ・ひらがな・空白）を吸収して出題可能な鳥の和名を返す"""
+        return self._bird_by_key.get(normalize_name(name))
+
+    def rows(self, source: str, name: Optional[str] = None) -> List[Dict]:
+        """指定したソースのレコードを取得（nameを指定すると和名で絞り込む）"""
+        mask = pc.equal(self.table["source"], source)
+        if name is not None:
+            mask = pc.and_(mask, pc.equal(self.table["name_key"], normalize_name(name)))
+        return self.table.filter(mask).to_pylist()
+
+
+def sound_file_record(f: Dict) -> Dict:
+    """sound_files.json の1件をカタログのレコードに変換"""
+    return {
+        "japanese_name": f['bird_name'],
+        "source": "sound",
+        "scientific_name": f.get('scientific_name'),
+        "genus": f.get('genus'),
+        "genus_jp": f.get('genus_jp'),
+        "family": f.get('family'),
+        "family_jp": f.get('family_jp'),
+        "order": f.get('order'),
+        "order_jp": f.get('order_jp'),
+        "filename": f['filename'],
+        "filepath": f.get('filepath'),
+        "content_hash": f.get('content_hash'),
+    }
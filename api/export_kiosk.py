@@ -0,0 +1,220 @@
+"""
+オフラインのキオスク端末用に、クイズを静的なファイル一式として書き出すスクリプト
+出力: kiosk/（index.html を開くか、任意の静的ファイルサーバーで配信する。APIは使わない）
+
+  index.html / kiosk.js / kiosk.css   画面（api/kiosk_template/ のコピー）
+  data.js                              出題するラウンド（window.KIOSK_DATA）。file:// でも読めるよう JSON ではなくスクリプトにする
+  audio/<hash>.mp3                     出題する録音（ffmpeg があればモノラル・低ビットレートに変換し、先頭 --max-seconds 秒に切る）
+  manifest.json                        ファイルごとのサイズと sha256（端末への同期・破損の確認用）
+
+正解はそのまま書かず、問題ごとのソルトと選択肢のハッシュ（FNV-1a 32bit）で画面側で判定する
+（ソースを見ただけでは正解がわからない程度の目隠しで、改ざん対策ではない）
+
+使い方
+  python api/export_kiosk.py                              # 全録音から200ラウンド
+  python api/export_kiosk.py --label 平塚博物館用 --rounds 500 --output dist/hiratsuka
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import shutil
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# `python api/export_kiosk.py` として実行しても api パッケージを参照できるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from api.catalog import Catalog
+from api.shuffle_bag import ShuffleBag
+from api.storage import open_storage
+
+TEMPLATE_DIR = Path(__file__).resolve().parent / "kiosk_template"
+TEMPLATE_FILES = ("index.html", "kiosk.js", "kiosk.css")
+
+# 変換の設定（変えたら TRANSCODE_VERSION を上げ、ファイル名のハッシュを変える）
+TRANSCODE_VERSION = 1
+DEFAULT_BITRATE = "64k"
+DEFAULT_MAX_SECONDS = 30
+
+# export_audio が書き出す録音のファイル名（ハッシュの先頭20文字 + 拡張子）
+EXPORTED_AUDIO_NAME = re.compile(r"^[0-9a-f]{20}\.\w+$")
+
+
+def answer_check(salt: str, answer: str) -> str:
+    """正解の判定に使うハッシュ（FNV-1a 32bit、kiosk.js の answerCheck と同じ）"""
+    value = 0x811C9DC5
+    for byte in f"{salt}:{answer}".encode("utf-8"):
+        value = ((value ^ byte) * 0x01000193) & 0xFFFFFFFF
+    return f"{value:08x}"
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def export_audio(source: Path, audio_dir: Path, bitrate: Optional[str], max_seconds: int) -> str:
+    """
+    録音を audio/ に書き出し、ファイル名を返す（内容と変換の設定が同じなら書き出し済みのものを使う）
+    bitrate が None なら変換せずにコピーする
+    """
+    settings = f"kiosk:{TRANSCODE_VERSION}:{bitrate}:{max_seconds}:" if bitrate else "kiosk:copy:"
+    digest = hashlib.sha256(settings.encode("ascii"))
+    digest.update(_file_sha256(source).encode("ascii"))
+    suffix = ".mp3" if bitrate else source.suffix.lower()
+    name = digest.hexdigest()[:20] + suffix
+    target = audio_dir / name
+    if target.exists():
+        return name
+
+    tmp = audio_dir / f".{name}.tmp{suffix}"
+    if bitrate:
+        subprocess.run(
+            ["ffmpeg", "-v", "error", "-y", "-i", str(source), "-t", str(max_seconds),
+             "-ac", "1", "-ar", "44100", "-b:a", bitrate, str(tmp)],
+            check=True,
+        )
+    else:
+        shutil.copyfile(source, tmp)
+    tmp.replace(target)
+    return name
+
+
+def build_rounds(catalog: Catalog, audio_names: Dict[str, str], rounds: int, questions: int,
+                 seed: int) -> List[List[Dict]]:
+    """
+    ラウンドを作る（ShuffleBag で、全種を出し切るまで同じ種・録音を出さない）
+    audio_names は録音のファイル名 -> 書き出したファイル名（書き出せなかった録音は出題しない）
+    """
+    files_by_bird = {
+        bird: [f for f in files if f['filename'] in audio_names]
+        for bird, files in catalog.audio_files_by_bird.items()
+    }
+    birds = sorted(bird for bird, files in files_by_bird.items() if files)
+    if len(birds) < 4:
+        raise ValueError("出題には最低4種類の鳥が必要です")
+
+    bag = ShuffleBag(seed)
+    rng = random.Random(seed)
+    result = []
+    for r in range(rounds):
+        round_questions = []
+        for i in range(questions):
+            bird, occurrence = bag.species(birds, r * questions + i)
+            selected = bag.recording(bird, files_by_bird[bird], occurrence)
+            choices = [bird] + rng.sample([b for b in birds if b != bird], 3)
+            rng.shuffle(choices)
+            salt = f"{rng.getrandbits(32):08x}"
+            round_questions.append({
+                "audio": f"audio/{audio_names[selected['filename']]}",
+                "choices": choices,
+                "salt": salt,
+                "check": answer_check(salt, bird),
+                "scientific_name": selected.get('scientific_name'),
+                "family": selected.get('family_jp'),
+            })
+        result.append(round_questions)
+    return result
+
+
+def write_manifest(output_dir: Path, extra: Dict):
+    files = {}
+    for path in sorted(output_dir.rglob("*")):
+        if path.is_file() and path.name != "manifest.json" and not path.name.startswith("."):
+            files[path.relative_to(output_dir).as_posix()] = {"size": path.stat().st_size, "sha256": _file_sha256(path)}
+    manifest = dict(extra, files=files)
+    with open(output_dir / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+
+
+def export_kiosk(catalog: Catalog, storage, output_dir: Path, rounds: int, questions: int, seed: int,
+                 label: Optional[str] = None, bitrate: Optional[str] = DEFAULT_BITRATE,
+                 max_seconds: int = DEFAULT_MAX_SECONDS) -> Dict:
+    """キオスク用のファイル一式を書き出し、マニフェストの概要を返す"""
+    if bitrate and shutil.which("ffmpeg") is None:
+        print("ffmpeg が見つからないため、録音を変換せずにコピーします")
+        bitrate = None
+
+    audio_dir = output_dir / "audio"
+    audio_dir.mkdir(parents=True, exist_ok=True)
+    audio_names: Dict[str, str] = {}
+    failed = 0
+    for f in catalog.sound_files:
+        if label and label not in f['filename']:
+            continue
+        try:
+            audio_names[f['filename']] = export_audio(storage.fetch(f['filename']), audio_dir, bitrate, max_seconds)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"  ✗ {f['filename']}: {e}")
+            failed += 1
+
+    # 出題できない（4種類に満たない）ときは何も削除せずに終える
+    round_data = build_rounds(catalog, audio_names, rounds, questions, seed)
+
+    # 今回使わない録音（前回の書き出しの残り）を削除する。export_audio が付けた名前のファイルだけを対象にする
+    used = set(audio_names.values())
+    for path in audio_dir.iterdir():
+        if path.name not in used and EXPORTED_AUDIO_NAME.match(path.name) and path.is_file():
+            path.unlink()
+
+    generated_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    data = {"generated_at": generated_at, "questions_per_round": questions, "rounds": round_data}
+    with open(output_dir / "data.js", "w", encoding="utf-8") as f:
+        f.write("window.KIOSK_DATA = ")
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        f.write(";\n")
+    for name in TEMPLATE_FILES:
+        shutil.copyfile(TEMPLATE_DIR / name, output_dir / name)
+
+    summary = {
+        "generated_at": generated_at,
+        "rounds": rounds,
+        "questions_per_round": questions,
+        "recordings": len(used),
+        "species": len({f['bird_name'] for f in catalog.sound_files if f['filename'] in audio_names}),
+        "transcoded": bitrate is not None,
+    }
+    write_manifest(output_dir, summary)
+    print(f"ラウンド: {rounds}件 / 録音: {len(used)}件 / 失敗: {failed}件")
+    return summary
+
+
+def main():
+    """メイン処理"""
+    base_dir = Path(__file__).resolve().parent.parent
+    parser = argparse.ArgumentParser(description="キオスク端末用のクイズを静的なファイル一式として書き出す")
+    parser.add_argument("--sound-files", type=Path, default=base_dir / "api" / "sound_files.json")
+    parser.add_argument("--output", type=Path, default=base_dir / "kiosk")
+    parser.add_argument("--rounds", type=int, default=200, help="作るラウンド数")
+    parser.add_argument("--questions", type=int, default=5, help="1ラウンドの問題数")
+    parser.add_argument("--seed", type=int, default=None, help="出題順の乱数の種（既定: ランダム）")
+    parser.add_argument("--label", default=None, help="ファイル名にこの文字列を含む録音だけを使う（例: 平塚博物館用）")
+    parser.add_argument("--bitrate", default=DEFAULT_BITRATE, help="変換後のビットレート（--no-transcode で変換しない）")
+    parser.add_argument("--max-seconds", type=int, default=DEFAULT_MAX_SECONDS, help="録音の先頭から使う秒数")
+    parser.add_argument("--no-transcode", action="store_true", help="録音を変換せずにコピーする")
+    args = parser.parse_args()
+
+    storage = open_storage(base_dir / "sound", base_dir / "data" / "audio_cache")
+    print(f"Sound files: {args.sound_files}")
+    print(f"Sound storage: {storage}")
+    print(f"Output: {args.output}")
+    print()
+
+    with open(args.sound_files, "r", encoding="utf-8") as f:
+        catalog = Catalog.from_sound_files(json.load(f))
+    seed = args.seed if args.seed is not None else random.getrandbits(64)
+    export_kiosk(catalog, storage, args.output, args.rounds, args.questions, seed, label=args.label,
+                 bitrate=None if args.no_transcode else args.bitrate, max_seconds=args.max_seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+録音の音響フィンガープリント（同じ録音の重複・種名の付け間違いの検出）
+取り込み時（api/build_fingerprints.py）に録音ごとに一度だけ作る
+
+- スペクトログラム（NumPy の STFT）の局所的なピークを、前後0.5秒に PEAKS_PER_SECOND 個まで強い順に選ぶ
+  強さは周波数ごとの中央値（定常的なノイズ）との差で比べる
+  窓はピークごとにずらすため、切り出した位置によって残るピークが変わらない
+- ピークとその後に続く FAN_OUT 個のピークの組を (周波数1, 周波数2, 時間差) の20bitのハッシュにし、
+  組の始点の時刻（フレーム）と合わせて保存する
+- 転置索引はハッシュで並べた配列で、照合は searchsorted でまとめて引く
+  同じ録音なら「索引側の時刻 - 照合側の時刻」が揃うため、録音ごとに最も多い時刻差の件数を一致数とする
+  ノイズ除去・音量の変更・前後のカットをしても強いピークは残るため、一致数は十分に大きくなる
+  一致したハッシュが時刻差に均等に散らばった場合の1つの時刻差あたりの件数（偶然の一致の期待値）も返す
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from api.visuals import SAMPLE_RATE
+
+# フィンガープリントのパラメータ（変えたら FINGERPRINT_VERSION を上げ、索引を作り直す）
+FINGERPRINT_VERSION = 2
+FFT_SIZE = 1024
+HOP_SIZE = 256
+MIN_FREQ = 300
+MAX_FREQ = 10000
+# ピークとみなす範囲（前後のフレーム数、上下の周波数ビン数）
+PEAK_TIME_RADIUS = 10
+PEAK_FREQ_RADIUS = 10
+# 周波数ごとの中央値より何dB大きければピークにするか（小さいと背景の雑音のピークばかりになる）
+PEAK_MIN_DB = 12.0
+PEAKS_PER_SECOND = 10
+FAN_OUT = 8
+# ハッシュにする周波数（ビン）と時間差（フレーム）の刻み
+# 切り出しや再エンコードでフレームの位置がずれると、周波数の変わる鳴き声のピークは数ビンずれるため粗くする
+FREQ_STEP = 4
+DT_STEP = 2
+MAX_DT = 63
+
+# 一致とみなす時刻差の幅（フレーム）
+OFFSET_TOLERANCE = 2
+# 照合で引く1つのハッシュの録音数の上限（多くの録音に現れるハッシュは手がかりにならない）
+MAX_POSTINGS = 200
+
+INDEX_NAME = "index.npz"
+FILES_NAME = "files.json"
+
+_MIN_BIN = int(MIN_FREQ * FFT_SIZE / SAMPLE_RATE)
+_MAX_BIN = int(MAX_FREQ * FFT_SIZE / SAMPLE_RATE)
+FRAME_SECONDS = HOP_SIZE / SAMPLE_RATE
+_HALF_WINDOW_FRAMES = int(round(0.5 / FRAME_SECONDS))
+
+
+def _max_filter(values: np.ndarray, radius: int, axis: int) -> np.ndarray:
+    """axis 方向の前後 radius の最大値"""
+    pad = [(0, 0)] * values.ndim
+    pad[axis] = (radius, radius)
+    padded = np.pad(values, pad, constant_values=-np.inf)
+    return np.lib.stride_tricks.sliding_window_view(padded, 2 * radius + 1, axis=axis).max(axis=-1)
+
+
+def peaks(samples: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """スペクトログラムのピークの (フレーム, 周波数ビン)（時刻順）"""
+    samples = np.asarray(samples, dtype=np.float32)
+    if len(samples) < FFT_SIZE:
+        samples = np.pad(samples, (0, FFT_SIZE - len(samples)))
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FFT_SIZE)[::HOP_SIZE]
+    power = np.abs(np.fft.rfft(frames * np.hanning(FFT_SIZE).astype(np.float32), axis=1)) ** 2
+    db = 10 * np.log10(power[:, _MIN_BIN:_MAX_BIN] + 1e-10)
+    db -= np.median(db, axis=0)
+
+    local_max = _max_filter(_max_filter(db, PEAK_FREQ_RADIUS, axis=1), PEAK_TIME_RADIUS, axis=0)
+    t, f = np.nonzero((db == local_max) & (db > PEAK_MIN_DB))
+    if not len(t):
+        return t, f
+
+    # 前後0.5秒の中で強い方から PEAKS_PER_SECOND 番目までのピークを残す
+    # （1秒ごとの区切りだと、切り出した位置で区切りがずれて残るピークが変わる）
+    strength = db[t, f]
+    left = np.searchsorted(t, t - _HALF_WINDOW_FRAMES, side="left")
+    right = np.searchsorted(t, t + _HALF_WINDOW_FRAMES, side="right")
+    window = left[:, None] + np.arange(int((right - left).max()))
+    in_window = window < right[:, None]
+    stronger = ((strength[np.minimum(window, len(t) - 1)] > strength[:, None]) & in_window).sum(axis=1)
+    keep = stronger < PEAKS_PER_SECOND
+    return t[keep], f[keep]
+
+
+def fingerprint(samples: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """録音のフィンガープリント（ハッシュ uint32、始点のフレーム uint32）"""
+    t, f = peaks(samples)
+    hashes: List[np.ndarray] = []
+    times: List[np.ndarray] = []
+    for k in range(1, FAN_OUT + 1):
+        if len(t) <= k:
+            break
+        dt = (t[k:] - t[:-k]) // DT_STEP
+        valid = dt <= MAX_DT
+        f1, f2 = f[:-k][valid] // FREQ_STEP, f[k:][valid] // FREQ_STEP
+        # 周波数1（7bit） | 周波数2（7bit） | 時間差（6bit）
+        hashes.append(((f1 << 13) | (f2 << 6) | dt[valid]).astype(np.uint32))
+        times.append(t[:-k][valid].astype(np.uint32))
+    if not hashes:
+        return np.zeros(0, np.uint32), np.zeros(0, np.uint32)
+    return np.concatenate(hashes), np.concatenate(times)
+
+
+class FingerprintIndex:
+    """
+    録音ごとのフィンガープリントと、ハッシュで並べた転置索引
+    files は録音ごとの情報（filename / content_hash / bird_name）で、位置が録音の番号
+    """
+
+    def __init__(self):
+        self.files: List[Dict] = []
+        self._hashes: List[np.ndarray] = []
+        self._times: List[np.ndarray] = []
+        self._by_name: Dict[str, int] = {}
+        self._sorted_hashes = np.zeros(0, np.uint32)
+        self._sorted_files = np.zeros(0, np.uint32)
+        self._sorted_times = np.zeros(0, np.uint32)
+        self._counts = np.zeros(0, np.int64)
+        self._frames = np.zeros(0, np.int64)
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def get(self, filename: str) -> Optional[int]:
+        return self._by_name.get(filename)
+
+    def fingerprint_of(self, number: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self._hashes[number], self._times[number]
+
+    def add(self, entry: Dict, hashes: np.ndarray, times: np.ndarray) -> int:
+        """録音を追加する（照合の前に build() を呼ぶ）"""
+        self._by_name[entry['filename']] = len(self.files)
+        self.files.append(entry)
+        self._hashes.append(hashes)
+        self._times.append(times)
+        return len(self.files) - 1
+
+    def build(self):
+        """転置索引（ハッシュで並べた配列）を作る"""
+        if not self.files:
+            return
+        hashes = np.concatenate(self._hashes)
+        order = np.argsort(hashes, kind="stable")
+        counts = np.array([len(h) for h in self._hashes], dtype=np.int64)
+        self._sorted_hashes = hashes[order]
+        self._sorted_files = np.repeat(np.arange(len(self.files), dtype=np.uint32), counts)[order]
+        self._sorted_times = np.concatenate(self._times)[order]
+        self._counts = counts
+        self._frames = np.array([int(t.max()) + 1 if len(t) else 1 for t in self._times], dtype=np.int64)
+
+    def query(self, hashes: np.ndarray, times: np.ndarray, exclude: Optional[int] = None) -> List[Dict]:
+        """
+        索引の録音ごとの一致数（時刻差が揃ったハッシュの数）を、多い順に返す
+        similarity は一致数を2つの録音のハッシュ数の少ない方で割ったもの（一方が他方の一部でも1に近くなる）
+        ノイズを加えた録音はハッシュ数が増えるため、同じ録音でも similarity は小さくなる
+        background は一致したハッシュ（時刻差を問わない）が取りうる時刻差に均等に散らばった場合の、
+        一致数を数える幅（隣の時刻差を含む）あたりの件数。関係のない録音の一致数はこの数倍程度にとどまる
+        """
+        if not len(hashes) or not len(self._sorted_hashes):
+            return []
+        left = np.searchsorted(self._sorted_hashes, hashes, side="left")
+        right = np.searchsorted(self._sorted_hashes, hashes, side="right")
+        counts = right - left
+        use = (counts > 0) & (counts <= MAX_POSTINGS)
+        left, counts, query_times = left[use], counts[use], times[use].astype(np.int64)
+        if not len(counts):
+            return []
+
+        # 一致した索引の位置をまとめて展開する
+        total = int(counts.sum())
+        starts = np.repeat(left - np.cumsum(counts) + counts, counts)
+        positions = starts + np.arange(total)
+        files = self._sorted_files[positions].astype(np.int64)
+        offsets = (self._sorted_times[positions].astype(np.int64) - np.repeat(query_times, counts)) // OFFSET_TOLERANCE
+        if exclude is not None:
+            keep = files != exclude
+            files, offsets = files[keep], offsets[keep]
+        if not len(files):
+            return []
+        hits = np.bincount(files, minlength=len(self.files))
+        query_frames = int(times.max()) + 1
+
+        # (録音, 時刻差) ごとの件数から、録音ごとに最も多い時刻差を選ぶ
+        offset_bias = int(-offsets.min())
+        span = int(offsets.max()) + offset_bias + 1
+        unique, matches = np.unique(files * span + offsets + offset_bias, return_counts=True)
+        # ピークの時刻は前後に1フレームずれることがあるため、隣の時刻差の件数も足す
+        following = np.searchsorted(unique, unique + 1)
+        following = np.minimum(following, len(unique) - 1)
+        matches = matches + np.where((unique[following] == unique + 1) & ((unique + 1) % span != 0), matches[following], 0)
+        key_files = unique // span
+        order = np.lexsort((-matches, key_files))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = key_files[order][1:] != key_files[order][:-1]
+        best = order[first]
+
+        results = []
+        for number, count, key in zip(key_files[best], matches[best], unique[best]):
+            number = int(number)
+            smaller = min(len(hashes), int(self._counts[number]))
+            offset_bins = (query_frames + int(self._frames[number])) / OFFSET_TOLERANCE
+            results.append({
+                "number": number,
+                "matches": int(count),
+                "similarity": round(min(1.0, int(count) / max(1, smaller)), 4),
+                "background": round(2 * int(hits[number]) / offset_bins, 4),
+                "offset_seconds": round((int(key % span) - offset_bias) * OFFSET_TOLERANCE * FRAME_SECONDS, 2),
+            })
+        results.sort(key=lambda r: -r["matches"])
+        return results
+
+    def save(self, data_dir: Path):
+        data_dir.mkdir(parents=True, exist_ok=True)
+        counts = np.array([len(h) for h in self._hashes], dtype=np.int64)
+        tmp = data_dir / f".{INDEX_NAME}"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                version=np.array([FINGERPRINT_VERSION]),
+                counts=counts,
+                hashes=np.concatenate(self._hashes) if self._hashes else np.zeros(0, np.uint32),
+                times=np.concatenate(self._times) if self._times else np.zeros(0, np.uint32),
+            )
+        tmp.replace(data_dir / INDEX_NAME)
+        with open(data_dir / FILES_NAME, "w", encoding="utf-8") as f:
+            json.dump(self.files, f, ensure_ascii=False, indent=1)
+
+    @classmethod
+    def load(cls, data_dir: Path) -> "FingerprintIndex":
+        """保存した索引を読み込む（ないか、パラメータが変わっていれば空の索引）"""
+        index = cls()
+        try:
+            with open(data_dir / FILES_NAME, "r", encoding="utf-8") as f:
+                files = json.load(f)
+            data = np.load(data_dir / INDEX_NAME)
+        except (OSError, ValueError):
+            return index
+        if int(data["version"][0]) != FINGERPRINT_VERSION or len(data["counts"]) != len(files):
+            return index
+        bounds = np.concatenate([[0], np.cumsum(data["counts"])])
+        hashes, times = data["hashes"], data["times"]
+        for i, entry in enumerate(files):
+            index.add(entry, hashes[bounds[i]:bounds[i + 1]], times[bounds[i]:bounds[i + 1]])
+        return index
@@ -0,0 +1,161 @@
+// キオスク端末用の鳥の鳴き声クイズ（api/export_kiosk.py が書き出した data.js を使い、APIには接続しない）
+(function () {
+  'use strict'
+
+  var data = window.KIOSK_DATA
+  // 操作がないまま経過したらスタート画面に戻す（ミリ秒）
+  var IDLE_TIMEOUT = 120000
+  var ROUND_KEY = 'kioskRoundIndex'
+
+  var round = []
+  var questionIndex = 0
+  var score = 0
+  var records = []
+  var idleTimer = null
+
+  function $(id) {
+    return document.getElementById(id)
+  }
+
+  function show(id) {
+    ['start', 'question', 'finish'].forEach(function (name) {
+      $(name).hidden = name !== id
+    })
+  }
+
+  // 正解の判定に使うハッシュ（FNV-1a 32bit、export_kiosk.py の answer_check と同じ）
+  function answerCheck(salt, answer) {
+    var bytes = new TextEncoder().encode(salt + ':' + answer)
+    var value = 0x811c9dc5
+    for (var i = 0; i < bytes.length; i++) {
+      value = Math.imul(value ^ bytes[i], 0x01000193) >>> 0
+    }
+    return ('0000000' + value.toString(16)).slice(-8)
+  }
+
+  // ラウンドは端末ごとに順番に使い、全ラウンドを使い切ったら最初に戻る
+  function nextRound() {
+    var index = 0
+    try {
+      index = parseInt(localStorage.getItem(ROUND_KEY) || '0', 10) || 0
+      localStorage.setItem(ROUND_KEY, String((index + 1) % data.rounds.length))
+    } catch (e) {
+      index = Math.floor(Math.random() * data.rounds.length)
+    }
+    return data.rounds[index % data.rounds.length]
+  }
+
+  function resetIdleTimer() {
+    clearTimeout(idleTimer)
+    idleTimer = setTimeout(function () {
+      $('audio').pause()
+      show('start')
+    }, IDLE_TIMEOUT)
+  }
+
+  function startRound() {
+    round = nextRound()
+    questionIndex = 0
+    score = 0
+    records = []
+    showQuestion()
+  }
+
+  function showQuestion() {
+    var question = round[questionIndex]
+    show('question')
+    $('question-number').textContent = '問題 ' + (questionIndex + 1) + ' / ' + round.length
+    $('result').hidden = true
+    $('audio').src = question.audio
+
+    var choices = $('choices')
+    choices.innerHTML = ''
+    question.choices.forEach(function (choice) {
+      var button = document.createElement('button')
+      button.textContent = choice
+      button.addEventListener('click', function () {
+        answer(question, choice)
+      })
+      choices.appendChild(button)
+    })
+  }
+
+  function answer(question, choice) {
+    if (!$('result').hidden) {
+      return
+    }
+    var correct = question.choices.filter(function (c) {
+      return answerCheck(question.salt, c) === question.check
+    })[0]
+    var isCorrect = choice === correct
+    if (isCorrect) {
+      score++
+    }
+    records.push({ species: correct, isCorrect: isCorrect })
+
+    Array.prototype.forEach.call($('choices').children, function (button) {
+      if (button.textContent === correct) {
+        button.className = 'correct'
+      } else if (button.textContent === choice) {
+        button.className = 'wrong'
+      }
+    })
+    $('result-message').textContent = isCorrect ? '正解！🎉' : '残念... 正解は「' + correct + '」でした'
+    $('result-detail').textContent = [question.family, question.scientific_name].filter(Boolean).join(' / ')
+    $('next-button').textContent = questionIndex + 1 < round.length ? '次の問題へ' : '結果を見る'
+    $('result').hidden = false
+  }
+
+  function finish() {
+    var percentage = Math.round((score / round.length) * 100)
+    var emoji = '💪'
+    var message = 'もっと練習しましょう！'
+    if (percentage === 100) {
+      emoji = '🎉'
+      message = '完璧！素晴らしい！'
+    } else if (percentage >= 80) {
+      emoji = '👏'
+      message = 'すごい！よくできました！'
+    } else if (percentage >= 60) {
+      emoji = '😊'
+      message = 'よく頑張りました！'
+    }
+    $('finish-emoji').textContent = emoji
+    $('finish-message').textContent = message
+    $('score').textContent = score + ' / ' + round.length
+
+    var list = $('records')
+    list.innerHTML = ''
+    records.forEach(function (record) {
+      var item = document.createElement('li')
+      item.textContent = record.species + ' ' + (record.isCorrect ? '⭕️' : '❌')
+      list.appendChild(item)
+    })
+    show('finish')
+  }
+
+  $('start-button').addEventListener('click', startRound)
+  $('retry-button').addEventListener('click', startRound)
+  $('play-button').addEventListener('click', function () {
+    var audio = $('audio')
+    audio.currentTime = 0
+    audio.play()
+  })
+  $('next-button').addEventListener('click', function () {
+    $('audio').pause()
+    questionIndex++
+    if (questionIndex < round.length) {
+      showQuestion()
+    } else {
+      finish()
+    }
+  })
+  ;['click', 'touchstart'].forEach(function (type) {
+    document.addEventListener(type, resetIdleTimer)
+  })
+
+  if (!data || !data.rounds || !data.rounds.length) {
+    $('start').textContent = '問題データ（data.js）が見つかりません'
+  }
+  show('start')
+})()
@@ -0,0 +1,471 @@
+"""
+ランキング（日別・週別・全期間）
+
+得点はサーバーが判定した回答（署名付きの問題ID）から加算する（正解1問につき1点）
+回答はイベントログ（events.jsonl、追記のみ）に書き込み、
+各ワーカーはログの未読分をメモリ上の順位付き集合（インデックス付きスキップリスト）に反映する
+（ログの読み込みは read_pending で別スレッドから、反映は apply_pending でイベントループから行える）
+同じユーザーが同じ問題に回答し直しても、ログで最初の回答だけを数える（どのワーカーでも同じ結果になる）
+上位K件・自分の順位の取得はいずれも O(log n)
+
+公開するのはユーザーID（Supabase の auth UUID）ではなく、期間ごとの識別子（quiz_token.player_id）
+
+再起動に備えて、定期的に集計結果とログの読み込み位置をスナップショット（snapshot.json）に保存する
+保存したらログからスナップショットに含めた分を削除する（圧縮）。ログの位置は圧縮しても変わらず、
+圧縮した後のログは先頭の行にファイルの先頭のイベントの位置を持つ
+未読分が圧縮で消えていたワーカーはスナップショットを読み込み直す
+期間の区切りは日本時間（日別は0時、週別は月曜0時）
+"""
+
+import json
+import logging
+import os
+import random
+import shutil
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from api.quiz_token import player_id
+
+logger = logging.getLogger(__name__)
+
+JST = timezone(timedelta(hours=9))
+
+PERIODS = ("daily", "weekly", "all")
+
+# スキップリストの最大の高さ（4^16 件程度まで O(log n) を保つ）
+MAX_LEVEL = 16
+
+# 出題から回答までの時間の上限（秒）。これより後の回答は得点にしない
+ANSWER_WINDOW = 3600
+
+# 圧縮したイベントログの先頭の行（{"base": ファイルの先頭のイベントの位置}）
+EVENTS_HEADER = b'{"base":'
+
+
+class _Last:
+    """どのキーよりも大きい番兵"""
+
+    def __lt__(self, other):
+        return False
+
+    def __le__(self, other):
+        return False
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, level: int):
+        self.key = key
+        self.next: List[Optional["_Node"]] = [None] * level
+        # 各レベルで次のノードまでに飛ばす要素数
+        self.width: List[int] = [1] * level
+
+
+class RankedSet:
+    """
+    キーの昇順に並んだ集合（インデックス付きスキップリスト）
+    追加・削除・順位の取得・先頭からの取り出しが O(log n)
+    """
+
+    def __init__(self):
+        self._tail = _Node(_Last(), 0)
+        self._head = _Node(None, MAX_LEVEL)
+        self._head.next = [self._tail] * MAX_LEVEL
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @staticmethod
+    def _random_level() -> int:
+        level = 1
+        while level < MAX_LEVEL and random.random() < 0.25:
+            level += 1
+        return level
+
+    def insert(self, key):
+        chain: List[_Node] = [self._head] * MAX_LEVEL
+        steps_at_level = [0] * MAX_LEVEL
+        node = self._head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        height = self._random_level()
+        new_node = _Node(key, height)
+        steps = 0
+        for level in range(height):
+            prev = chain[level]
+            new_node.next[level] = prev.next[level]
+            prev.next[level] = new_node
+            new_node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(height, MAX_LEVEL):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        chain: List[_Node] = [self._head] * MAX_LEVEL
+        node = self._head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is self._tail or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), MAX_LEVEL):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def rank(self, key) -> Optional[int]:
+        """キーより小さい要素の数（0始まりの順位、キーがなければ None）"""
+        position = 0
+        node = self._head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        if node.next[0] is self._tail or node.next[0].key != key:
+            return None
+        return position
+
+    def head(self, count: int) -> List:
+        """先頭から count 件"""
+        result = []
+        node = self._head.next[0]
+        while node is not self._tail and len(result) < count:
+            result.append(node.key)
+            node = node.next[0]
+        return result
+
+
+def period_key(period: str, at: datetime) -> str:
+    """期間の識別子（日別: 2026-10-19、週別: 2026-W43、全期間: all）"""
+    local = at.astimezone(JST)
+    if period == "daily":
+        return local.date().isoformat()
+    if period == "weekly":
+        year, week, _ = local.isocalendar()
+        return f"{year}-W{week:02d}"
+    return "all"
+
+
+class _Board:
+    """1つの期間のランキング"""
+
+    def __init__(self, key: str):
+        self.key = key
+        # ユーザーID -> (合計スコア, 最後に加算したイベントの位置)
+        self.scores: Dict[str, Tuple[int, int]] = {}
+        # (-合計スコア, イベントの位置, ユーザーID) の昇順 = 順位順（同点なら先に到達した方が上位）
+        self.ranked = RankedSet()
+
+    def add(self, user_id: str, points: int, seq: int):
+        total = points
+        current = self.scores.get(user_id)
+        if current is not None:
+            self.ranked.remove((-current[0], current[1], user_id))
+            total += current[0]
+        self.scores[user_id] = (total, seq)
+        self.ranked.insert((-total, seq, user_id))
+
+    def top(self, limit: int) -> List[Dict]:
+        return [
+            {"rank": i + 1, "player": player_id(self.key, user_id), "score": -neg_score}
+            for i, (neg_score, _, user_id) in enumerate(self.ranked.head(limit))
+        ]
+
+    def rank_of(self, user_id: str) -> Optional[Dict]:
+        current = self.scores.get(user_id)
+        if current is None:
+            return None
+        return {"rank": self.ranked.rank((-current[0], current[1], user_id)) + 1, "score": current[0]}
+
+
+def _read_header(f) -> Tuple[int, int]:
+    """イベントログの先頭の行から (ファイルの先頭のイベントの位置, 先頭の行の長さ)（圧縮前のログは (0, 0)）"""
+    f.seek(0)
+    line = f.readline()
+    if not line.startswith(EVENTS_HEADER) or not line.endswith(b"\n"):
+        return 0, 0
+    try:
+        return int(json.loads(line)["base"]), len(line)
+    except (ValueError, KeyError, TypeError):
+        return 0, 0
+
+
+def _same_file(fd: int, path: Path) -> bool:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return False
+    opened = os.fstat(fd)
+    return (st.st_dev, st.st_ino) == (opened.st_dev, opened.st_ino)
+
+
+class Leaderboard:
+    """イベントログとスナップショットから復元するランキング"""
+
+    def __init__(self, data_dir: Path, snapshot_interval: float = 60.0, compact_bytes: int = 1024 * 1024):
+        self.data_dir = data_dir
+        self.events_path = data_dir / "events.jsonl"
+        self.snapshot_path = data_dir / "snapshot.json"
+        self.lock_path = data_dir / "events.lock"
+        self.snapshot_interval = snapshot_interval
+        self.compact_bytes = compact_bytes
+        self.boards: Dict[str, _Board] = {}
+        # 回答済みの (ユーザーID, 問題) -> 回答時刻（ANSWER_WINDOW の2倍より古いものは捨てる、古い順）
+        self._answered: Dict[str, float] = {}
+        # 読み込んだイベントログの位置（圧縮しても変わらない、ログの始めからのバイト数）
+        self._offset = 0
+        self._fd: Optional[int] = None
+        self._lock_fd: Optional[int] = None
+        self._last_snapshot = time.monotonic()
+
+    def load(self):
+        """スナップショットを読み込み、それ以降のイベントを反映する"""
+        state = self._read_snapshot() or {"boards": {}, "answered": {}, "offset": 0}
+        base = self._events_base()
+        if state["offset"] < base:
+            logger.error("leaderboard snapshot is older than the compacted events, skipping missing events",
+                         extra={"offset": state["offset"], "base": base})
+            state["offset"] = base
+        self._restore(state)
+        self.sync()
+        logger.info("leaderboard loaded", extra={"offset": self._offset,
+                                                 "users": len(self.boards.get("all", _Board("all")).scores)})
+
+    def _read_snapshot(self) -> Optional[Dict]:
+        """スナップショットから集計を作る（共有の状態には触れないので別スレッドで呼べる）"""
+        if not self.snapshot_path.exists():
+            return None
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            boards: Dict[str, _Board] = {}
+            for period, board_data in snapshot["boards"].items():
+                board = _Board(board_data["key"])
+                for user_id, (score, seq) in board_data["scores"].items():
+                    board.scores[user_id] = (score, seq)
+                    board.ranked.insert((-score, seq, user_id))
+                boards[period] = board
+            return {"boards": boards, "answered": {key: at for key, at in snapshot.get("answered", [])},
+                    "offset": snapshot["offset"]}
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("failed to load leaderboard snapshot, rebuilding from events", extra={"error": str(e)})
+            return None
+
+    def _restore(self, state: Dict):
+        self.boards = state["boards"]
+        self._answered = state["answered"]
+        self._offset = state["offset"]
+
+    def _events_base(self) -> int:
+        try:
+            with open(self.events_path, "rb") as f:
+                return _read_header(f)[0]
+        except FileNotFoundError:
+            return 0
+
+    def record_answer(self, user_id: str, question: str, is_correct: bool, at: Optional[datetime] = None):
+        """
+        サーバーが判定した回答をイベントログに追記する（正解なら1点、反映は次の sync）
+        question は問題ごとに一意な値（問題IDの署名）。同じユーザーの2回目以降の回答は数えない
+        """
+        at = at or datetime.now(timezone.utc)
+        event = {"user_id": user_id, "score": 1 if is_correct else 0, "at": at.timestamp(), "question": question}
+        line = json.dumps(event) + "\n"
+        if self._lock_fd is None:
+            self.data_dir.mkdir(parents=True, exist_ok=True)
+            self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        # 圧縮（write_snapshot）とは排他にする。追記同士は同時でよい
+        if fcntl is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_SH)
+        try:
+            if self._fd is not None and not _same_file(self._fd, self.events_path):
+                # 圧縮でログが置き換わった
+                os.close(self._fd)
+                self._fd = None
+            if self._fd is None:
+                # O_APPEND の1回の write で書き込み、他のワーカーの追記と行が混ざらないようにする
+                self._fd = os.open(self.events_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            os.write(self._fd, line.encode("utf-8"))
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def sync(self):
+        """イベントログの未読分（他のワーカーが追記した分を含む）を反映する"""
+        self.apply_pending(self.read_pending())
+
+    def read_pending(self) -> Tuple[int, bytes, Optional[Dict]]:
+        """
+        イベントログの未読分を読む（ファイルを読むだけなので別スレッドで呼べる）
+        (読み始めの位置, データ, スナップショット) を返す
+        未読分が圧縮で消えていれば、スナップショットを読み込み、その位置から読む
+        """
+        offset = self._offset
+        snapshot = None
+        try:
+            with open(self.events_path, "rb") as f:
+                base, header = _read_header(f)
+                if offset < base:
+                    snapshot = self._read_snapshot()
+                    if snapshot is None or snapshot["offset"] < base:
+                        logger.error("leaderboard events were compacted before being read, skipping missing events",
+                                     extra={"offset": offset, "base": base})
+                        snapshot = None
+                        offset = base
+                    else:
+                        offset = snapshot["offset"]
+                f.seek(header + offset - base)
+                return offset, f.read(), snapshot
+        except FileNotFoundError:
+            return offset, b"", None
+
+    def apply_pending(self, pending: Tuple[int, bytes, Optional[Dict]]):
+        """read_pending で読んだ分を反映する（他の呼び出しで反映済みの分は飛ばす）"""
+        start, data, snapshot = pending
+        if snapshot is not None and snapshot["offset"] > self._offset:
+            self._restore(snapshot)
+        if start > self._offset:
+            # 圧縮で消えた分を飛ばす
+            logger.warning("skipped compacted leaderboard events", extra={"offset": self._offset, "to": start})
+            self._offset = start
+        data = data[self._offset - start:]
+        # 書き込み途中の行は次回に回す
+        end = data.rfind(b"\n") + 1
+        position = self._offset
+        for line in data[:end].splitlines(keepends=True):
+            try:
+                event = json.loads(line)
+                self._apply(event["user_id"], int(event["score"]), float(event["at"]), position, event.get("question"))
+            except (ValueError, KeyError, TypeError):
+                logger.warning("skipped invalid leaderboard event", extra={"offset": position})
+            position += len(line)
+        self._offset += end
+
+    def _apply(self, user_id: str, score: int, at: float, seq: int, question: Optional[str] = None):
+        if question is not None:
+            key = f"{user_id}:{question}"
+            if key in self._answered:
+                return
+            self._answered[key] = at
+            # 古い回答済みの記録を捨てる（問題の有効期間を過ぎたものは回答自体が数えられない）
+            while self._answered:
+                oldest = next(iter(self._answered))
+                if self._answered[oldest] >= at - 2 * ANSWER_WINDOW:
+                    break
+                del self._answered[oldest]
+        if score <= 0:
+            return
+        moment = datetime.fromtimestamp(at, timezone.utc)
+        for period in PERIODS:
+            key = period_key(period, moment)
+            board = self.boards.get(period)
+            if board is None or key > board.key:
+                board = self.boards[period] = _Board(key)
+            elif key < board.key:
+                # 期間が切り替わった後に届いた前の期間のイベント
+                continue
+            board.add(user_id, score, seq)
+
+    def _current(self, period: str) -> Optional[_Board]:
+        board = self.boards.get(period)
+        if board is None or board.key != period_key(period, datetime.now(timezone.utc)):
+            return None
+        return board
+
+    def top(self, period: str, limit: int) -> Dict:
+        """上位 limit 件（先に sync で未読分を反映しておく）"""
+        board = self._current(period)
+        return {
+            "period": period,
+            "key": period_key(period, datetime.now(timezone.utc)),
+            "entries": board.top(limit) if board else [],
+            "total_users": len(board.scores) if board else 0,
+        }
+
+    def rank_of(self, period: str, user_id: str) -> Dict:
+        """ユーザーの順位（記録がなければ rank は None。先に sync で未読分を反映しておく）"""
+        board = self._current(period)
+        entry = board.rank_of(user_id) if board else None
+        key = period_key(period, datetime.now(timezone.utc))
+        return {
+            "period": period,
+            "key": key,
+            "player": player_id(key, user_id),
+            "rank": entry["rank"] if entry else None,
+            "score": entry["score"] if entry else 0,
+            "total_users": len(board.scores) if board else 0,
+        }
+
+    def snapshot_due(self) -> bool:
+        return time.monotonic() - self._last_snapshot >= self.snapshot_interval
+
+    def snapshot_payload(self) -> Dict:
+        """スナップショットの内容（書き込みは別スレッドで行えるよう、ここで複製する）"""
+        self._last_snapshot = time.monotonic()
+        return {
+            "offset": self._offset,
+            "answered": list(self._answered.items()),
+            "boards": {
+                period: {"key": board.key, "scores": dict(board.scores)}
+                for period, board in self.boards.items()
+            },
+        }
+
+    def write_snapshot(self, payload: Dict):
+        """
+        スナップショットを保存し、スナップショットに含めたイベントをログから削除する（別スレッドで呼べる）
+        ログは未反映の分だけを新しいファイルに写して置き換える（他のワーカーの追記とはロックで排他にする）
+        """
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                events = open(self.events_path, "rb")
+            except FileNotFoundError:
+                events = None
+            try:
+                base, header = _read_header(events) if events is not None else (0, 0)
+                if payload["offset"] < base:
+                    # 他のワーカーがより新しいスナップショットで圧縮済み
+                    return
+                tmp = self.snapshot_path.with_suffix(f".{os.getpid()}.tmp")
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(payload, f, separators=(",", ":"))
+                tmp.replace(self.snapshot_path)
+
+                # fcntl のない環境では追記と排他にできないので圧縮しない
+                if events is None or fcntl is None or payload["offset"] - base < self.compact_bytes:
+                    return
+                events.seek(header + payload["offset"] - base)
+                tmp = self.events_path.with_suffix(f".{os.getpid()}.tmp")
+                with open(tmp, "wb") as f:
+                    f.write(EVENTS_HEADER + b"%d}\n" % payload["offset"])
+                    shutil.copyfileobj(events, f)
+                tmp.replace(self.events_path)
+                logger.info("compacted leaderboard events", extra={"base": payload["offset"]})
+            finally:
+                if events is not None:
+                    events.close()
@@ -4,20 +4,44 @@ FastAPIを使用した鳥の識別クイズのバックエンドサーバー
 音声データはsoundフォルダの音声ファイルを使用
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-from typing import Optional, List, Dict
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Tuple
+import asyncio
+import hashlib
 import json
+import logging
 import random
 import time
 import os
 from pathlib import Path
-from datetime import datetime
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from email.utils import format_datetime
+from functools import partial
 from urllib.parse import quote
 
+from api.admission import AdmissionMiddleware
+from api.answer_analytics import AnswerAnalytics
+from api.answer_recorder import AnswerRecorder
+from api.audio_server import AudioServer
+from api.bulk_download import MAX_BULK_FILES, ZipSource, arcname_from_url, is_allowed_url, iter_zip
+from api.catalog import Catalog
+from api.leaderboard import ANSWER_WINDOW as LEADERBOARD_ANSWER_WINDOW, JST, PERIODS, Leaderboard
+from api import metrics
+from api.name_search import MAX_SUGGESTIONS, NameSearchIndex
+from api.profiling import ProfilingMiddleware
+from api.quiz_rooms import RoomError, RoomManager
+from api.sharding import ShardMap
+from api.quiz_token import make_question_id, make_session_token, parse_question_id, parse_session_token
+from api.shuffle_bag import ShuffleBag
+from api.structured_log import RequestIdMiddleware, setup_logging
+from api.storage import LocalStorage, open_storage
+from api.supabase_auth import user_id_from_authorization
+from api.traffic_capture import TrafficCapture, TrafficCaptureMiddleware
+from api.visuals import VisualIndex
+
 # アプリケーション初期化
 app = FastAPI(
     title="鳥の鳴き声クイズ API (ローカル音声版)",
@@ -25,59 +49,168 @@ app = FastAPI(
     version="2.0.0"
 )
 
-# CORS設定
+# データファイルのパス
+# Docker環境では /app から実行されるため、環境変数でベースディレクトリを指定可能にする
+BASE_DIR = Path(os.environ.get("APP_BASE_DIR", Path(__file__).resolve().parent.parent))
+SOUND_DIR = BASE_DIR / "sound"
+SOUND_FILES_JSON = BASE_DIR / "api" / "sound_files.json"
+# カタログ（api/build_catalog.py で作成）。イメージを作り直さずに差し替える場合は永続ボリュームを指定する
+CATALOG_PATH = Path(os.environ.get("CATALOG_PATH", BASE_DIR / "birdVoiceSearch" / "catalog.arrow"))
+# スペクトログラム・波形（api/build_visuals.py で作成）
+VISUALS_DIR = Path(os.environ.get("VISUALS_DIR", BASE_DIR / "visuals"))
+
+# 音声ファイルの保存先（AUDIO_STORAGE_URL が未設定なら SOUND_DIR、S3互換ならディスクキャッシュ付き）
+audio_storage = open_storage(SOUND_DIR, BASE_DIR / "data" / "audio_cache")
+
+# 録音の配信を複数のノードで分担する場合の担当（SHARD_NODES / SHARD_SELF、未設定なら全録音を配信する）
+shard_map = ShardMap.from_env()
+
+# ログはキュー経由でバックグラウンドのスレッドが書き出す（logs/api.log にも出力）
+setup_logging(BASE_DIR / "logs")
+logger = logging.getLogger("api")
+
+# デバッグ用: パス情報を出力
+logger.info("config", extra={
+    "base_dir": str(BASE_DIR),
+    "sound_dir": str(SOUND_DIR),
+    "sound_dir_exists": SOUND_DIR.exists(),
+    "audio_storage": str(audio_storage),
+    "shard": shard_map.self_node if shard_map else None,
+    "sound_files_json": str(SOUND_FILES_JSON),
+    "sound_files_json_exists": SOUND_FILES_JSON.exists(),
+    "catalog_path": str(CATALOG_PATH),
+    "catalog_exists": CATALOG_PATH.exists(),
+})
+
+# リクエスト単位のプロファイリング（PROFILE_ALL / PROFILE_SAMPLE_RATE / PROFILE_ADMIN_SECRET で有効化）
+app.add_middleware(ProfilingMiddleware, output_dir=BASE_DIR / "logs" / "profiles")
+
+# 流入制御（同時処理数の上限、クライアントごとのレート制限）
+app.add_middleware(AdmissionMiddleware)
+
+# メトリクス（ルート別のリクエスト数・処理時間、/audio の配信バイト数）
+app.add_middleware(metrics.MetricsMiddleware)
+
+# CORS設定（流入制御の外側に置き、429・503 の応答にもCORSヘッダーを付ける）
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # 本番環境では適切に設定すること
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
-# データファイルのパス
-# Docker環境では /app から実行されるため、環境変数でベースディレクトリを指定可能にする
-BASE_DIR = Path(os.environ.get("APP_BASE_DIR", Path(__file__).resolve().parent.parent))
-SOUND_DIR = BASE_DIR / "sound"
-SOUND_FILES_JSON = BASE_DIR / "api" / "sound_files.json"
+# 負荷試験で再生するためのトラフィックの記録（TRAFFIC_CAPTURE=1 のときのみ、流入制御で拒否したものも含める）
+traffic_capture = TrafficCapture.from_env(BASE_DIR / "logs" / "traffic")
+if traffic_capture is not None:
+    app.add_middleware(TrafficCaptureMiddleware, capture=traffic_capture)
 
-# デバッグ用: パス情報を出力
-print(f"[Config] BASE_DIR: {BASE_DIR}")
-print(f"[Config] SOUND_DIR: {SOUND_DIR} (exists: {SOUND_DIR.exists()})")
-print(f"[Config] SOUND_FILES_JSON: {SOUND_FILES_JSON} (exists: {SOUND_FILES_JSON.exists()})")
+# リクエストIDの付与とアクセスログ（最も外側で処理する）
+app.add_middleware(RequestIdMiddleware)
 
 # グローバルデータの読み込み
-sound_files_data: Optional[Dict] = None
+catalog: Optional[Catalog] = None
+search_index: Optional[NameSearchIndex] = None
+audio_server: Optional[AudioServer] = None
+visual_index = VisualIndex({})
+visuals_server: Optional[AudioServer] = None
+
+# スペクトログラム・波形のファイル名は内容のハッシュなので、ずっとキャッシュしてよい
+VISUALS_CACHE_CONTROL = "public, max-age=31536000, immutable"
 
 
 def load_data():
-    """データファイルを読み込む"""
-    global sound_files_data
+    """
+    データファイルを読み込む
+    カタログ（catalog.arrow）があれば優先し、なければ sound_files.json を読み込む
+    """
+    global catalog, search_index, audio_server, visual_index, visuals_server
     
-    if SOUND_FILES_JSON.exists():
+    if CATALOG_PATH.exists():
+        catalog = Catalog.open(CATALOG_PATH)
+        logger.info("data loaded", extra={"source": "catalog.arrow", "audio_files": len(catalog.sound_files)})
+    elif SOUND_FILES_JSON.exists():
         with open(SOUND_FILES_JSON, 'r', encoding='utf-8') as f:
-            sound_files_data = json.load(f)
-        print(f"[Data] Loaded sound_files.json: {sound_files_data.get('total_success', 0)} audio files")
+            catalog = Catalog.from_sound_files(json.load(f))
+        logger.info("data loaded", extra={"source": "sound_files.json", "audio_files": len(catalog.sound_files)})
     else:
-        print(f"[Data] Warning: sound_files.json not found at {SOUND_FILES_JSON}")
-        print(f"[Data] Please run: python api/parse_sound_files.py")
+        logger.warning(
+            "sound_files.json not found. Please run: python api/parse_sound_files.py",
+            extra={"path": str(SOUND_FILES_JSON)},
+        )
+        return
+    
+    # 種名サジェスト用の索引を作成
+    search_index = NameSearchIndex.from_catalog(catalog)
+    
+    # 音声配信用のファイルディスクリプタ・ヘッダー・小さいファイルの内容を用意（fork するワーカーと共有）
+    # 分担する場合はこのノードの担当の録音だけを開く
+    if shard_map is not None:
+        shard_map.assign(catalog.sound_files)
+    previous_audio_server = audio_server
+    audio_server = AudioServer.from_env(audio_storage, (
+        f['filename'] for f in catalog.sound_files if shard_map is None or shard_map.is_local(f['filename'])))
+    audio_server.preload()
+    if previous_audio_server is not None:
+        previous_audio_server.close()
+    logger.info("audio server ready", extra={"files": len(audio_server.files),
+                                             "cached_bytes": audio_server.cached_bytes})
+    
+    # 取り込み時に作ったスペクトログラム・波形（なければURLを返さない）
+    visual_index = VisualIndex.open(VISUALS_DIR)
+    previous_visuals_server = visuals_server
+    visuals_server = AudioServer(LocalStorage(VISUALS_DIR, extensions=None), visual_index.asset_names(),
+                                 cache_control=VISUALS_CACHE_CONTROL)
+    visuals_server.preload()
+    if previous_visuals_server is not None:
+        previous_visuals_server.close()
+    logger.info("visuals ready", extra={"recordings": len(visual_index.files)})
 
 
 @app.on_event("startup")
 async def startup_event():
-    """アプリケーション起動時にデータを読み込む"""
-    load_data()
+    """
+    アプリケーション起動時にデータを読み込む
+    start.py のマルチワーカー起動では親プロセスで読み込み済みのため何もしない
+    """
+    if catalog is None:
+        load_data()
+    # 書き込みスレッドは fork 後のワーカーごとに起動する
+    if answer_recorder is not None:
+        answer_recorder.start()
+    leaderboard.load()
+    await quiz_rooms.start()
+    metrics.registry.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """キューに残った回答・ランキング・回答の集計・トラフィックの記録・メトリクスを書き込み、クイズルームを終了する"""
+    await quiz_rooms.stop()
+    metrics.registry.stop()
+    if answer_recorder is not None:
+        answer_recorder.stop()
+    if traffic_capture is not None:
+        traffic_capture.close()
+    try:
+        leaderboard.write_snapshot(leaderboard.snapshot_payload())
+    except OSError as e:
+        logger.warning("failed to write leaderboard snapshot", extra={"error": str(e)})
+    try:
+        answer_analytics.write_checkpoint(answer_analytics.take_delta())
+    except (OSError, ValueError) as e:
+        logger.warning("failed to write answer analytics", extra={"error": str(e)})
 
 
 # レスポンスモデル
 class QuizQuestion(BaseModel):
-    """クイズの問題"""
+    """クイズの問題（正解・学名・科名は回答の結果で返す）"""
     question_id: str
     audio_url: str
     audio_source: str  # "local"
-    correct_answer: str
     choices: List[str]
-    scientific_name: Optional[str] = None
-    family: Optional[str] = None  # 科名（日本語）
+    session: Optional[str] = None  # 次の問題を取得するときに渡す出題順のセッション
 
 
 class QuizAnswer(BaseModel):
@@ -93,6 +226,15 @@ class QuizResult(BaseModel):
     message: str
     scientific_name: Optional[str] = None
     family: Optional[str] = None
+    recorded: bool = False  # サーバー側で回答履歴に記録したか
+    spectrogram_url: Optional[str] = None  # 出題した録音のスペクトログラム（PNG）
+    peaks_url: Optional[str] = None  # 出題した録音の波形（audiowaveform 形式のJSON）
+
+
+class QuizScore(BaseModel):
+    """1ラウンドのスコア"""
+    score: int = Field(ge=0)
+    total_questions: int = Field(gt=0, le=100)
 
 
 class BirdInfo(BaseModel):
@@ -102,29 +244,84 @@ class BirdInfo(BaseModel):
     family: Optional[str] = None
     order: Optional[str] = None
     audio_count: int
+    recordings: List[Dict] = []  # 録音ごとの音声・スペクトログラム・波形のURL
+
 
+# 出題順のセッションの有効期間（秒）。過ぎたら新しい順番で出題する
+QUIZ_SESSION_TTL = int(os.environ.get("QUIZ_SESSION_TTL", 6 * 3600))
 
 # 一時的な問題保存用（本番ではRedisなどを使用）
 quiz_sessions: Dict[str, Dict] = {}
 
+metrics.registry.gauge_callback(
+    "tori_quiz_sessions", "保持している問題セッション数", lambda: {(): len(quiz_sessions)})
+
+# 回答履歴の記録（DATABASE_URL が設定されている場合のみ）
+answer_recorder = AnswerRecorder.from_env(BASE_DIR / "logs")
+if answer_recorder is not None:
+    metrics.registry.gauge_callback(
+        "tori_answer_queue_depth", "書き込み待ちの回答数", lambda: {(): answer_recorder.queue.qsize()})
+
+# 種ごとの正答率・回答時間の集計（差分を定期的にファイルの集計へ足し込む）
+answer_analytics = AnswerAnalytics(
+    Path(os.environ.get("ANALYTICS_DIR", BASE_DIR / "data" / "analytics")),
+    checkpoint_interval=float(os.environ.get("ANALYTICS_CHECKPOINT_INTERVAL", 60)),
+)
+
+# ランキング（イベントログはワーカー間で共有し、各ワーカーがメモリ上で集計する）
+leaderboard = Leaderboard(
+    Path(os.environ.get("LEADERBOARD_DIR", BASE_DIR / "data" / "leaderboard")),
+    snapshot_interval=float(os.environ.get("LEADERBOARD_SNAPSHOT_INTERVAL", 60)),
+    compact_bytes=int(os.environ.get("LEADERBOARD_COMPACT_BYTES", 1024 * 1024)),
+)
+
+
+async def sync_leaderboard():
+    """ランキングにイベントログの未読分を反映（ログ・スナップショットの読み込みは別スレッド）"""
+    leaderboard.apply_pending(await asyncio.to_thread(leaderboard.read_pending))
+
+
+async def snapshot_leaderboard_if_due():
+    """前回から一定時間経っていればランキングのスナップショットを保存（書き込みは別スレッド）"""
+    if not leaderboard.snapshot_due():
+        return
+    try:
+        await asyncio.to_thread(leaderboard.write_snapshot, leaderboard.snapshot_payload())
+    except OSError as e:
+        logger.warning("failed to write leaderboard snapshot", extra={"error": str(e)})
+
+
+async def checkpoint_analytics_if_due():
+    """前回から一定時間経っていれば回答の集計をファイルに足し込む（書き込みは別スレッド）"""
+    if not answer_analytics.checkpoint_due():
+        return
+    try:
+        await asyncio.to_thread(answer_analytics.write_checkpoint, answer_analytics.take_delta())
+    except (OSError, ValueError) as e:
+        logger.warning("failed to write answer analytics", extra={"error": str(e)})
+
 
 def get_available_birds() -> List[str]:
     """利用可能な鳥のリストを取得"""
-    if not sound_files_data:
+    if not catalog:
         return []
     
-    success_files = sound_files_data.get('success', [])
-    unique_birds = sorted(set(f['bird_name'] for f in success_files))
-    return unique_birds
+    return catalog.available_birds
 
 
 def get_audio_files_for_bird(bird_name: str) -> List[Dict]:
     """指定した鳥の音声ファイルを取得"""
-    if not sound_files_data:
+    if not catalog:
         return []
     
-    success_files = sound_files_data.get('success', [])
-    return [f for f in success_files if f['bird_name'] == bird_name]
+    return catalog.audio_files_by_bird.get(bird_name, [])
+
+
+def audio_url_for(filename: str) -> str:
+    """録音のURL（分担する場合、担当が他のノードなら絶対URL）"""
+    if shard_map is not None:
+        return shard_map.audio_url(filename)
+    return f"/audio/{quote(filename, safe='')}"
 
 
 def get_bird_info(bird_name: str) -> Optional[Dict]:
@@ -164,27 +361,30 @@ async def health_check():
     """ヘルスチェック"""
     available_birds = get_available_birds()
     
-    # 音声ディレクトリの状態を確認
-    sound_dir_exists = SOUND_DIR.exists()
-    audio_files_count = 0
-    if sound_dir_exists:
-        audio_files_count = len(list(SOUND_DIR.glob("*.mp3")))
-    
     return {
         "status": "healthy",
-        "data_loaded": sound_files_data is not None,
+        "data_loaded": catalog is not None,
         "available_birds_count": len(available_birds),
         "audio_source": "local",
         "sound_dir": str(SOUND_DIR),
-        "sound_dir_exists": sound_dir_exists,
-        "audio_files_count": audio_files_count,
+        "sound_dir_exists": SOUND_DIR.exists(),
+        "audio_storage": str(audio_storage),
+        "shard": {"node": shard_map.self_node, "nodes": len(shard_map.nodes)} if shard_map else None,
+        # 配信できる音声ファイル数（保存先の一覧はカタログの読み込み時に取得済み）
+        "audio_files_count": len(audio_server.files) if audio_server else 0,
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus形式のメトリクス"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/api/species")
 async def get_species_list():
     """利用可能な鳥の種名一覧を取得"""
-    if not sound_files_data:
+    if not catalog:
         raise HTTPException(status_code=500, detail="データが読み込まれていません")
     
     available_birds = get_available_birds()
@@ -206,13 +406,14 @@ async def get_species_list():
 
 
 @app.get("/api/quiz/question")
-async def get_quiz_question():
+async def get_quiz_question(session: Optional[str] = Query(default=None, max_length=100)):
     """
     クイズの問題を生成
     soundフォルダの音声ファイルを使用
     選択肢は正解の鳥の名前を含む4択
+    session（前の問題のレスポンスの session）を渡すと、全種を出し切るまで同じ種を出題しない
     """
-    if not sound_files_data:
+    if not catalog:
         raise HTTPException(status_code=500, detail="データが読み込まれていません")
     
     available_birds = get_available_birds()
@@ -223,75 +424,321 @@ async def get_quiz_question():
             detail="出題には最低4種類の鳥が必要です"
         )
     
-    # ランダムに正解の鳥を選択
-    correct_bird = random.choice(available_birds)
+    # 出題順のセッションから正解の鳥と録音を選ぶ（期限切れ・不正なら新しいセッションを始める）
+    now = time.time()
+    state = parse_session_token(session) if session else None
+    if state is None or now - state[2] > QUIZ_SESSION_TTL:
+        state = (random.getrandbits(64), 0, int(now))
+    seed, position, started_at = state
+    # 乱数は問題IDの正解の暗号化にも使うため、同じミリ秒に出題しても重ならないようにする
+    correct_bird, question = pick_question(seed, position, int(now * 1000), random.getrandbits(32))
+    question.session = make_session_token(seed, position + 1, started_at)
+    
+    # セッションに保存
+    bird_info = get_bird_info(correct_bird) or {}
+    quiz_sessions[question.question_id] = {
+        "correct_answer": correct_bird,
+        "scientific_name": bird_info.get('scientific_name'),
+        "family_jp": bird_info.get('family_jp'),
+        "clip": parse_question_id(question.question_id).clip,
+        "issued_at": now,
+    }
+    
+    metrics.quiz_questions_total.inc(correct_bird)
+    
+    return question
+
+
+def pick_question(seed: int, position: int, issued_at_ms: int, nonce: int) -> Tuple[str, QuizQuestion]:
+    """出題順（乱数の種 seed の ShuffleBag）の position 番目の問題を作る（(正解の鳥, 問題) を返す）"""
+    bag = ShuffleBag(seed)
+    correct_bird, occurrence = bag.species(get_available_birds(), position)
+    audio_files = get_audio_files_for_bird(correct_bird)
+    selected_file = bag.recording(correct_bird, audio_files, occurrence) if audio_files else None
+    return correct_bird, build_question(correct_bird, random, issued_at_ms, nonce, selected_file)
+
+
+def build_question(correct_bird: str, rng: random.Random, issued_at_ms: int, nonce: int,
+                   selected_file: Optional[Dict] = None) -> QuizQuestion:
+    """
+    正解の鳥から問題を作る（音声（selected_file がなければ）・不正解の選択肢・並び順は rng で決める）
+    問題IDには正解を暗号化・署名して埋め込み、他のワーカーでも回答を判定できるようにする
+    """
     audio_files = get_audio_files_for_bird(correct_bird)
     
     if not audio_files:
         raise HTTPException(status_code=500, detail="音声ファイルが見つかりません")
     
-    # ランダムに1つの音声を選択
-    selected_file = random.choice(audio_files)
-    
-    # 鳥の情報を取得
-    bird_info = get_bird_info(correct_bird)
+    # 指定がなければランダムに1つの音声を選択
+    if selected_file is None:
+        selected_file = rng.choice(audio_files)
     
     # 不正解の選択肢を作成（正解以外からランダムに3つ）
-    other_birds = [b for b in available_birds if b != correct_bird]
-    wrong_choices = random.sample(other_birds, min(3, len(other_birds)))
+    other_birds = [b for b in get_available_birds() if b != correct_bird]
+    wrong_choices = rng.sample(other_birds, min(3, len(other_birds)))
     
     # 選択肢を作成（正解 + 不正解3つ）
     choices = [correct_bird] + wrong_choices
-    random.shuffle(choices)
+    rng.shuffle(choices)
     
-    # 問題IDを生成
-    question_id = f"q_{int(time.time())}_{random.randint(1000, 9999)}"
-    
-    # セッションに保存
-    quiz_sessions[question_id] = {
-        "correct_answer": correct_bird,
-        "scientific_name": bird_info['scientific_name'] if bird_info else None,
-        "family_jp": bird_info['family_jp'] if bird_info else None,
-        "created_at": datetime.now().isoformat(),
-    }
-    
-    # 音声ファイルのURL（日本語ファイル名をURLエンコード）
-    encoded_filename = quote(selected_file['filename'], safe='')
-    audio_url = f"/audio/{encoded_filename}"
+    # 音声ファイルのURL（日本語ファイル名をURLエンコード、担当が他のノードならそのノードのURL）
+    audio_url = audio_url_for(selected_file['filename'])
     
     return QuizQuestion(
-        question_id=question_id,
+        question_id=make_question_id(correct_bird, issued_at_ms, nonce, visual_index.hash_of(selected_file['filename'])),
         audio_url=audio_url,
         audio_source="local",
-        correct_answer=correct_bird,  # デバッグ用（本番では削除）
         choices=choices,
-        scientific_name=bird_info['scientific_name'] if bird_info else None,
-        family=bird_info['family_jp'] if bird_info else None,
     )
 
 
+# 日替わりチャレンジ（日付ごとに生成したレスポンスの本文とETag）
+DAILY_QUESTIONS = int(os.environ.get("DAILY_QUESTIONS", 5))
+daily_challenge_cache: Dict[str, Tuple[bytes, str]] = {}
+
+
+def build_daily_challenge(day: date) -> bytes:
+    """
+    日付から決まるシードで1ラウンド分の問題を作り、JSONにする
+    同じカタログなら全ワーカーで同じ内容になる
+    """
+    seed = hashlib.sha256(f"tori-daily:{day.isoformat()}".encode("utf-8")).digest()
+    rng = random.Random(int.from_bytes(seed[:8], "big"))
+    
+    available_birds = get_available_birds()
+    correct_birds = rng.sample(available_birds, min(DAILY_QUESTIONS, len(available_birds)))
+    issued_at_ms = int(datetime.combine(day, dtime(), tzinfo=JST).timestamp()) * 1000
+    questions = [
+        build_question(bird, rng, issued_at_ms, i).model_dump(exclude={"session"})
+        for i, bird in enumerate(correct_birds)
+    ]
+    return json.dumps(
+        {"date": day.isoformat(), "questions": questions, "count": len(questions)},
+        ensure_ascii=False, separators=(",", ":"),
+    ).encode("utf-8")
+
+
+@app.get("/api/quiz/daily")
+async def get_daily_challenge(if_none_match: Optional[str] = Header(default=None)):
+    """
+    日替わりチャレンジ（全員に同じ1ラウンド分の問題）
+    日本時間の0時まで共有キャッシュ（CDN）に保存できる
+    """
+    if not catalog:
+        raise HTTPException(status_code=500, detail="データが読み込まれていません")
+    if len(get_available_birds()) < 4:
+        raise HTTPException(status_code=500, detail="出題には最低4種類の鳥が必要です")
+    
+    now = datetime.now(JST)
+    today = now.date()
+    key = today.isoformat()
+    cached = daily_challenge_cache.get(key)
+    if cached is None:
+        body = build_daily_challenge(today)
+        cached = (body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"')
+        daily_challenge_cache.clear()
+        daily_challenge_cache[key] = cached
+    body, etag = cached
+    
+    midnight = datetime.combine(today + timedelta(days=1), dtime(), tzinfo=JST)
+    max_age = max(0, int((midnight - now).total_seconds()))
+    headers = {
+        "Cache-Control": f"public, max-age={max_age}, s-maxage={max_age}",
+        "Expires": format_datetime(midnight.astimezone(timezone.utc), usegmt=True),
+        "ETag": etag,
+    }
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @app.post("/api/quiz/answer")
-async def submit_answer(answer: QuizAnswer):
-    """クイズの回答を送信"""
-    if answer.question_id not in quiz_sessions:
-        raise HTTPException(status_code=404, detail="問題が見つかりません")
+async def submit_answer(answer: QuizAnswer, authorization: Optional[str] = Header(default=None)):
+    """
+    クイズの回答を送信
+    ログイン中のユーザー（Authorization: Bearer <Supabaseのアクセストークン>）の回答は履歴に記録し、
+    正解ならランキングに1点加える（同じ問題への2回目以降の回答・出題から ANSWER_WINDOW 秒を過ぎた回答は数えない）
+    正誤と回答にかかった時間は種ごとの集計に加える
+    """
+    answered_at = time.time()
+    session = quiz_sessions.get(answer.question_id)
+    if session is None:
+        # 別のワーカーが出題した問題は問題IDの署名から正解を復元する
+        parsed = parse_question_id(answer.question_id)
+        if parsed is None:
+            raise HTTPException(status_code=404, detail="問題が見つかりません")
+        bird_info = get_bird_info(parsed.answer) or {}
+        session = {
+            "correct_answer": parsed.answer,
+            "scientific_name": bird_info.get('scientific_name'),
+            "family_jp": bird_info.get('family_jp'),
+            "clip": parsed.clip,
+            "issued_at": parsed.issued_at,
+        }
     
-    session = quiz_sessions[answer.question_id]
     correct_answer = session["correct_answer"]
     is_correct = answer.user_answer == correct_answer
+    metrics.quiz_answers_total.inc(correct_answer, "correct" if is_correct else "incorrect")
+    answer_analytics.record(correct_answer, is_correct, answered_at - session["issued_at"])
+    await checkpoint_analytics_if_due()
+    
+    # キューが一杯のときは recorded=False を返し、クライアント側での保存に任せる
+    recorded = False
+    user_id = user_id_from_authorization(authorization)
+    if user_id and answer_recorder is not None:
+        recorded = answer_recorder.record_answer(user_id, correct_answer, is_correct)
+    if user_id and answered_at - session["issued_at"] <= LEADERBOARD_ANSWER_WINDOW:
+        # 問題IDの署名は問題ごとに一意なので、同じ問題への回答の重複の判定に使う
+        leaderboard.record_answer(user_id, answer.question_id.rpartition(".")[2], is_correct)
+        await sync_leaderboard()
+        await snapshot_leaderboard_if_due()
     
+    visuals = visual_index.urls(session.get("clip"))
     return QuizResult(
         is_correct=is_correct,
         correct_answer=correct_answer,
         message="正解！🎉" if is_correct else f"残念... 正解は「{correct_answer}」でした",
         scientific_name=session.get("scientific_name"),
         family=session.get("family_jp"),
+        recorded=recorded,
+        spectrogram_url=visuals.get("spectrogram_url"),
+        peaks_url=visuals.get("peaks_url"),
     )
 
 
+@app.post("/api/quiz/score")
+async def submit_score(result: QuizScore, authorization: Optional[str] = Header(default=None)):
+    """
+    1ラウンドのスコアを記録（履歴のみ）
+    ランキングの得点はクライアントが送る値ではなく、/api/quiz/answer で判定した回答から加算する
+    """
+    if result.score > result.total_questions:
+        raise HTTPException(status_code=400, detail="スコアが問題数を超えています")
+    user_id = user_id_from_authorization(authorization)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="ログインが必要です")
+    
+    recorded = answer_recorder is not None and answer_recorder.record_score(
+        user_id, result.score, result.total_questions)
+    return {"recorded": recorded}
+
+
+def build_room_question(seed: int, position: int) -> Dict:
+    """クイズルームの問題（ルームごとの出題順で作る）"""
+    if not catalog or len(get_available_birds()) < 4:
+        raise RoomError("出題には最低4種類の鳥が必要です")
+    correct_bird, question = pick_question(seed, position, int(time.time() * 1000), 0)
+    metrics.quiz_questions_total.inc(correct_bird)
+    bird_info = get_bird_info(correct_bird) or {}
+    return {
+        "audio_url": question.audio_url,
+        "choices": question.choices,
+        "correct_answer": correct_bird,
+        "scientific_name": bird_info.get('scientific_name'),
+        "family": bird_info.get('family_jp'),
+        **visual_index.urls(parse_question_id(question.question_id).clip),
+    }
+
+
+def record_room_answer(species: str, is_correct: bool, latency: float):
+    """クイズルームの回答も種ごとの集計に加える"""
+    metrics.quiz_answers_total.inc(species, "correct" if is_correct else "incorrect")
+    answer_analytics.record(species, is_correct, latency)
+
+
+# クイズルーム（クラス全員で同じ問題に回答する）
+quiz_rooms = RoomManager.from_env(build_room_question, on_answer=record_room_answer)
+
+
+@app.post("/api/rooms")
+async def create_room():
+    """
+    クイズルームを作成
+    参加者は /ws/rooms/<code>?name=<名前> に WebSocket で接続する
+    host_token を付けて接続すると出題（next）・結果の表示（reveal）・終了（close）ができる
+    """
+    if not catalog:
+        raise HTTPException(status_code=500, detail="データが読み込まれていません")
+    try:
+        room = quiz_rooms.create_room()
+    except RoomError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return dict(room, websocket_path=f"/ws/rooms/{room['code']}")
+
+
+@app.websocket("/ws/rooms/{code}")
+async def room_socket(
+    websocket: WebSocket,
+    code: str,
+    name: str = Query(default="", max_length=50),
+    host_token: Optional[str] = Query(default=None, pattern=r"^[A-Za-z0-9_-]{1,64}$"),
+):
+    """クイズルームへの参加（メッセージの形式は api/quiz_rooms.py を参照）"""
+    await quiz_rooms.serve(websocket, code, name, host_token)
+
+
+@app.get("/api/analytics/species")
+async def get_species_analytics(
+    min_answers: int = Query(default=1, ge=1),
+    limit: int = Query(default=50, ge=1, le=1000),
+):
+    """
+    種ごとの回答数・正答率・回答にかかった時間（秒、p50/p90/平均）
+    正答率の低い順（難しい順）。他のワーカーの直近の回答は次のチェックポイントで反映される
+    """
+    return answer_analytics.summary(min_answers=min_answers, limit=limit)
+
+
+@app.get("/api/leaderboard/{period}")
+async def get_leaderboard(period: str, limit: int = Query(default=10, ge=1, le=100)):
+    """
+    ランキングの上位（period: daily / weekly / all、日本時間で区切る）
+    ユーザーは期間ごとの識別子（player）で返し、ユーザーIDは公開しない
+    """
+    if period not in PERIODS:
+        raise HTTPException(status_code=404, detail="期間は daily / weekly / all のいずれかです")
+    
+    await sync_leaderboard()
+    result = leaderboard.top(period, limit)
+    await snapshot_leaderboard_if_due()
+    return result
+
+
+@app.get("/api/leaderboard/{period}/me")
+async def get_my_rank(period: str, authorization: Optional[str] = Header(default=None)):
+    """ログイン中のユーザーの順位（player はランキングの上位の player と同じ識別子）"""
+    if period not in PERIODS:
+        raise HTTPException(status_code=404, detail="期間は daily / weekly / all のいずれかです")
+    user_id = user_id_from_authorization(authorization)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="ログインが必要です")
+    
+    await sync_leaderboard()
+    return leaderboard.rank_of(period, user_id)
+
+
+@app.get("/api/search/suggest")
+async def suggest_species(
+    q: str = Query(..., min_length=1, max_length=50),
+    limit: int = Query(default=10, ge=1, le=MAX_SUGGESTIONS),
+):
+    """
+    鳥の名前の入力補完
+    和名（ひらがな・半角カナ可）、学名、科名の前方一致で候補を返す
+    """
+    if not search_index:
+        raise HTTPException(status_code=500, detail="データが読み込まれていません")
+    
+    results = search_index.suggest(q, limit=limit)
+    return {"query": q, "results": results, "count": len(results)}
+
+
 @app.get("/api/bird/{species_name}")
 async def get_bird_detail(species_name: str):
-    """鳥の詳細情報を取得"""
+    """鳥の詳細情報を取得（ひらがな・半角カナでも可）"""
+    if catalog:
+        species_name = catalog.resolve_bird_name(species_name) or species_name
+    
     bird_info = get_bird_info(species_name)
     
     if not bird_info:
@@ -304,17 +751,98 @@ async def get_bird_detail(species_name: str):
         scientific_name=bird_info['scientific_name'],
         family=bird_info['family_jp'],
         order=bird_info['order_jp'],
-        audio_count=len(audio_files)
+        audio_count=len(audio_files),
+        recordings=[
+            {
+                "filename": f['filename'],
+                "audio_url": audio_url_for(f['filename']),
+                **visual_index.urls(visual_index.hash_of(f['filename'])),
+            }
+            for f in audio_files
+        ],
     )
 
 
-# 静的ファイル（音声ファイル）を配信
-# 注意: StaticFilesは全てのAPIエンドポイントの後にマウントする
-# soundディレクトリが存在する場合のみマウント
-if SOUND_DIR.exists():
-    app.mount("/audio", StaticFiles(directory=str(SOUND_DIR)), name="audio")
-else:
-    print(f"Warning: Sound directory not found at {SOUND_DIR}")
+@app.get("/api/download/zip")
+async def download_zip(
+    species: List[str] = Query(default=[]),
+    url: List[str] = Query(default=[]),
+):
+    """
+    録音をまとめたZIPをストリーミングでダウンロード
+    species: soundフォルダの録音を種名で指定（複数可。分担する場合、他のノードの担当分はそのノードから取得する）
+    url: 外部の録音URLを指定（許可されたホストのみ、複数可）
+    """
+    sources: List[ZipSource] = []
+
+    for species_name in species:
+        audio_files = get_audio_files_for_bird(species_name)
+        if not audio_files:
+            raise HTTPException(status_code=404, detail=f"該当する鳥が見つかりません: {species_name}")
+        for f in audio_files:
+            # 分担する場合、担当が他のノードの録音はそのノードから取得する
+            owner_url = shard_map.owner_url(f['filename']) if shard_map is not None else None
+            if owner_url:
+                sources.append((f['filename'], shard_map.audio_url(f['filename'])))
+            else:
+                sources.append((f['filename'], partial(audio_storage.open, f['filename'])))
+
+    for u in url:
+        if not is_allowed_url(u):
+            raise HTTPException(status_code=400, detail=f"ダウンロードが許可されていないURLです: {u}")
+        sources.append((arcname_from_url(u), u))
+
+    if not sources:
+        raise HTTPException(status_code=400, detail="speciesまたはurlを指定してください")
+    if len(sources) > MAX_BULK_FILES:
+        raise HTTPException(status_code=400, detail=f"一度にダウンロードできるのは{MAX_BULK_FILES}件までです")
+
+    return StreamingResponse(
+        iter_zip(sources),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="tori_recordings.zip"'},
+    )
+
+
+async def serve_audio(scope, receive, send):
+    """
+    音声ファイルを配信（カタログの読み込み時に作った AudioServer に渡す）
+    分担する場合、担当が他のノードの録音はそのノードにリダイレクトする
+    """
+    if shard_map is not None and scope["type"] == "http":
+        filename = scope["path"].rpartition("/")[2]
+        owner_url = shard_map.owner_url(filename)
+        if owner_url is not None:
+            metrics.audio_shard_redirects_total.inc()
+            location = f"{owner_url}/audio/{quote(filename, safe='')}"
+            await send({"type": "http.response.start", "status": 307,
+                        "headers": [(b"location", location.encode("ascii")), (b"content-length", b"0")]})
+            await send({"type": "http.response.body", "body": b""})
+            return
+    if audio_server is None:
+        await send({"type": "http.response.start", "status": 404, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    await audio_server(scope, receive, send)
+
+
+# 音声ファイルを配信
+# 注意: 全てのAPIエンドポイントの後にマウントする
+app.mount("/audio", serve_audio, name="audio")
+if isinstance(audio_storage, LocalStorage) and not audio_storage.root.exists():
+    logger.warning("sound directory not found", extra={"path": str(audio_storage.root)})
+
+
+async def serve_visuals(scope, receive, send):
+    """スペクトログラム・波形を配信（ファイル名は内容のハッシュ）"""
+    if visuals_server is None:
+        await send({"type": "http.response.start", "status": 404, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    await visuals_server(scope, receive, send)
+
+
+app.mount("/visuals", serve_visuals, name="visuals")
 
 
 if __name__ == "__main__":
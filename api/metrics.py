@@ -0,0 +1,432 @@
+"""
+Prometheus形式のメトリクス
+記録はスレッドごとの集計領域（シャード）に書き込むだけでロックを取らない
+スクレイプ時（GET /metrics）に全シャードを合算してテキスト形式で出力する
+
+start.py のマルチワーカー起動では、スクレイプはどれか1つのワーカーに届く
+各ワーカーは合算した値を共有のディレクトリ（METRICS_DIR）に定期的（METRICS_FLUSH_INTERVAL 秒）に書き、
+スクレイプを受けたワーカーが全ワーカーの値を合算して返す（1プロセスで動かす場合は共有しない）
+  - 終了したワーカーのカウンタ・ヒストグラムは archive.json に足し込んで残す（合計が減らないようにする）
+  - ゲージは動いているワーカーの分だけを合算する
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+# レイテンシのヒストグラムの境界（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+class _Shard:
+    """1スレッド分の集計領域（書き込みは所有スレッドのみ）"""
+
+    __slots__ = ("values",)
+
+    def __init__(self):
+        # メトリクス名 -> ラベル値 -> 値（カウンタ: 数値、ヒストグラム: [各バケット..., 合計]）
+        self.values: Dict[str, Dict[LabelValues, object]] = {}
+
+
+ARCHIVE_NAME = "archive.json"
+LOCK_NAME = ".lock"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _add(merged: Dict[str, Dict], name: str, metric_type: str, labels: LabelValues, value):
+    entry = merged.setdefault(name, {"type": metric_type, "values": {}})
+    values = entry["values"]
+    if isinstance(value, list):
+        current = values.setdefault(labels, [0] * len(value))
+        for i, v in enumerate(value):
+            current[i] += v
+    else:
+        values[labels] = values.get(labels, 0) + value
+
+
+def _read_snapshot(path: Path) -> Dict[str, Dict]:
+    """書き出した値を {名前: {"type", "values": {ラベル値: 値}}} にする"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    merged: Dict[str, Dict] = {}
+    for name, entry in data.items():
+        for labels, value in entry["values"]:
+            _add(merged, name, entry["type"], tuple(labels), value)
+    return merged
+
+
+def _write_snapshot(path: Path, merged: Dict[str, Dict]):
+    data = {name: {"type": entry["type"], "values": [[list(labels), value] for labels, value in entry["values"].items()]}
+            for name, entry in merged.items()}
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    tmp.replace(path)
+
+
+class Registry:
+    """メトリクスの登録と合算"""
+
+    def __init__(self, directory: Optional[Path] = None, flush_interval: float = 1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._owner_pid = os.getpid()
+        self._flusher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._local = threading.local()
+        self._shards: List[_Shard] = []
+        self._shards_lock = threading.Lock()
+        self._metrics: List["_Metric"] = []
+        self._gauge_callbacks: List[Tuple[str, str, Callable[[], Dict[LabelValues, float]], Tuple[str, ...]]] = []
+
+    def _shard(self) -> _Shard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            # スレッドごとに初回だけロックを取って登録する
+            shard = _Shard()
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> "Counter":
+        metric = Counter(self, name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> "Gauge":
+        metric = Gauge(self, name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> "Histogram":
+        metric = Histogram(self, name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge_callback(self, name: str, documentation: str,
+                       callback: Callable[[], Dict[LabelValues, float]], labelnames: Tuple[str, ...] = ()):
+        """スクレイプ時に値を計算するゲージ（例: セッション数）"""
+        self._gauge_callbacks.append((name, documentation, callback, labelnames))
+
+    def _merged(self, name: str) -> Dict[LabelValues, object]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        merged: Dict[LabelValues, object] = {}
+        for shard in shards:
+            # 他スレッドが書き込み中でも壊れないようにコピーしてから読む
+            for labels, value in list(shard.values.get(name, {}).items()):
+                if isinstance(value, list):
+                    current = merged.setdefault(labels, [0] * len(value))
+                    for i, v in enumerate(list(value)):
+                        current[i] += v
+                else:
+                    merged[labels] = merged.get(labels, 0) + value
+        return merged
+
+    def collect(self) -> Dict[str, Dict]:
+        """このプロセスの値（{名前: {"type", "values"}}）"""
+        collected: Dict[str, Dict] = {}
+        for metric in self._metrics:
+            collected[metric.name] = {"type": metric.metric_type, "values": self._merged(metric.name)}
+        for name, _, callback, _ in self._gauge_callbacks:
+            collected[name] = {"type": "gauge", "values": dict(callback())}
+        return collected
+
+    def _snapshot_path(self) -> Path:
+        return self.directory / f"{os.getpid()}.json"
+
+    def flush(self):
+        """このプロセスの値を共有のディレクトリに書く"""
+        if self.directory is None:
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            _write_snapshot(self._snapshot_path(), self.collect())
+        except OSError:
+            pass
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def start(self):
+        """定期的な書き出しを始める（fork 後のワーカーごとに呼ぶ）"""
+        if self.directory is None or (self._flusher is not None and self._flusher.is_alive()):
+            return
+        self._stop.clear()
+        self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+        self._flusher.start()
+
+    def stop(self):
+        """書き出しを止め、最後の値を書く（1プロセスで動かした場合はディレクトリを削除する）"""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+            self._flusher = None
+        if self.directory is None:
+            return
+        if os.getpid() == self._owner_pid:
+            self.cleanup()
+        else:
+            self.flush()
+
+    def cleanup(self):
+        """共有のディレクトリを削除する（start.py の親プロセスが全ワーカーの終了後に呼ぶ）"""
+        if self.directory is None:
+            return
+        for path in self.directory.glob("*"):
+            path.unlink(missing_ok=True)
+        for path in self.directory.glob(".*"):
+            path.unlink(missing_ok=True)
+        try:
+            self.directory.rmdir()
+        except OSError:
+            pass
+
+    def _merge_workers(self) -> Dict[str, Dict]:
+        """全ワーカーの値を合算する（終了したワーカーの値は archive.json に移す）"""
+        own = self.collect()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / LOCK_NAME, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            _write_snapshot(self._snapshot_path(), own)
+            archive_path = self.directory / ARCHIVE_NAME
+            archive = _read_snapshot(archive_path) if archive_path.exists() else {}
+            merged: Dict[str, Dict] = {}
+            archived = False
+            for path in sorted(self.directory.glob("[0-9]*.json")):
+                pid = int(path.stem)
+                try:
+                    snapshot = own if pid == os.getpid() else _read_snapshot(path)
+                except (OSError, ValueError):
+                    continue
+                alive = pid == os.getpid() or _alive(pid)
+                for name, entry in snapshot.items():
+                    if not alive and entry["type"] == "gauge":
+                        continue
+                    for labels, value in entry["values"].items():
+                        _add(archive if not alive else merged, name, entry["type"], labels, value)
+                if not alive:
+                    path.unlink(missing_ok=True)
+                    archived = True
+            if archived:
+                _write_snapshot(archive_path, archive)
+        for name, entry in archive.items():
+            for labels, value in entry["values"].items():
+                _add(merged, name, entry["type"], labels, value)
+        return merged
+
+    def render(self) -> str:
+        """Prometheusのテキスト形式で出力"""
+        if self.directory is not None:
+            try:
+                merged = self._merge_workers()
+            except OSError:
+                merged = self.collect()
+        else:
+            merged = self.collect()
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render(merged.get(metric.name, {}).get("values", {})))
+        for name, documentation, _, labelnames in self._gauge_callbacks:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in merged.get(name, {}).get("values", {}).items():
+                lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Tuple[str, ...], labels: LabelValues, extra: str = "") -> str:
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    metric_type = ""
+
+    def __init__(self, registry: Registry, name: str, documentation: str, labelnames: Tuple[str, ...]):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def _values(self) -> Dict[LabelValues, object]:
+        shard = self.registry._shard()
+        values = shard.values.get(self.name)
+        if values is None:
+            values = shard.values[self.name] = {}
+        return values
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        values = self._values()
+        values[labels] = values.get(labels, 0) + amount
+
+    def render(self, merged: Dict[LabelValues, object]) -> List[str]:
+        lines = self._header()
+        for labels, value in sorted(merged.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """増減するゲージ（各シャードの増減を合算する）"""
+    metric_type = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, registry: Registry, name: str, documentation: str, labelnames: Tuple[str, ...],
+                 buckets: Tuple[float, ...]):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels: str):
+        values = self._values()
+        counts = values.get(labels)
+        if counts is None:
+            # 各バケット（+Inf含む）の件数と合計値
+            counts = values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self, merged: Dict[LabelValues, object]) -> List[str]:
+        lines = self._header()
+        for labels, counts in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {counts[-1]!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+# ---------------------------------------------------------------------------
+# APIで使うメトリクス
+# ---------------------------------------------------------------------------
+
+def _default_directory() -> Optional[Path]:
+    """
+    METRICS_DIR（未設定・空文字なら共有せず、このプロセスの値だけを返す）
+    start.py のマルチワーカー起動では、fork 前の親プロセスが一時ディレクトリを設定する
+    """
+    value = os.environ.get("METRICS_DIR")
+    return Path(value) if value else None
+
+
+registry = Registry(_default_directory(), float(os.environ.get("METRICS_FLUSH_INTERVAL", 1.0)))
+
+http_requests_total = registry.counter(
+    "tori_http_requests_total", "HTTPリクエスト数", ("method", "route", "status"))
+http_request_duration_seconds = registry.histogram(
+    "tori_http_request_duration_seconds", "HTTPリクエストの処理時間（秒）", ("method", "route"))
+http_requests_in_flight = registry.gauge(
+    "tori_http_requests_in_flight", "処理中のHTTPリクエスト数")
+audio_bytes_served_total = registry.counter(
+    "tori_audio_bytes_served_total", "配信した音声のバイト数")
+audio_shard_redirects_total = registry.counter(
+    "tori_audio_shard_redirects_total", "担当が他のノードの録音をリダイレクトした数")
+quiz_questions_total = registry.counter(
+    "tori_quiz_questions_total", "出題数（種別）", ("species",))
+quiz_answers_total = registry.counter(
+    "tori_quiz_answers_total", "回答数（種別・正誤別）", ("species", "result"))
+
+
+class MetricsMiddleware:
+    """
+    ルート別のリクエスト数・処理時間・処理中件数と、/audio の配信バイト数を記録するASGIミドルウェア
+    ルートはパスのテンプレート（例: /api/bird/{species_name}）単位で集計する
+    """
+
+    def __init__(self, app, audio_prefix: str = "/audio/"):
+        self.app = app
+        self.audio_prefix = audio_prefix
+        self._route_paths: Optional[Dict[object, str]] = None
+
+    def _route_label(self, scope) -> str:
+        path = scope.get("path", "")
+        if path.startswith(self.audio_prefix):
+            return self.audio_prefix.rstrip("/")
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "other"
+        if self._route_paths is None:
+            # エンドポイント関数 -> パステンプレート の対応表を初回に作る
+            routes = getattr(scope.get("app"), "routes", [])
+            self._route_paths = {getattr(r, "endpoint", None): r.path for r in routes if hasattr(r, "path")}
+        return self._route_paths.get(endpoint, "other")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        body_bytes = 0
+        http_requests_in_flight.inc()
+
+        async def send_wrapper(message):
+            nonlocal status, body_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                body_bytes += len(message.get("body", b""))
+            elif message["type"] == "http.response.zerocopy":
+                body_bytes += message.get("count", 0)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec()
+            route = self._route_label(scope)
+            method = scope.get("method", "")
+            http_requests_total.inc(method, route, str(status))
+            http_request_duration_seconds.observe(time.perf_counter() - start, method, route)
+            if route == self.audio_prefix.rstrip("/") and status < 400:
+                # ファイル別にすると系列数が録音の数だけ増えるため、全体の合計だけを数える
+                audio_bytes_served_total.inc(amount=body_bytes)
@@ -0,0 +1,164 @@
+"""
+鳥の名前の前方一致検索（サジェスト）用の索引
+和名・学名・科名をトライ木に登録し、各ノードに上位候補をあらかじめ保持しておく
+検索は入力文字数分ノードをたどるだけで終わる
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from api.catalog import Catalog, normalize_name
+
+# 各ノードに保持する候補数（=1回に返せる最大件数）
+MAX_SUGGESTIONS = 20
+
+# 一致した項目の種類（数値が小さいほど上位に表示）
+MATCH_PRIORITY = {
+    "japanese_name": 0,
+    "scientific_name": 1,
+    "family": 2,
+}
+
+
+def search_key(text: str) -> str:
+    """検索キーの正規化（和名の正規化に加えて英字を小文字に揃える）"""
+    return normalize_name(text).lower()
+
+
+class _Node:
+    __slots__ = ("children", "top", "exact")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        # このノード以下に登録された候補（順位順、最大MAX_SUGGESTIONS件）
+        self.top: List[int] = []
+        # このノードでキーが完結する候補
+        self.exact: List[int] = []
+
+
+class NameSearchIndex:
+    """種名サジェスト用のトライ木"""
+
+    def __init__(self, species: List[Dict]):
+        """
+        species: japanese_name, scientific_name, family, family_jp, audio_count を持つ辞書のリスト
+        """
+        self.species = species
+        # 候補 = (種のインデックス, 一致した項目)
+        self._candidates: List[Tuple[int, str]] = []
+        self._root = _Node()
+
+        nodes: List[_Node] = [self._root]
+
+        for species_id, s in enumerate(species):
+            for field, value in self._keys(s):
+                key = search_key(value)
+                if not key:
+                    continue
+                candidate_id = len(self._candidates)
+                self._candidates.append((species_id, field))
+
+                # 構築中は top に経路上の全候補を積んでおき、最後に順位付けして絞り込む
+                node = self._root
+                node.top.append(candidate_id)
+                for ch in key:
+                    child = node.children.get(ch)
+                    if child is None:
+                        child = _Node()
+                        node.children[ch] = child
+                        nodes.append(child)
+                    node = child
+                    node.top.append(candidate_id)
+                node.exact.append(candidate_id)
+
+        # 各ノードの上位候補を確定する（同じ種は最上位の一致のみ残す）
+        for node in nodes:
+            node.top = self._rank(node.top)
+            node.exact = self._rank(node.exact)
+
+    @staticmethod
+    def _keys(s: Dict):
+        """1種あたりの検索キー"""
+        yield "japanese_name", s['japanese_name']
+        if s.get('scientific_name'):
+            yield "scientific_name", s['scientific_name']
+            # 種小名だけでも引けるようにする（例: "personata"）
+            parts = s['scientific_name'].split()
+            if len(parts) >= 2:
+                yield "scientific_name", " ".join(parts[1:])
+        if s.get('family_jp'):
+            yield "family", s['family_jp']
+        if s.get('family'):
+            yield "family", s['family']
+
+    def _sort_key(self, candidate_id: int):
+        species_id, field = self._candidates[candidate_id]
+        s = self.species[species_id]
+        return (MATCH_PRIORITY[field], -s.get('audio_count', 0), len(s['japanese_name']), s['japanese_name'])
+
+    def _rank(self, candidate_ids: List[int]) -> List[int]:
+        seen = set()
+        ranked = []
+        for candidate_id in sorted(candidate_ids, key=self._sort_key):
+            species_id = self._candidates[candidate_id][0]
+            if species_id in seen:
+                continue
+            seen.add(species_id)
+            ranked.append(candidate_id)
+            if len(ranked) >= MAX_SUGGESTIONS:
+                break
+        return ranked
+
+    @classmethod
+    def from_catalog(cls, catalog: Catalog) -> "NameSearchIndex":
+        """カタログの出題可能な鳥から索引を作る"""
+        species = []
+        for bird_name in catalog.available_birds:
+            audio_files = catalog.audio_files_by_bird[bird_name]
+            first_file = audio_files[0]
+            species.append({
+                'japanese_name': bird_name,
+                'scientific_name': first_file['scientific_name'],
+                'family': first_file['family'],
+                'family_jp': first_file['family_jp'],
+                'audio_count': len(audio_files),
+            })
+        return cls(species)
+
+    def _find(self, key: str) -> Optional[_Node]:
+        node = self._root
+        for ch in key:
+            node = node.children.get(ch)
+            if node is None:
+                return None
+        return node
+
+    def suggest(self, query: str, limit: int = 10) -> List[Dict]:
+        """
+        前方一致で候補を返す
+        完全一致 → 和名 → 学名 → 科名 の順、同順位は録音数の多い順
+        """
+        key = search_key(query)
+        if not key:
+            return []
+        node = self._find(key)
+        if node is None:
+            return []
+
+        results = []
+        seen = set()
+        for candidate_id in node.exact + node.top:
+            species_id, field = self._candidates[candidate_id]
+            if species_id in seen:
+                continue
+            seen.add(species_id)
+            s = self.species[species_id]
+            results.append({
+                "japanese_name": s['japanese_name'],
+                "scientific_name": s.get('scientific_name'),
+                "family_jp": s.get('family_jp'),
+                "audio_count": s.get('audio_count', 0),
+                "matched": field,
+            })
+            if len(results) >= limit:
+                break
+        return results
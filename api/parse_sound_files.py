@@ -1,27 +1,42 @@
 """
-soundフォルダの音声ファイルから鳥の名前を抽出してJSONファイルを生成するスクリプト
+soundフォルダ（AUDIO_STORAGE_URL を設定した場合はその保存先）の音声ファイルから
+鳥の名前を抽出してJSONファイルを生成するスクリプト
 """
 
 import json
 import re
+import sys
+import unicodedata
 from pathlib import Path
 from typing import Optional, List, Dict
 
+# `python api/parse_sound_files.py` として実行しても api パッケージを参照できるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from api.catalog import fold_kana, normalize_name
+from api.storage import content_hash, open_storage
+
 
 def extract_bird_name_from_filename(filename: str) -> Optional[str]:
     """
     ファイル名から鳥の名前を抽出
     例: "アオサギ　平塚博物館用.mp3" -> "アオサギ"
     例: "アオジ水辺の楽校20231105_084632アオジ　地鳴き.mp3" -> "アオジ"
+    例: "ｶﾜﾗﾋﾜ　地鳴き.mp3" -> "カワラヒワ"（半角カナ・ひらがなはカタカナに正規化）
+    例: "ウグイスのさえずり.mp3" -> "ウグイス"
     """
     # 拡張子を除去
     name_without_ext = filename.replace('.mp3', '').replace('.wav', '').replace('.ogg', '')
     
+    # 半角カナをNFKCで全角に揃える。ひらがなのカタカナへの変換は鳥名の部分だけに行う
+    # （先に全体を変換すると「ウグイスのさえずり」の「のさえずり」まで鳥名になる）
+    name_without_ext = unicodedata.normalize("NFKC", name_without_ext)
+    
     # 最初の全角スペース、半角スペース、または日付/時刻パターンまでを抽出
-    # パターン: カタカナで始まる鳥名
-    match = re.match(r'^([ァ-ヶー]+)', name_without_ext)
+    # パターン: カタカナ（またはひらがなだけ）で始まる鳥名
+    match = re.match(r'^([ァ-ヶー]+|[ぁ-ゖー]+)', name_without_ext)
     if match:
-        return match.group(1)
+        return fold_kana(match.group(1))
     
     return None
 
@@ -30,9 +45,11 @@ def find_bird_in_mokuroku(bird_name: str, mokuroku_list: List[Dict]) -> Optional
     """
     目録データから鳥の情報を検索
     """
+    bird_key = normalize_name(bird_name)
+    
     # 亜種を除外して検索
     for bird in mokuroku_list:
-        if not bird.get('is_subspecies', False) and bird.get('japanese_name') == bird_name:
+        if not bird.get('is_subspecies', False) and normalize_name(bird.get('japanese_name', '')) == bird_key:
             return {
                 'japanese_name': bird['japanese_name'],
                 'scientific_name': bird['scientific_name'],
@@ -46,7 +63,7 @@ def find_bird_in_mokuroku(bird_name: str, mokuroku_list: List[Dict]) -> Optional
     
     # 亜種も含めて検索
     for bird in mokuroku_list:
-        if bird.get('japanese_name') == bird_name:
+        if normalize_name(bird.get('japanese_name', '')) == bird_key:
             return {
                 'japanese_name': bird['japanese_name'],
                 'scientific_name': bird['scientific_name'],
@@ -61,32 +78,40 @@ def find_bird_in_mokuroku(bird_name: str, mokuroku_list: List[Dict]) -> Optional
     return None
 
 
-def parse_sound_files(sound_dir: Path, mokuroku_json_path: Path) -> List[Dict]:
+def parse_sound_files(storage, mokuroku_json_path: Path, previous: Optional[Dict[str, Dict]] = None) -> List[Dict]:
     """
     soundフォルダの音声ファイルをパースして鳥の情報を生成
+    内容のハッシュ（シャーディングに使う）は、前回の結果（previous: ファイル名 -> 前回の1件）と
+    サイズ・更新時刻が同じファイルでは計算し直さない
     """
+    previous = previous or {}
     # 目録データの読み込み
     with open(mokuroku_json_path, 'r', encoding='utf-8') as f:
         mokuroku_list = json.load(f)
     
     # 音声ファイルをスキャン
-    audio_files = []
-    for ext in ['*.mp3', '*.wav', '*.ogg']:
-        audio_files.extend(sound_dir.glob(ext))
+    listing = storage.list()
+    audio_files = sorted(listing)
     
     results = []
     not_found = []
     
-    for audio_file in sorted(audio_files):
-        bird_name = extract_bird_name_from_filename(audio_file.name)
+    for filename in audio_files:
+        bird_name = extract_bird_name_from_filename(filename)
         
         if bird_name:
             bird_info = find_bird_in_mokuroku(bird_name, mokuroku_list)
             
             if bird_info:
+                info = listing[filename]
+                old = previous.get(filename, {})
+                if old.get('content_hash') and old.get('size') == info.size and old.get('mtime') == info.mtime:
+                    digest = old['content_hash']
+                else:
+                    digest = content_hash(storage, filename)
                 results.append({
-                    'filename': audio_file.name,
-                    'filepath': str(audio_file.relative_to(sound_dir.parent)),
+                    'filename': filename,
+                    'filepath': str(Path("sound") / filename),
                     'bird_name': bird_name,
                     'scientific_name': bird_info['scientific_name'],
                     'family': bird_info['family'],
@@ -95,20 +120,23 @@ def parse_sound_files(sound_dir: Path, mokuroku_json_path: Path) -> List[Dict]:
                     'order_jp': bird_info['order_jp'],
                     'genus': bird_info['genus'],
                     'genus_jp': bird_info['genus_jp'],
+                    'content_hash': digest,
+                    'size': info.size,
+                    'mtime': info.mtime,
                 })
-                print(f"✓ {audio_file.name} -> {bird_name} ({bird_info['scientific_name']})")
+                print(f"✓ {filename} -> {bird_name} ({bird_info['scientific_name']})")
             else:
                 not_found.append({
-                    'filename': audio_file.name,
+                    'filename': filename,
                     'extracted_name': bird_name
                 })
-                print(f"✗ {audio_file.name} -> {bird_name} (目録に見つかりません)")
+                print(f"✗ {filename} -> {bird_name} (目録に見つかりません)")
         else:
             not_found.append({
-                'filename': audio_file.name,
+                'filename': filename,
                 'extracted_name': None
             })
-            print(f"✗ {audio_file.name} -> 鳥名を抽出できませんでした")
+            print(f"✗ {filename} -> 鳥名を抽出できませんでした")
     
     return results, not_found
 
@@ -117,17 +145,23 @@ def main():
     """メイン処理"""
     # パスの設定
     base_dir = Path(__file__).resolve().parent.parent
-    sound_dir = base_dir / "sound"
+    storage = open_storage(base_dir / "sound", base_dir / "data" / "audio_cache")
     mokuroku_json = base_dir / "birdVoiceSearch" / "mokuroku_parsed.json"
     output_json = base_dir / "api" / "sound_files.json"
     
-    print(f"Sound directory: {sound_dir}")
+    print(f"Sound storage: {storage}")
     print(f"Mokuroku JSON: {mokuroku_json}")
     print(f"Output JSON: {output_json}")
     print()
     
+    # 前回の結果（内容のハッシュを使い回す）
+    previous = {}
+    if output_json.exists():
+        with open(output_json, 'r', encoding='utf-8') as f:
+            previous = {r['filename']: r for r in json.load(f).get('success', [])}
+    
     # 音声ファイルをパース
-    results, not_found = parse_sound_files(sound_dir, mokuroku_json)
+    results, not_found = parse_sound_files(storage, mokuroku_json, previous)
     
     # 結果を保存
     with open(output_json, 'w', encoding='utf-8') as f:
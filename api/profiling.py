@@ -0,0 +1,123 @@
+"""
+リクエスト単位のプロファイリング（オプトイン）
+以下のいずれかに該当したリクエストをcProfileで計測し、logs/profiles/ に保存する
+
+  PROFILE_ALL=1                 全リクエストを計測
+  PROFILE_SAMPLE_RATE=0.01      指定した割合のリクエストを計測
+  X-Profile-Token ヘッダー      値が PROFILE_ADMIN_SECRET と一致したリクエストを計測
+
+保存数は PROFILE_MAX_FILES（既定100件）までで、古いものから削除する
+計測しないリクエストのコストは乱数1回とヘッダーの確認のみ
+"""
+
+import asyncio
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+PROFILE_HEADER = b"x-profile-token"
+
+logger = logging.getLogger(__name__)
+
+# cProfileは同時に1つしか有効にできないため、計測中のリクエストがあれば他は計測しない
+_profile_lock = threading.Lock()
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class ProfilingMiddleware:
+    """
+    条件に一致したリクエストをcProfileで計測するASGIミドルウェア
+    イベントループ上の処理を計測するため、同時に処理されている他のリクエストの処理も含まれる
+    """
+
+    def __init__(self, app, output_dir: Path, enabled: Optional[bool] = None,
+                 sample_rate: Optional[float] = None, admin_secret: Optional[str] = None,
+                 max_files: Optional[int] = None):
+        self.app = app
+        self.output_dir = output_dir
+        self.enabled = enabled if enabled is not None else os.environ.get("PROFILE_ALL") == "1"
+        self.sample_rate = sample_rate if sample_rate is not None else _env_float("PROFILE_SAMPLE_RATE", 0.0)
+        secret = admin_secret if admin_secret is not None else os.environ.get("PROFILE_ADMIN_SECRET", "")
+        self.admin_secret = secret.encode("utf-8")
+        self.max_files = max_files if max_files is not None else int(os.environ.get("PROFILE_MAX_FILES", 100))
+
+    def _should_profile(self, scope) -> bool:
+        if self.enabled:
+            return True
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return True
+        if self.admin_secret:
+            for name, value in scope.get("headers", ()):
+                if name == PROFILE_HEADER:
+                    return hmac.compare_digest(value, self.admin_secret)
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        if not _profile_lock.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{scope.get('method', '')}"
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile_id.encode("ascii")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                profiler.disable()
+        finally:
+            _profile_lock.release()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            # ファイル書き込みはイベントループを止めないように別スレッドで行う
+            await asyncio.to_thread(self._dump, profiler, profile_id, scope.get("path", ""), elapsed_ms)
+
+    def _dump(self, profiler: cProfile.Profile, profile_id: str, path: str, elapsed_ms: float):
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            route = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_")[:40] or "root"
+            base = self.output_dir / f"{profile_id}_{route}_{elapsed_ms:.0f}ms"
+
+            # snakeviz などで開ける形式と、そのまま読める上位の関数一覧
+            profiler.dump_stats(str(base.with_suffix(".prof")))
+            summary = io.StringIO()
+            summary.write(f"{path} {elapsed_ms:.2f}ms\n\n")
+            pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(30)
+            base.with_suffix(".txt").write_text(summary.getvalue(), encoding="utf-8")
+
+            self._enforce_retention()
+        except OSError as e:
+            logger.warning("failed to write profile", extra={"error": str(e)})
+
+    def _enforce_retention(self):
+        profiles = sorted(self.output_dir.glob("*.prof"), key=lambda p: p.stat().st_mtime)
+        for old in profiles[:max(0, len(profiles) - self.max_files)]:
+            old.unlink(missing_ok=True)
+            old.with_suffix(".txt").unlink(missing_ok=True)
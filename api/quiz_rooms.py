@@ -0,0 +1,728 @@
+"""
+クイズルーム（クラス全員が同じ問題を聞いて回答する）
+
+  POST /api/rooms                     ルームを作成し、6桁のコードと host_token を返す
+  WebSocket /ws/rooms/<コード>?name=   参加（?host_token= を付けると出題・終了の操作ができる）
+
+ルームごとに1問ずつ出題し、回答はルーム内で集計・採点して結果を全員に送る
+- 全員へのメッセージはルームで1回だけJSONにし、同じ文字列を各接続の送信キューに積む
+  送信は接続ごとのタスクが行い、キューが ROOM_OUTBOX_SIZE 件たまった（受信が追いつかない）接続は切断する
+- 回答の途中経過（status）は ROOM_STATUS_INTERVAL 秒に1回にまとめて送る
+- ルームのメモリは参加者数（ROOM_MAX_MEMBERS）と出題中の1問分の回答に比例し、問題の履歴は持たない
+  ワーカーあたりのルーム数は ROOM_MAX_ROOMS まで。参加者のいないルーム・作成から時間の経ったルームは削除する
+
+start.py のマルチワーカー起動では、ルームは作成したワーカー（オーナー）が持つ
+ルームのコードとオーナーの pid は共有のディレクトリ（ROOMS_DIR）に書き、別のワーカーに接続した参加者は
+Unixソケットでオーナーに中継する。全員へのメッセージはワーカーごとに1行だけ送り、受け取ったワーカーが配る
+1行はフィールドのJSON配列（名前・host_token・メッセージに空白や改行があっても区切りがずれない）
+
+  オーナー -> 中継: ["F", コード, JSON]（全員へ） / ["U", コード, 参加者ID, JSON]（1人へ） / ["C", コード[, 参加者ID, クローズコード]]（切断）
+  中継 -> オーナー: ["J", コード, 参加者ID, host_token か null, 名前]（参加） / ["L", コード, 参加者ID]（退出） / ["M", コード, 参加者ID, JSON]（受信）
+"""
+
+import asyncio
+import heapq
+import hmac
+import json
+import logging
+import os
+import secrets
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from api import metrics
+
+logger = logging.getLogger(__name__)
+
+CODE_DIGITS = 6
+NAME_MAX_LENGTH = 20
+# 参加者から受け取るメッセージの最大長（文字数、超えたものは無視する）
+MAX_MESSAGE_LENGTH = 1024
+# 結果に載せる上位の人数
+RANKING_SIZE = 10
+# ワーカー間の1行の最大長と、送信待ちのバイト数の上限（超えたら接続を切る）
+LINE_LIMIT = 1 << 20
+LINK_BUFFER_LIMIT = 16 << 20
+# 正解したときの点数（早く答えるほど最大 SPEED_BONUS 点を加える）
+CORRECT_POINTS = 100
+SPEED_BONUS = 100
+
+# クローズコード
+CLOSE_NORMAL = 1000
+CLOSE_SLOW = 1008
+CLOSE_ROOM_CLOSED = 4000
+CLOSE_NOT_FOUND = 4404
+CLOSE_FULL = 4429
+
+frames_total = metrics.registry.counter(
+    "tori_room_frames_total", "ルームの全員に送ったメッセージ数（種類別）", ("type",))
+deliveries_total = metrics.registry.counter(
+    "tori_room_deliveries_total", "ルームの参加者に届けたメッセージ数（中継先のワーカーで配った分を含む）")
+slow_disconnects_total = metrics.registry.counter(
+    "tori_room_slow_disconnects_total", "送信キューがあふれて切断した接続数")
+
+
+class RoomError(Exception):
+    """ルームを作成できない"""
+
+
+def _dumps(message: Dict) -> str:
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+
+
+class Connection:
+    """WebSocket 1本の送信（上限つきのキューに積み、専用のタスクが順に送る）"""
+
+    def __init__(self, websocket: WebSocket, outbox_size: int):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(outbox_size)
+        self.close_code = CLOSE_NORMAL
+        self.closing = False
+        self.task = asyncio.create_task(self._write())
+
+    def send(self, text: str):
+        if self.closing:
+            return
+        try:
+            self.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            # 受信が追いつかない端末は、送信待ちを捨てて切断する（他の参加者への配信を遅らせない）
+            slow_disconnects_total.inc()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.close(CLOSE_SLOW)
+
+    def close(self, code: int = CLOSE_NORMAL):
+        """送信待ちを送り終えてから切断する"""
+        if self.closing:
+            return
+        self.closing = True
+        self.close_code = code
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            self.task.cancel()
+
+    def stop(self):
+        self.closing = True
+        self.task.cancel()
+
+    async def _write(self):
+        try:
+            while True:
+                text = await self.queue.get()
+                if text is None:
+                    break
+                await self.websocket.send_text(text)
+            await self.websocket.close(self.close_code)
+        except Exception:
+            # 切断済みの接続への送信
+            pass
+
+
+class Link:
+    """ワーカー間の接続（1行が1メッセージ）"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.closed = False
+
+    def send(self, *fields):
+        if self.closed:
+            return
+        if self.writer.transport.get_write_buffer_size() > LINK_BUFFER_LIMIT:
+            logger.warning("room link overflowed")
+            self.close()
+            return
+        self.writer.write(json.dumps(fields, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+
+    @staticmethod
+    def parse(line: bytes) -> Optional[list]:
+        """受け取った1行のフィールド（形式が違えば None）"""
+        try:
+            fields = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(fields, list) or len(fields) < 2 or not all(isinstance(f, str) for f in fields[:3]):
+            return None
+        return fields
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.writer.close()
+
+
+class _RemoteSink:
+    """別のワーカーに接続している参加者への送信"""
+
+    __slots__ = ("link", "code", "member_id")
+
+    def __init__(self, link: Link, code: str, member_id: str):
+        self.link = link
+        self.code = code
+        self.member_id = member_id
+
+    def send(self, text: str):
+        self.link.send("U", self.code, self.member_id, text)
+
+    def close(self, code: int = CLOSE_NORMAL):
+        self.link.send("C", self.code, self.member_id, code)
+
+
+Sink = Union[Connection, _RemoteSink]
+
+
+class Member:
+    __slots__ = ("name", "is_host", "score")
+
+    def __init__(self, name: str, is_host: bool):
+        self.name = name
+        self.is_host = is_host
+        self.score = 0
+
+
+class Room:
+    """1つのルーム（オーナーのワーカーだけが持つ）"""
+
+    def __init__(self, manager: "RoomManager", code: str, host_token: str, seed: int):
+        self.manager = manager
+        self.code = code
+        self.host_token = host_token
+        self.seed = seed
+        self.created_at = self.active_at = time.monotonic()
+        self.members: Dict[str, Member] = {}
+        self.sinks: Dict[str, Sink] = {}
+        # 全員へのメッセージの送り先（このワーカーの接続と、参加者のいる中継先のワーカー）
+        self.local: Dict[str, Connection] = {}
+        self.links: Dict[Link, int] = {}
+        self.players = 0
+        self.position = 0
+        # 出題中の問題（結果を送ったら None）
+        self.question: Optional[Dict] = None
+        self.question_frame: Optional[str] = None
+        self.answers: Dict[str, str] = {}
+        self.counts: Dict[str, int] = {}
+        self.deadline: Optional[asyncio.TimerHandle] = None
+        self.status_timer: Optional[asyncio.TimerHandle] = None
+        self.closed = False
+
+    def broadcast(self, message: Dict):
+        """全員に送る（JSONにするのは1回だけ）"""
+        text = _dumps(message)
+        for conn in self.local.values():
+            conn.send(text)
+        for link in self.links:
+            link.send("F", self.code, text)
+        frames_total.inc(message["type"])
+        deliveries_total.inc(amount=len(self.members))
+
+    def join(self, member_id: str, name: str, host_token: Optional[str], sink: Sink) -> bool:
+        if self.closed or len(self.members) >= self.manager.max_members:
+            sink.send(_dumps({"type": "error", "message": "ルームが満員です" if not self.closed else "ルームは終了しました"}))
+            sink.close(CLOSE_FULL)
+            return False
+        is_host = bool(host_token) and hmac.compare_digest(host_token.encode("utf-8"), self.host_token.encode("ascii"))
+        self.members[member_id] = Member(name, is_host)
+        self.players += not is_host
+        self.sinks[member_id] = sink
+        if isinstance(sink, Connection):
+            self.local[member_id] = sink
+        else:
+            self.links[sink.link] = self.links.get(sink.link, 0) + 1
+        self.active_at = time.monotonic()
+
+        sink.send(_dumps({"type": "joined", "code": self.code, "member_id": member_id, "name": name,
+                          "is_host": is_host, "number": self.position}))
+        # 出題中なら途中から参加した人にも同じ問題を送る
+        if self.question_frame is not None:
+            sink.send(self.question_frame)
+        self._schedule_status()
+        return True
+
+    def leave(self, member_id: str):
+        member = self.members.pop(member_id, None)
+        if member is None:
+            return
+        self.players -= not member.is_host
+        sink = self.sinks.pop(member_id)
+        if isinstance(sink, Connection):
+            del self.local[member_id]
+        else:
+            count = self.links[sink.link] - 1
+            if count:
+                self.links[sink.link] = count
+            else:
+                del self.links[sink.link]
+        self.active_at = time.monotonic()
+        if self.closed:
+            return
+        if self.question is not None and member_id not in self.answers and self._all_answered():
+            self.finish_question()
+        else:
+            self._schedule_status()
+
+    def drop_link(self, link: Link):
+        """中継先のワーカーとの接続が切れたら、そこに接続していた参加者を退出させる"""
+        for member_id in [m for m, s in self.sinks.items() if isinstance(s, _RemoteSink) and s.link is link]:
+            self.leave(member_id)
+
+    def receive(self, member_id: str, text: str):
+        member = self.members.get(member_id)
+        if member is None or self.closed:
+            return
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return
+        if not isinstance(data, dict):
+            return
+        self.active_at = time.monotonic()
+        kind = data.get("type")
+        if kind == "answer":
+            self.answer(member_id, data.get("choice"))
+        elif member.is_host:
+            if kind == "next":
+                self.next_question()
+            elif kind == "reveal":
+                if self.question is not None:
+                    self.finish_question()
+            elif kind == "close":
+                self.manager.close_room(self.code)
+
+    def next_question(self):
+        if self.question is not None:
+            self.finish_question()
+        try:
+            question = self.manager.question_factory(self.seed, self.position)
+        except Exception as e:
+            logger.warning("failed to build room question", extra={"room": self.code, "error": str(e)})
+            self.broadcast({"type": "error", "message": "問題を作成できませんでした"})
+            return
+        self.position += 1
+        seconds = self.manager.question_seconds
+        self.question = dict(question, number=self.position, started_at=time.monotonic())
+        self.answers = {}
+        self.counts = {choice: 0 for choice in question["choices"]}
+        message = {
+            "type": "question",
+            "number": self.position,
+            "audio_url": question["audio_url"],
+            "choices": question["choices"],
+            "seconds": seconds,
+            "deadline": round(time.time() + seconds, 3),
+        }
+        self.broadcast(message)
+        self.question_frame = _dumps(message)
+        loop = asyncio.get_running_loop()
+        if self.deadline is not None:
+            self.deadline.cancel()
+        self.deadline = loop.call_later(seconds, self._on_deadline, self.position)
+
+    def answer(self, member_id: str, choice):
+        member = self.members[member_id]
+        if self.question is None or member.is_host or member_id in self.answers or choice not in self.counts:
+            return
+        self.answers[member_id] = choice
+        self.counts[choice] += 1
+        elapsed = time.monotonic() - self.question["started_at"]
+        is_correct = choice == self.question["correct_answer"]
+        if is_correct:
+            remaining = max(0.0, 1 - elapsed / self.manager.question_seconds)
+            member.score += CORRECT_POINTS + round(SPEED_BONUS * remaining)
+        if self.manager.on_answer is not None:
+            self.manager.on_answer(self.question["correct_answer"], is_correct, elapsed)
+        self.sinks[member_id].send(_dumps({"type": "answered", "number": self.position, "choice": choice}))
+        if self._all_answered():
+            self.finish_question()
+        else:
+            self._schedule_status()
+
+    def _all_answered(self) -> bool:
+        return len(self.answers) >= self.players
+
+    def _on_deadline(self, number: int):
+        self.deadline = None
+        if self.question is not None and self.question["number"] == number:
+            self.finish_question()
+
+    def finish_question(self):
+        """正解・選択肢ごとの回答数・得点を全員に送る"""
+        question = self.question
+        self.question = self.question_frame = None
+        if self.deadline is not None:
+            self.deadline.cancel()
+            self.deadline = None
+        players = [(member_id, m) for member_id, m in self.members.items() if not m.is_host]
+        ranking = heapq.nlargest(RANKING_SIZE, players, key=lambda item: item[1].score)
+        self.broadcast({
+            "type": "result",
+            "number": question["number"],
+            "correct_answer": question["correct_answer"],
+            "scientific_name": question.get("scientific_name"),
+            "family": question.get("family"),
+            "spectrogram_url": question.get("spectrogram_url"),
+            "peaks_url": question.get("peaks_url"),
+            "counts": self.counts,
+            "answered": len(self.answers),
+            "players": len(players),
+            # 各自の得点（参加者IDごと）と上位
+            "scores": {member_id: m.score for member_id, m in players},
+            "ranking": [{"name": m.name, "score": m.score} for _, m in ranking],
+        })
+        self.answers = {}
+        self.counts = {}
+
+    def _schedule_status(self):
+        """参加者数・回答数の途中経過（ROOM_STATUS_INTERVAL 秒に1回にまとめる）"""
+        if self.status_timer is None and not self.closed:
+            self.status_timer = asyncio.get_running_loop().call_later(
+                self.manager.status_interval, self._send_status)
+
+    def _send_status(self):
+        self.status_timer = None
+        self.broadcast({
+            "type": "status",
+            "players": self.players,
+            "number": self.position,
+            "answered": len(self.answers) if self.question is not None else None,
+        })
+
+    def close(self):
+        if self.closed:
+            return
+        self.broadcast({"type": "closed"})
+        self.closed = True
+        for timer in (self.deadline, self.status_timer):
+            if timer is not None:
+                timer.cancel()
+        for conn in self.local.values():
+            conn.close(CLOSE_ROOM_CLOSED)
+        for link in self.links:
+            link.send("C", self.code)
+
+
+class ProxyRoom:
+    """別のワーカーが持つルームへの中継（このワーカーに接続した参加者の分だけ）"""
+
+    def __init__(self, manager: "RoomManager", code: str, link: Link):
+        self.manager = manager
+        self.code = code
+        self.link = link
+        self.local: Dict[str, Connection] = {}
+
+    def receive(self, member_id: str, text: str):
+        self.link.send("M", self.code, member_id, text)
+
+    def leave(self, member_id: str):
+        if self.local.pop(member_id, None) is None:
+            return
+        self.link.send("L", self.code, member_id)
+        if not self.local:
+            self.manager.proxies.pop(self.code, None)
+
+    def close(self, code: int = CLOSE_ROOM_CLOSED):
+        for conn in self.local.values():
+            conn.close(code)
+
+
+class RoomManager:
+    """ワーカー内のルームと、他のワーカーとの中継"""
+
+    def __init__(self, question_factory: Callable[[int, int], Dict], rooms_dir: Path,
+                 on_answer: Optional[Callable[[str, bool, float], None]] = None,
+                 max_rooms: int = 1000, max_members: int = 200, question_seconds: float = 20.0,
+                 status_interval: float = 0.5, outbox_size: int = 32,
+                 idle_timeout: float = 600.0, max_age: float = 4 * 3600.0):
+        # question_factory(乱数の種, 出題済みの問題数) は audio_url / choices / correct_answer などの辞書を返す
+        self.question_factory = question_factory
+        self.rooms_dir = rooms_dir
+        self.on_answer = on_answer
+        self.max_rooms = max_rooms
+        self.max_members = max_members
+        self.question_seconds = question_seconds
+        self.status_interval = status_interval
+        self.outbox_size = outbox_size
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.rooms: Dict[str, Room] = {}
+        self.proxies: Dict[str, ProxyRoom] = {}
+        # オーナーのワーカー（pid）への接続と、他のワーカーからの接続
+        self.owner_links: Dict[int, Link] = {}
+        self.peer_links: List[Link] = []
+        self.sockets = 0
+        self._member_seq = 0
+        self._link_lock: Optional[asyncio.Lock] = None
+        self._server = None
+        self._sweeper: Optional[asyncio.Task] = None
+        metrics.registry.gauge_callback("tori_rooms", "このワーカーが持つルーム数", lambda: {(): len(self.rooms)})
+        metrics.registry.gauge_callback("tori_room_sockets", "ルームのWebSocket接続数", lambda: {(): self.sockets})
+
+    @classmethod
+    def from_env(cls, question_factory: Callable[[int, int], Dict],
+                 on_answer: Optional[Callable[[str, bool, float], None]] = None) -> "RoomManager":
+        """
+        環境変数から作る
+        ROOMS_DIR の既定値は、このモジュールを読み込んだプロセス（start.py では fork 前の親プロセス）ごとの一時ディレクトリ
+        """
+        env = os.environ.get
+        rooms_dir = env("ROOMS_DIR") or str(Path(tempfile.gettempdir()) / f"tori_rooms_{os.getpid()}")
+        return cls(
+            question_factory, Path(rooms_dir), on_answer=on_answer,
+            max_rooms=int(env("ROOM_MAX_ROOMS", 1000)),
+            max_members=int(env("ROOM_MAX_MEMBERS", 200)),
+            question_seconds=float(env("ROOM_QUESTION_SECONDS", 20)),
+            status_interval=float(env("ROOM_STATUS_INTERVAL", 0.5)),
+            outbox_size=int(env("ROOM_OUTBOX_SIZE", 32)),
+            idle_timeout=float(env("ROOM_IDLE_TIMEOUT", 600)),
+            max_age=float(env("ROOM_MAX_AGE", 4 * 3600)),
+        )
+
+    def _socket_path(self, pid: int) -> Path:
+        return self.rooms_dir / f"{pid}.sock"
+
+    async def start(self):
+        """中継用のUnixソケットと、古いルームの削除を始める（fork 後のワーカーごとに呼ぶ）"""
+        self.rooms_dir.mkdir(parents=True, exist_ok=True)
+        self._link_lock = asyncio.Lock()
+        if hasattr(asyncio, "start_unix_server"):
+            path = self._socket_path(os.getpid())
+            path.unlink(missing_ok=True)
+            self._server = await asyncio.start_unix_server(self._serve_peer, path=str(path), limit=LINE_LIMIT)
+        self._sweeper = asyncio.create_task(self._sweep())
+
+    async def stop(self):
+        for code in list(self.rooms):
+            self.close_room(code)
+        for proxy in list(self.proxies.values()):
+            proxy.close()
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+        if self._server is not None:
+            self._server.close()
+            self._socket_path(os.getpid()).unlink(missing_ok=True)
+        for link in list(self.owner_links.values()) + self.peer_links:
+            link.close()
+        try:
+            # 最後に終了したワーカーが空のディレクトリを削除する
+            self.rooms_dir.rmdir()
+        except OSError:
+            pass
+
+    # --- ルームの作成・削除 ---
+
+    def _claim(self, code: str) -> bool:
+        """コードを共有のディレクトリに登録する（使用中なら False、オーナーが終了していれば取り直す）"""
+        path = self.rooms_dir / code
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+            except FileExistsError:
+                owner = self._owner(code)
+                if owner is None or owner == os.getpid() or _alive(owner):
+                    return False
+                path.unlink(missing_ok=True)
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(str(os.getpid()))
+            return True
+        return False
+
+    def _owner(self, code: str) -> Optional[int]:
+        try:
+            return int((self.rooms_dir / code).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def create_room(self) -> Dict:
+        """ルームを作成し、コードと host_token を返す"""
+        if len(self.rooms) >= self.max_rooms:
+            raise RoomError("ルームが多すぎます。しばらくしてから作成してください")
+        self.rooms_dir.mkdir(parents=True, exist_ok=True)
+        for _ in range(20):
+            code = f"{secrets.randbelow(10 ** CODE_DIGITS):0{CODE_DIGITS}d}"
+            if code not in self.rooms and self._claim(code):
+                break
+        else:
+            raise RoomError("ルームのコードを割り当てられませんでした")
+        host_token = secrets.token_urlsafe(16)
+        self.rooms[code] = Room(self, code, host_token, secrets.randbits(64))
+        return {"code": code, "host_token": host_token}
+
+    def close_room(self, code: str):
+        room = self.rooms.pop(code, None)
+        if room is None:
+            return
+        room.close()
+        if self._owner(code) == os.getpid():
+            (self.rooms_dir / code).unlink(missing_ok=True)
+
+    async def _sweep(self):
+        """参加者のいないまま ROOM_IDLE_TIMEOUT 秒経ったルームと、作成から ROOM_MAX_AGE 秒経ったルームを削除する"""
+        while True:
+            await asyncio.sleep(min(30.0, self.idle_timeout))
+            now = time.monotonic()
+            for code, room in list(self.rooms.items()):
+                if (now - room.created_at > self.max_age
+                        or (not room.members and now - room.active_at > self.idle_timeout)):
+                    self.close_room(code)
+
+    # --- 参加者の接続 ---
+
+    async def serve(self, websocket: WebSocket, code: str, name: str, host_token: Optional[str]):
+        """WebSocket の接続を受け付け、切断されるまでルームとの間でメッセージを受け渡す"""
+        await websocket.accept()
+        conn = Connection(websocket, self.outbox_size)
+        self._member_seq += 1
+        member_id = f"{os.getpid()}-{self._member_seq}"
+        name = " ".join(name.split())[:NAME_MAX_LENGTH] or "ゲスト"
+        self.sockets += 1
+        target: Union[Room, ProxyRoom, None] = None
+        try:
+            target = await self._join(code, member_id, name, host_token, conn)
+            if target is None:
+                conn.send(_dumps({"type": "error", "message": "ルームが見つかりません"}))
+                conn.close(CLOSE_NOT_FOUND)
+            while True:
+                text = await websocket.receive_text()
+                if target is not None and len(text) <= MAX_MESSAGE_LENGTH:
+                    target.receive(member_id, text)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self.sockets -= 1
+            if target is not None:
+                target.leave(member_id)
+            conn.stop()
+
+    async def _join(self, code: str, member_id: str, name: str, host_token: Optional[str],
+                    conn: Connection) -> Union[Room, ProxyRoom, None]:
+        room = self.rooms.get(code)
+        if room is not None:
+            return room if room.join(member_id, name, host_token, conn) else None
+        if not code.isdigit():
+            return None
+
+        # 別のワーカーが持つルームには中継して参加する
+        proxy = self.proxies.get(code)
+        if proxy is None or proxy.link.closed:
+            owner = self._owner(code)
+            if owner is None or owner == os.getpid():
+                return None
+            link = await self._link_to(owner)
+            if link is None:
+                return None
+            proxy = self.proxies.get(code)
+            if proxy is None or proxy.link.closed:
+                proxy = self.proxies[code] = ProxyRoom(self, code, link)
+        proxy.local[member_id] = conn
+        proxy.link.send("J", code, member_id, host_token, name)
+        return proxy
+
+    # --- ワーカー間の中継 ---
+
+    async def _link_to(self, owner: int) -> Optional[Link]:
+        async with self._link_lock:
+            link = self.owner_links.get(owner)
+            if link is not None and not link.closed:
+                return link
+            try:
+                reader, writer = await asyncio.open_unix_connection(str(self._socket_path(owner)), limit=LINE_LIMIT)
+            except OSError:
+                return None
+            link = self.owner_links[owner] = Link(reader, writer)
+        asyncio.create_task(self._read_owner(owner, link))
+        return link
+
+    async def _read_owner(self, owner: int, link: Link):
+        """オーナーのワーカーからのメッセージを、このワーカーの参加者に配る"""
+        try:
+            while True:
+                line = await link.reader.readline()
+                if not line:
+                    break
+                fields = Link.parse(line)
+                if fields is None:
+                    logger.warning("invalid room link line", extra={"owner": owner})
+                    continue
+                op, code = fields[0], fields[1]
+                proxy = self.proxies.get(code)
+                if proxy is None:
+                    continue
+                if op == "F" and len(fields) == 3:
+                    for conn in proxy.local.values():
+                        conn.send(fields[2])
+                elif op == "U" and len(fields) == 4 and isinstance(fields[3], str):
+                    conn = proxy.local.get(fields[2])
+                    if conn is not None:
+                        conn.send(fields[3])
+                elif op == "C" and len(fields) == 4 and isinstance(fields[3], int):
+                    conn = proxy.local.get(fields[2])
+                    if conn is not None:
+                        conn.close(fields[3])
+                elif op == "C" and len(fields) == 2:
+                    proxy.close()
+        except (OSError, ValueError, asyncio.LimitOverrunError) as e:
+            logger.warning("room link failed", extra={"owner": owner, "error": str(e)})
+        finally:
+            # オーナーのワーカーが終了したら、そのルームの参加者を切断する
+            link.close()
+            if self.owner_links.get(owner) is link:
+                del self.owner_links[owner]
+            for proxy in [p for p in self.proxies.values() if p.link is link]:
+                proxy.close()
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """他のワーカーに接続した参加者の参加・退出・メッセージを、このワーカーのルームに渡す"""
+        link = Link(reader, writer)
+        self.peer_links.append(link)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                fields = Link.parse(line)
+                if fields is None or len(fields) < 3:
+                    # 1行の誤りで中継している参加者全員を切断しない
+                    logger.warning("invalid room link line")
+                    continue
+                op, code, member_id = fields[0], fields[1], fields[2]
+                room = self.rooms.get(code)
+                if op == "J":
+                    if len(fields) != 5 or not isinstance(fields[4], str) or not isinstance(fields[3], (str, type(None))):
+                        logger.warning("invalid room link line")
+                        continue
+                    sink = _RemoteSink(link, code, member_id)
+                    if room is None:
+                        sink.send(_dumps({"type": "error", "message": "ルームが見つかりません"}))
+                        sink.close(CLOSE_NOT_FOUND)
+                    else:
+                        room.join(member_id, fields[4], fields[3], sink)
+                elif room is None:
+                    continue
+                elif op == "L":
+                    room.leave(member_id)
+                elif op == "M" and len(fields) == 4 and isinstance(fields[3], str):
+                    room.receive(member_id, fields[3])
+        except (OSError, ValueError, asyncio.LimitOverrunError) as e:
+            logger.warning("room link failed", extra={"error": str(e)})
+        finally:
+            link.close()
+            self.peer_links.remove(link)
+            for room in list(self.rooms.values()):
+                room.drop_link(link)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
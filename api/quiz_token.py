@@ -0,0 +1,120 @@
+"""
+問題IDの署名
+正解を暗号化・署名して問題IDに埋め込み、問題を出題したワーカー以外でも回答を判定できるようにする
+
+  q_<発行時刻（ミリ秒）>_<乱数>.<暗号化した正解（base64url）>[.<録音のハッシュ>].<署名>
+
+正解は ANSWER_BLOCK バイトの倍数まで埋めてから、鍵と "q_<発行時刻>_<乱数>" から作った
+鍵ストリーム（HMAC-SHA256 のカウンタモード）との XOR で暗号化する（長さからも正解が分からない）
+
+録音のハッシュ（api/visuals.py）は回答時にスペクトログラム・波形のURLを返すために使う
+発行時刻は回答にかかった時間の集計（api/answer_analytics.py）に使う
+
+出題順のセッション（api/shuffle_bag.py）の状態と、ランキングで公開するユーザーの識別子も同じ鍵で作る
+
+  s_<開始時刻>_<乱数の種（16進）>_<出題済みの問題数>.<署名>
+
+署名の鍵は QUIZ_TOKEN_SECRET（未設定なら起動時に生成し、fork したワーカー間で共有）
+複数のコンテナで動かす場合は QUIZ_TOKEN_SECRET を揃えること
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+import secrets
+from typing import NamedTuple, Optional, Tuple
+
+_SECRET = os.environ.get("QUIZ_TOKEN_SECRET", "").encode("utf-8") or secrets.token_bytes(32)
+
+# 署名の長さ（16進文字数）
+SIGNATURE_LENGTH = 16
+# 正解を暗号化する前に埋める単位（バイト、種名はUTF-8で64バイトに収まる）
+ANSWER_BLOCK = 64
+
+_ANSWER_KEY = hmac.new(_SECRET, b"quiz-answer", hashlib.sha256).digest()
+
+
+def _sign(body: str) -> str:
+    return hmac.new(_SECRET, body.encode("utf-8"), hashlib.sha256).hexdigest()[:SIGNATURE_LENGTH]
+
+
+class QuestionToken(NamedTuple):
+    """問題IDに埋め込んだ値"""
+    answer: str
+    clip: Optional[str]
+    issued_at: float  # 発行時刻（UNIX時間、秒）
+
+
+def _keystream(prefix: str, length: int) -> bytes:
+    blocks = [
+        hmac.new(_ANSWER_KEY, f"{prefix}.{counter}".encode("utf-8"), hashlib.sha256).digest()
+        for counter in range((length + 31) // 32)
+    ]
+    return b"".join(blocks)[:length]
+
+
+def _xor(data: bytes, key: bytes) -> bytes:
+    return (int.from_bytes(data, "big") ^ int.from_bytes(key, "big")).to_bytes(len(data), "big")
+
+
+def make_question_id(correct_answer: str, issued_at_ms: int, nonce: int, clip: Optional[str] = None) -> str:
+    """
+    暗号化した正解（と出題した録音のハッシュ）を埋め込んだ問題IDを作る（発行時刻はミリ秒）
+    同じ発行時刻・乱数の組は同じ鍵ストリームになるため、nonce は問題ごとに変えること
+    """
+    prefix = f"q_{issued_at_ms}_{nonce}"
+    plain = correct_answer.encode("utf-8")
+    plain += b"\0" * (ANSWER_BLOCK - len(plain) % ANSWER_BLOCK)
+    sealed = _xor(plain, _keystream(prefix, len(plain)))
+    encoded = base64.urlsafe_b64encode(sealed).decode("ascii").rstrip("=")
+    body = f"{prefix}.{encoded}"
+    if clip:
+        body += f".{clip}"
+    return f"{body}.{_sign(body)}"
+
+
+def parse_question_id(question_id: str) -> Optional[QuestionToken]:
+    """署名を検証して (正解, 録音のハッシュ, 発行時刻) を取り出す（不正なIDなら None）"""
+    body, _, signature = question_id.rpartition(".")
+    if not body or not hmac.compare_digest(signature.encode("utf-8"), _sign(body).encode("ascii")):
+        return None
+    parts = body.split(".")
+    if len(parts) not in (2, 3):
+        return None
+    encoded = parts[1]
+    try:
+        sealed = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+        answer = _xor(sealed, _keystream(parts[0], len(sealed))).rstrip(b"\0").decode("utf-8")
+        issued_at = int(parts[0].split("_")[1]) / 1000
+    except (binascii.Error, UnicodeDecodeError, ValueError, IndexError):
+        return None
+    return QuestionToken(answer, parts[2] if len(parts) == 3 else None, issued_at)
+
+
+def player_id(scope: str, user_id: str) -> str:
+    """
+    ランキングで公開するユーザーの識別子（ランキングの期間ごとに異なり、ユーザーIDに戻せない）
+    """
+    return _sign(f"p_{scope}_{user_id}")
+
+
+def make_session_token(seed: int, position: int, started_at: int) -> str:
+    """出題順のセッションの状態（乱数の種と出題済みの問題数）を署名付きのトークンにする"""
+    body = f"s_{started_at}_{seed:016x}_{position}"
+    return f"{body}.{_sign(body)}"
+
+
+def parse_session_token(token: str) -> Optional[Tuple[int, int, int]]:
+    """署名を検証して (乱数の種, 出題済みの問題数, 開始時刻) を取り出す（不正なトークンなら None）"""
+    body, _, signature = token.rpartition(".")
+    if not body or not hmac.compare_digest(signature.encode("utf-8"), _sign(body).encode("ascii")):
+        return None
+    parts = body.split("_")
+    if len(parts) != 4 or parts[0] != "s":
+        return None
+    try:
+        return int(parts[2], 16), int(parts[3]), int(parts[1])
+    except ValueError:
+        return None
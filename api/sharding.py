@@ -0,0 +1,186 @@
+"""
+録音の配信を複数のノードで分担する（シャーディング）
+
+  SHARD_NODES=a=http://10.0.0.1:8000,b=http://10.0.0.2:8000   ノードの名前とURL（未設定なら分担しない）
+  SHARD_SELF=a                                                このノードの名前
+  SHARD_VNODES=160                                            ノードあたりの仮想ノード数
+
+録音の内容のハッシュ（取り込み時に parse_sound_files.py が書く）をコンシステントハッシュのリングに置いて担当のノードを決める
+- ノードごとに仮想ノードを置き、ノード間の録音数の偏りを小さくする
+- ノードを追加・削除したときに担当が変わるのは、追加・削除したノードの担当分（約 1/ノード数）だけ
+- 担当は名前で決まるため、ノードのURLを変えても録音は移動しない
+- 内容のハッシュのない録音（古い sound_files.json）はファイル名のハッシュで決める
+
+各ノードは担当の録音だけを /audio で配信する（ページキャッシュにも担当分だけが載る）
+問題の audio_url は担当ノードのURLにし、担当外の /audio へのリクエストは担当ノードにリダイレクトする
+
+担当の確認と、ノードに置く録音の同期
+  python api/sharding.py --nodes a=http://localhost:8001,b=http://localhost:8002
+  python api/sharding.py --nodes a=...,b=...,c=... --previous a=...,b=...    # ノードを追加したときに移動する録音
+  python api/sharding.py --nodes a=...,b=... --sync a --output shards/a      # ノード a の担当分だけを shards/a に置く
+"""
+
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+
+# `python api/sharding.py` として実行しても api パッケージを参照できるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+DEFAULT_VNODES = 160
+
+
+def _position(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def file_key(f: Dict) -> str:
+    """リング上の位置を決めるキー（内容のハッシュ、なければファイル名）"""
+    return f.get('content_hash') or "name:" + f['filename']
+
+
+def parse_nodes(value: str) -> Dict[str, str]:
+    """"a=http://host:8000,b=..." を {名前: URL} にする"""
+    nodes: Dict[str, str] = {}
+    for item in value.split(","):
+        name, sep, url = item.strip().partition("=")
+        if not item.strip():
+            continue
+        if not sep or not name or not url:
+            raise ValueError(f"ノードの指定が正しくありません（名前=URL）: {item}")
+        nodes[name.strip()] = url.strip().rstrip("/")
+    return nodes
+
+
+class HashRing:
+    """コンシステントハッシュのリング"""
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = DEFAULT_VNODES):
+        points: List[Tuple[int, str]] = sorted(
+            (_position(f"{node}#{i}"), node) for node in nodes for i in range(vnodes))
+        if not points:
+            raise ValueError("ノードがありません")
+        self._positions = [p for p, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key: str) -> str:
+        """キーの位置から時計回りに最初の仮想ノードのノード"""
+        index = bisect.bisect(self._positions, _position(key))
+        return self._nodes[index % len(self._nodes)]
+
+
+class ShardMap:
+    """録音ごとの担当ノード"""
+
+    def __init__(self, nodes: Dict[str, str], self_node: str, vnodes: int = DEFAULT_VNODES):
+        if self_node not in nodes:
+            raise ValueError(f"SHARD_SELF のノードが SHARD_NODES にありません: {self_node}")
+        self.nodes = nodes
+        self.self_node = self_node
+        self.ring = HashRing(sorted(nodes), vnodes)
+        # ファイル名 -> 担当ノード（カタログの読み込み時に assign で作る）
+        self.owners: Dict[str, str] = {}
+
+    @classmethod
+    def from_env(cls) -> Optional["ShardMap"]:
+        nodes = os.environ.get("SHARD_NODES", "")
+        if not nodes.strip():
+            return None
+        return cls(parse_nodes(nodes), os.environ.get("SHARD_SELF", ""),
+                   int(os.environ.get("SHARD_VNODES", DEFAULT_VNODES)))
+
+    def assign(self, sound_files: Iterable[Dict]):
+        self.owners = {f['filename']: self.ring.node_for(file_key(f)) for f in sound_files}
+
+    def is_local(self, filename: str) -> bool:
+        return self.owners.get(filename, self.self_node) == self.self_node
+
+    def owner_url(self, filename: str) -> Optional[str]:
+        """担当が他のノードならそのURL（このノードの担当なら None）"""
+        owner = self.owners.get(filename, self.self_node)
+        return None if owner == self.self_node else self.nodes[owner]
+
+    def audio_url(self, filename: str) -> str:
+        """録音のURL（担当が他のノードなら絶対URL）"""
+        path = f"/audio/{quote(filename, safe='')}"
+        base = self.owner_url(filename)
+        return base + path if base else path
+
+
+def plan(sound_files: List[Dict], nodes: Dict[str, str], vnodes: int) -> Dict[str, str]:
+    """ファイル名 -> 担当ノード"""
+    ring = HashRing(sorted(nodes), vnodes)
+    return {f['filename']: ring.node_for(file_key(f)) for f in sound_files}
+
+
+def sync_shard(storage, assignment: Dict[str, str], node: str, output_dir: Path) -> Tuple[int, int]:
+    """ノードの担当分を output_dir に置き、担当外のファイルを削除する（(コピー数, 削除数) を返す）"""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    wanted = {name for name, owner in assignment.items() if owner == node}
+    existing = {p.name for p in output_dir.iterdir() if p.is_file() and not p.name.startswith(".")}
+    copied = removed = 0
+    for name in sorted(wanted - existing):
+        tmp = output_dir / f".{name}.tmp"
+        shutil.copyfile(storage.fetch(name), tmp)
+        tmp.replace(output_dir / name)
+        copied += 1
+    for name in sorted(existing - wanted):
+        (output_dir / name).unlink()
+        removed += 1
+    return copied, removed
+
+
+def main():
+    """メイン処理"""
+    from api.storage import open_storage
+
+    base_dir = Path(__file__).resolve().parent.parent
+    parser = argparse.ArgumentParser(description="録音の担当ノードの確認と同期")
+    parser.add_argument("--nodes", required=True, help="ノード（名前=URL のカンマ区切り）")
+    parser.add_argument("--previous", default=None, help="変更前のノード（移動する録音を表示する）")
+    parser.add_argument("--vnodes", type=int, default=DEFAULT_VNODES, help="ノードあたりの仮想ノード数")
+    parser.add_argument("--sound-files", type=Path, default=base_dir / "api" / "sound_files.json")
+    parser.add_argument("--sync", default=None, help="担当分を --output に置くノードの名前")
+    parser.add_argument("--output", type=Path, default=None, help="--sync の出力先（そのノードの AUDIO_STORAGE_URL にする）")
+    args = parser.parse_args()
+
+    with open(args.sound_files, "r", encoding="utf-8") as f:
+        sound_files = json.load(f).get('success', [])
+    nodes = parse_nodes(args.nodes)
+    assignment = plan(sound_files, nodes, args.vnodes)
+    missing_hash = sum(1 for f in sound_files if not f.get('content_hash'))
+    sizes = {f['filename']: f.get('size') or 0 for f in sound_files}
+
+    print(f"録音: {len(sound_files)}件（内容のハッシュなし: {missing_hash}件）")
+    for node in sorted(nodes):
+        names = [name for name, owner in assignment.items() if owner == node]
+        total = sum(sizes[name] for name in names)
+        print(f"  {node}: {len(names)}件 / {total / 1024 / 1024:.1f}MB（{nodes[node]}）")
+
+    if args.previous:
+        before = plan(sound_files, parse_nodes(args.previous), args.vnodes)
+        moved = [name for name in assignment if before[name] != assignment[name]]
+        ratio = len(moved) / len(assignment) if assignment else 0.0
+        print(f"移動する録音: {len(moved)}件（{ratio:.1%}）")
+        for name in moved[:20]:
+            print(f"  {before[name]} -> {assignment[name]}: {name}")
+        if len(moved) > 20:
+            print(f"  ...ほか{len(moved) - 20}件")
+
+    if args.sync:
+        if args.sync not in nodes or args.output is None:
+            parser.error("--sync にはノードの名前と --output を指定してください")
+        storage = open_storage(base_dir / "sound", base_dir / "data" / "audio_cache")
+        copied, removed = sync_shard(storage, assignment, args.sync, args.output)
+        print(f"{args.sync} の担当分を {args.output} に同期しました（コピー: {copied}件 / 削除: {removed}件）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+出題順のシャッフルバッグ
+セッションごとの乱数の種から、種（鳥）と録音を重複なく順に決める
+
+- 位置 i の要素は、鍵付きの並べ替え（Feistel 構造 + cycle walking）の i 番目として O(1) で求める
+  並べ替えの表は持たないため、セッションあたりの状態は (種, 位置) だけ
+- 全種を出し切ったら次の周回の並べ替えに移る（周回の境目で同じ種が続かないようにする）
+- 録音は、その種が何回目に出題されたかで同じように選ぶ（全録音を出し切るまで同じ録音は出ない）
+
+状態は署名付きのトークン（api/quiz_token.py）としてクライアントに渡すため、どのワーカーでも続きを出題できる
+"""
+
+import hashlib
+from typing import Dict, List, Tuple
+
+# Feistel 構造のラウンド数
+ROUNDS = 4
+
+
+class KeyedPermutation:
+    """[0, n) を鍵で決まる順に並べ替えたもの（i 番目を平均 O(1) で求める）"""
+
+    def __init__(self, n: int, key: bytes):
+        self.n = n
+        self.key = key
+        # n 以上の 2 の偶数乗の範囲で並べ替え、範囲外に出たら戻るまで繰り返す（cycle walking）
+        bits = max(2, (n - 1).bit_length())
+        self.half = (bits + 1) // 2
+        self.mask = (1 << self.half) - 1
+
+    def _round(self, round_index: int, value: int) -> int:
+        digest = hashlib.blake2b(
+            value.to_bytes(4, "big"), key=self.key, digest_size=4, person=bytes([round_index]) * 16,
+        ).digest()
+        return int.from_bytes(digest, "big") & self.mask
+
+    def _encrypt(self, value: int) -> int:
+        left, right = value >> self.half, value & self.mask
+        for round_index in range(ROUNDS):
+            left, right = right, left ^ self._round(round_index, right)
+        return (left << self.half) | right
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, index: int) -> int:
+        if not 0 <= index < self.n:
+            raise IndexError(index)
+        value = self._encrypt(index)
+        while value >= self.n:
+            value = self._encrypt(value)
+        return value
+
+
+class ShuffleBag:
+    """セッションの種から、出題する種・録音を決める"""
+
+    def __init__(self, seed: int):
+        self.seed = seed
+
+    def _permutation(self, label: str, n: int, cycle: int) -> KeyedPermutation:
+        key = hashlib.blake2b(f"{self.seed}:{label}:{cycle}".encode("utf-8"), digest_size=16).digest()
+        return KeyedPermutation(n, key)
+
+    def _index(self, label: str, n: int, position: int) -> int:
+        """position 番目に引く要素の番号（n 個を出し切るまで重複しない）"""
+        cycle, offset = divmod(position, n)
+        permutation = self._permutation(label, n, cycle)
+        if cycle > 0 and n > 1 and offset < 2:
+            # 前の周回の最後と同じ要素で始まる場合は、先頭の2つを入れ替える
+            previous_last = self._permutation(label, n, cycle - 1)[n - 1]
+            if permutation[0] == previous_last:
+                offset = 1 - offset
+        return permutation[offset]
+
+    def species(self, birds: List[str], position: int) -> Tuple[str, int]:
+        """position 番目の問題の種と、その種が何回目の出題か"""
+        return birds[self._index("species", len(birds), position)], position // len(birds)
+
+    def recording(self, bird: str, audio_files: List[Dict], occurrence: int) -> Dict:
+        """種の occurrence 回目の出題で使う録音"""
+        return audio_files[self._index(f"recording:{bird}", len(audio_files), occurrence)]
@@ -0,0 +1,299 @@
+"""
+音声ファイルの保存先
+取り込み（parse_sound_files / build_visuals / upload_sounds）と /audio の配信の両方が使う
+
+AUDIO_STORAGE_URL で切り替える
+- 未設定 / file:///path: ローカルのディレクトリ（未設定なら sound/）
+- s3://bucket/prefix: S3互換のオブジェクトストレージ
+  - MinIO などは S3_ENDPOINT_URL で指定する。認証は boto3 の標準（AWS_ACCESS_KEY_ID など）
+  - 読み込んだファイルはローカルのディスクキャッシュ（AUDIO_CACHE_DIR、合計 AUDIO_CACHE_DISK_BYTES まで）に保存し、
+    以降はキャッシュから読む。キャッシュにないファイルは Range 指定で必要な部分だけを読みながら返す
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, NamedTuple, Optional, Tuple
+from urllib.parse import urlparse
+
+from api import metrics
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+# 音声ファイルとして扱う拡張子
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".ogg")
+# 読み込みの単位
+CHUNK_SIZE = 256 * 1024
+# ディスクキャッシュの合計サイズの上限（バイト）
+DEFAULT_CACHE_DISK_BYTES = 2 * 1024 * 1024 * 1024
+
+cache_downloads_total = metrics.registry.counter(
+    "tori_audio_cache_downloads_total", "リモートから取得してディスクキャッシュに保存した音声ファイル数")
+
+
+class ObjectInfo(NamedTuple):
+    """保存先のファイルの情報"""
+    size: int
+    mtime: float
+
+
+class LocalStorage:
+    """ローカルのディレクトリ"""
+
+    def __init__(self, root: Path, extensions: Optional[Tuple[str, ...]] = AUDIO_EXTENSIONS):
+        self.root = root
+        # list() に含める拡張子（None ならすべて）
+        self.extensions = extensions
+
+    def __str__(self) -> str:
+        return str(self.root)
+
+    def list(self) -> Dict[str, ObjectInfo]:
+        """音声ファイル名 -> サイズ・更新時刻"""
+        files: Dict[str, ObjectInfo] = {}
+        if not self.root.is_dir():
+            return files
+        for entry in os.scandir(self.root):
+            if entry.is_file() and (self.extensions is None or entry.name.lower().endswith(self.extensions)):
+                st = entry.stat()
+                files[entry.name] = ObjectInfo(st.st_size, st.st_mtime)
+        return files
+
+    def local_path(self, name: str) -> Optional[Path]:
+        """ローカルで読めるファイルのパス（なければ None）"""
+        path = self.root / name
+        return path if path.is_file() else None
+
+    def fetch(self, name: str) -> Path:
+        """ローカルで読めるパスを返す"""
+        path = self.local_path(name)
+        if path is None:
+            raise FileNotFoundError(name)
+        return path
+
+    def open(self, name: str) -> BinaryIO:
+        return open(self.fetch(name), "rb")
+
+    def read_range(self, name: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """start から end の手前まで（end が None なら末尾まで）をチャンクで返す"""
+        with open(self.fetch(name), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start
+            while remaining is None or remaining > 0:
+                chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def put(self, name: str, source: Path):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f".{name}.{os.getpid()}.tmp"
+        shutil.copyfile(source, tmp)
+        tmp.replace(self.root / name)
+
+
+class S3Storage:
+    """S3互換のオブジェクトストレージ（boto3 が必要）"""
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None):
+        if boto3 is None:
+            raise RuntimeError("S3互換のストレージを使うには boto3 をインストールしてください")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.endpoint_url = endpoint_url
+        self._client = None
+        self._client_pid = 0
+
+    def __str__(self) -> str:
+        return f"s3://{self.bucket}/{self.prefix}"
+
+    @property
+    def client(self):
+        # 接続プールは fork したワーカー間で共有できないため、プロセスごとに作る
+        if self._client is None or self._client_pid != os.getpid():
+            self._client = boto3.client("s3", endpoint_url=self.endpoint_url)
+            self._client_pid = os.getpid()
+        return self._client
+
+    def list(self) -> Dict[str, ObjectInfo]:
+        files: Dict[str, ObjectInfo] = {}
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                name = obj["Key"][len(self.prefix):]
+                if "/" not in name and name.lower().endswith(AUDIO_EXTENSIONS):
+                    files[name] = ObjectInfo(obj["Size"], obj["LastModified"].timestamp())
+        return files
+
+    def local_path(self, name: str) -> Optional[Path]:
+        return None
+
+    def read_range(self, name: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        byte_range = f"bytes={start}-" + ("" if end is None else str(end - 1))
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.prefix + name, Range=byte_range)
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(name) from None
+        body = response["Body"]
+        try:
+            yield from body.iter_chunks(CHUNK_SIZE)
+        finally:
+            body.close()
+
+    def put(self, name: str, source: Path):
+        self.client.upload_file(str(source), self.bucket, self.prefix + name)
+
+
+class CachedStorage:
+    """
+    リモートの保存先の前に置くディスクキャッシュ（読み込み時に保存する）
+    合計サイズが上限を超えたら、最後に使ってから最も時間が経ったファイルから削除する
+    """
+
+    def __init__(self, backend, cache_dir: Path, max_bytes: int = DEFAULT_CACHE_DISK_BYTES):
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # ファイル名 -> サイズ（最後に使った順）
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        self._inflight: Dict[str, threading.Event] = {}
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        cached = [
+            entry for entry in os.scandir(cache_dir)
+            if entry.is_file() and not entry.name.startswith(".")
+        ]
+        for entry in sorted(cached, key=lambda e: e.stat().st_atime):
+            size = entry.stat().st_size
+            self._entries[entry.name] = size
+            self._total += size
+
+    def __str__(self) -> str:
+        return f"{self.backend} (cache: {self.cache_dir})"
+
+    def list(self) -> Dict[str, ObjectInfo]:
+        """リモートの一覧（リモートで差し替え・削除されたファイルはキャッシュから外す）"""
+        listing = self.backend.list()
+        with self._lock:
+            cached = list(self._entries.items())
+        for name, size in cached:
+            info = listing.get(name)
+            try:
+                fresh = info is not None and info.size == size and info.mtime <= (self.cache_dir / name).stat().st_mtime
+            except FileNotFoundError:
+                fresh = False
+            if not fresh:
+                self._remove(name)
+        return listing
+
+    def local_path(self, name: str) -> Optional[Path]:
+        """キャッシュ済みならそのパス（他のワーカーが削除した場合も None）"""
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        path = self.cache_dir / name
+        return path if path.is_file() else None
+
+    def fetch(self, name: str) -> Path:
+        """キャッシュになければリモートから取得して保存し、そのパスを返す（同じファイルの取得は1回にまとめる）"""
+        while True:
+            path = self.local_path(name)
+            if path is not None:
+                return path
+            with self._lock:
+                event = self._inflight.get(name)
+                if event is None:
+                    event = self._inflight[name] = threading.Event()
+                    break
+            event.wait()
+
+        try:
+            tmp = self.cache_dir / f".{name}.{os.getpid()}.{threading.get_ident()}.tmp"
+            size = 0
+            try:
+                with open(tmp, "wb") as f:
+                    for chunk in self.backend.read_range(name):
+                        f.write(chunk)
+                        size += len(chunk)
+                tmp.replace(self.cache_dir / name)
+            except BaseException:
+                tmp.unlink(missing_ok=True)
+                raise
+            cache_downloads_total.inc()
+            self._add(name, size)
+            return self.cache_dir / name
+        finally:
+            with self._lock:
+                self._inflight.pop(name).set()
+
+    def _add(self, name: str, size: int):
+        evicted = []
+        with self._lock:
+            self._total -= self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._total += size
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old, old_size = self._entries.popitem(last=False)
+                self._total -= old_size
+                evicted.append(old)
+        # 配信中のファイルは開いているディスクリプタから最後まで読める
+        for old in evicted:
+            (self.cache_dir / old).unlink(missing_ok=True)
+
+    def _remove(self, name: str):
+        with self._lock:
+            self._total -= self._entries.pop(name, 0)
+        (self.cache_dir / name).unlink(missing_ok=True)
+
+    def open(self, name: str) -> BinaryIO:
+        return open(self.fetch(name), "rb")
+
+    def read_range(self, name: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        path = self.local_path(name)
+        if path is not None:
+            return LocalStorage(self.cache_dir).read_range(name, start, end)
+        return self.backend.read_range(name, start, end)
+
+    def put(self, name: str, source: Path):
+        self.backend.put(name, source)
+
+
+def content_hash(storage, name: str) -> str:
+    """ファイルの内容の sha256（16進）"""
+    digest = hashlib.sha256()
+    with storage.open(name) as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def open_storage(default_dir: Path, cache_dir: Path):
+    """AUDIO_STORAGE_URL に応じた保存先を返す"""
+    url = os.environ.get("AUDIO_STORAGE_URL", "")
+    if not url:
+        return LocalStorage(default_dir)
+    parsed = urlparse(url)
+    if parsed.scheme == "file":
+        return LocalStorage(Path(parsed.path))
+    if parsed.scheme == "s3":
+        backend = S3Storage(parsed.netloc, parsed.path, endpoint_url=os.environ.get("S3_ENDPOINT_URL") or None)
+        return CachedStorage(
+            backend,
+            Path(os.environ.get("AUDIO_CACHE_DIR", cache_dir)),
+            int(os.environ.get("AUDIO_CACHE_DISK_BYTES", DEFAULT_CACHE_DISK_BYTES)),
+        )
+    raise ValueError(f"AUDIO_STORAGE_URL の形式が正しくありません: {url}")
@@ -0,0 +1,251 @@
+"""
+構造化ログ（JSON Lines）
+ログはキューに積むだけで、書き込み（標準出力・logs/api.log）はバックグラウンドのスレッドが行う
+キューが一杯のときは待たずに破棄し、破棄した件数を次のログに記録する
+
+環境変数
+  LOG_LEVEL=INFO           出力するレベル
+  LOG_SAMPLE_RATE=1.0      INFO以下のログを出力する割合（WARNING以上は常に出力）
+  LOG_DIR=<BASE_DIR>/logs  ログファイルの出力先（空文字でファイル出力なし）
+  LOG_MAX_BYTES / LOG_BACKUP_COUNT  ローテーションの設定
+
+ローテーションはプロセスごとに行うため、fork したワーカー（start.py）は logs/api.<pid>.log に書く
+（同じファイルを複数のプロセスがローテーションすると、互いに書き込み中のファイルを上書きする）
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+# 処理中のリクエストID
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+REQUEST_ID_HEADER = b"x-request-id"
+
+# JSONに含めない LogRecord の標準属性
+_RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "request_id"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_log_dir: Optional[Path] = None
+
+
+def _file_handler(path: Path, formatter: logging.Formatter) -> logging.Handler:
+    handler = logging.handlers.RotatingFileHandler(
+        path,
+        maxBytes=int(os.environ.get("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+        backupCount=int(os.environ.get("LOG_BACKUP_COUNT", 5)),
+        encoding="utf-8",
+    )
+    handler.setFormatter(formatter)
+    return handler
+
+
+class JsonFormatter(logging.Formatter):
+    """1レコードを1行のJSONにする"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            data["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _SamplingFilter(logging.Filter):
+    """INFO以下のログを指定した割合だけ通す"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or self.rate >= 1.0 or random.random() < self.rate
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    呼び出し元のスレッドではフォーマットせずにキューへ積むだけのハンドラ
+    キューが一杯なら待たずに破棄する
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 引数は後から変更されうるため、ここでメッセージだけ確定させる
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.request_id = request_id_var.get()
+        if self.dropped:
+            record.dropped_logs = self.dropped
+            self.dropped = 0
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(log_dir: Optional[Path] = None):
+    """
+    ルートロガーをキュー経由の構造化ログに切り替える（2回目以降の呼び出しは何もしない）
+    """
+    global _listener, _log_dir
+    if _listener is not None:
+        return
+
+    level = os.environ.get("LOG_LEVEL", "INFO").upper()
+    sample_rate = float(os.environ.get("LOG_SAMPLE_RATE", "1.0"))
+    queue_size = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+    if "LOG_DIR" in os.environ:
+        log_dir = Path(os.environ["LOG_DIR"]) if os.environ["LOG_DIR"] else None
+
+    formatter = JsonFormatter()
+    handlers = []
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+    handlers.append(stream_handler)
+
+    if log_dir is not None:
+        try:
+            log_dir.mkdir(parents=True, exist_ok=True)
+            handlers.append(_file_handler(log_dir / "api.log", formatter))
+            _log_dir = log_dir
+        except OSError as e:
+            print(f"[Log] Failed to open log file in {log_dir}: {e}", file=sys.stderr)
+
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    queue_handler = _NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(_SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def _stop_listener_before_fork():
+    # 書き込みスレッドがロックを持ったまま fork されないよう、一旦止めてキューを空にする
+    if _listener is not None:
+        _listener.stop()
+
+
+def _start_listener_after_fork():
+    # 親・子の両方で書き込みスレッドを起動し直す（子プロセスにはスレッドが引き継がれない）
+    if _listener is not None:
+        _listener.start()
+
+
+def _reopen_file_after_fork():
+    # 子プロセスは親のログファイルを閉じ、自分の pid のファイルに書く
+    if _listener is not None and _log_dir is not None:
+        handlers = []
+        for handler in _listener.handlers:
+            if isinstance(handler, logging.handlers.RotatingFileHandler):
+                formatter = handler.formatter
+                handler.close()
+                try:
+                    handler = _file_handler(_log_dir / f"api.{os.getpid()}.log", formatter)
+                except OSError as e:
+                    print(f"[Log] Failed to open log file in {_log_dir}: {e}", file=sys.stderr)
+                    continue
+            handlers.append(handler)
+        _listener.handlers = tuple(handlers)
+    _start_listener_after_fork()
+
+
+os.register_at_fork(
+    before=_stop_listener_before_fork,
+    after_in_parent=_start_listener_after_fork,
+    after_in_child=_reopen_file_after_fork,
+)
+
+
+def shutdown_logging():
+    """キューに残ったログを書き出してからスレッドを止める"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestIdMiddleware:
+    """
+    リクエストIDを割り当て、処理中のログに付与するASGIミドルウェア
+    X-Request-ID ヘッダーがあればその値を使い、レスポンスにも同じヘッダーを返す
+    リクエストごとのアクセスログ（INFO）も出力する
+    """
+
+    def __init__(self, app, logger_name: str = "api.access"):
+        self.app = app
+        self.logger = logging.getLogger(logger_name)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == REQUEST_ID_HEADER:
+                request_id = value.decode("latin-1")[:64]
+                break
+        if not request_id:
+            request_id = uuid.uuid4().hex[:16]
+        token = request_id_var.set(request_id)
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((REQUEST_ID_HEADER, request_id.encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.logger.info(
+                "request",
+                extra={
+                    "method": scope.get("method"),
+                    "path": scope.get("path"),
+                    "status": status,
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+                },
+            )
+            request_id_var.reset(token)
@@ -0,0 +1,58 @@
+"""
+Supabaseのアクセストークン（JWT）の検証
+フロントエンドから送られた Authorization: Bearer <access_token> からユーザーIDを取り出す
+
+署名の検証には SUPABASE_JWT_SECRET（Supabaseの Settings > API > JWT Secret、HS256）を使う
+未設定の場合はユーザーを特定できないものとして扱う
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Optional
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def user_id_from_token(token: str, secret: Optional[str] = None) -> Optional[str]:
+    """署名と有効期限を検証してユーザーID（sub）を返す（検証できなければ None）"""
+    secret = secret if secret is not None else os.environ.get("SUPABASE_JWT_SECRET", "")
+    if not secret:
+        return None
+
+    try:
+        header_b64, payload_b64, signature_b64 = token.split(".")
+        header = json.loads(_b64decode(header_b64))
+        if not isinstance(header, dict) or header.get("alg") != "HS256":
+            return None
+        expected = hmac.new(secret.encode("utf-8"), f"{header_b64}.{payload_b64}".encode("ascii"), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature_b64)):
+            return None
+        payload = json.loads(_b64decode(payload_b64))
+    except (ValueError, binascii.Error, UnicodeError):
+        return None
+
+    if not isinstance(payload, dict):
+        return None
+    # exp が数値でないトークンは期限切れと同じに扱う
+    exp = payload.get("exp", 0)
+    if isinstance(exp, bool) or not isinstance(exp, (int, float)) or exp < time.time():
+        return None
+    sub = payload.get("sub")
+    return sub if isinstance(sub, str) and sub else None
+
+
+def user_id_from_authorization(authorization: Optional[str]) -> Optional[str]:
+    """Authorization ヘッダーの値からユーザーIDを取り出す"""
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    return user_id_from_token(token.strip())
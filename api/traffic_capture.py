@@ -0,0 +1,218 @@
+"""
+本番トラフィックの記録（オプトイン）
+負荷試験（benchmarks/replay.py）で再生できるよう、リクエストの形とタイミングを匿名化して logs/traffic/ に記録する
+
+  TRAFFIC_CAPTURE=1                    有効にする
+  TRAFFIC_CAPTURE_SAMPLE_RATE=1.0      記録するクライアントの割合（クライアント単位で選ぶため、クイズの流れは途切れない）
+  TRAFFIC_CAPTURE_MAX_BYTES=16777216   1ファイルの上限（超えたら次のファイルに書く）
+  TRAFFIC_CAPTURE_MAX_FILES=20         保存数（古いものから削除）
+
+ファイルは gzip した JSON Lines（traffic_<開始日時>_<pid>.jsonl.gz）
+1行目はヘッダー {"v", "start", "pid"}（start は記録を始めた時刻）、以降は1行1リクエスト
+
+  t  ヘッダーの start からの到着時刻（ミリ秒）
+  c  クライアントの番号（IPは記録せず、プロセスごとに到着順の番号を振る）
+  m  メソッド / r ルートのテンプレート / p パス（ルートが一致したもののみ）
+  q  クエリ（KEPT_QUERY_PARAMS 以外の値は文字数だけ）
+  h  Range ヘッダー
+  s  ステータス / d 処理時間（ミリ秒） / i 受信バイト数 / o 送信バイト数
+
+記録しないもの: IP、Authorization・Cookie などのヘッダー、リクエスト本文（問題ID・回答）、セッションなどのトークン
+"""
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl
+
+from api.admission import MAX_TRACKED_CLIENTS, client_address
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+FILE_PREFIX = "traffic_"
+FILE_SUFFIX = ".jsonl.gz"
+
+# 値をそのまま記録するクエリ（カタログの種名・件数など、利用者を特定しないもの）
+KEPT_QUERY_PARAMS = ("limit", "species")
+
+# まとめて書き込む件数と間隔（秒）
+FLUSH_RECORDS = 512
+FLUSH_INTERVAL = 5.0
+
+
+class TrafficCapture:
+    """匿名化したリクエストの記録をためて、ファイルにまとめて書き込む"""
+
+    def __init__(self, output_dir: Path, sample_rate: float = 1.0,
+                 max_bytes: int = 16 * 1024 * 1024, max_files: int = 20):
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.trust_forwarded = os.environ.get("RATE_LIMIT_TRUST_FORWARDED") == "1"
+        # 接続元 -> (クライアントの番号 or None（記録しない）)
+        self._clients: "OrderedDict[str, Optional[int]]" = OrderedDict()
+        self._next_client = 0
+        self._buffer: List[str] = []
+        self._last_flush = time.monotonic()
+        self._write_lock = threading.Lock()
+        self._path: Optional[Path] = None
+        # 到着時刻の基準（ファイルを切り替えても変えない）
+        self._start = time.time()
+
+    @classmethod
+    def from_env(cls, output_dir: Path) -> Optional["TrafficCapture"]:
+        """TRAFFIC_CAPTURE=1 のときだけ作る"""
+        if os.environ.get("TRAFFIC_CAPTURE") != "1":
+            return None
+        return cls(
+            output_dir,
+            sample_rate=float(os.environ.get("TRAFFIC_CAPTURE_SAMPLE_RATE", 1.0)),
+            max_bytes=int(os.environ.get("TRAFFIC_CAPTURE_MAX_BYTES", 16 * 1024 * 1024)),
+            max_files=int(os.environ.get("TRAFFIC_CAPTURE_MAX_FILES", 20)),
+        )
+
+    def client_number(self, scope) -> Optional[int]:
+        """クライアントの番号（記録しないクライアントなら None）"""
+        address = client_address(scope, self.trust_forwarded)
+        if address in self._clients:
+            self._clients.move_to_end(address)
+            return self._clients[address]
+        number = None
+        if random.random() < self.sample_rate:
+            number = self._next_client
+            self._next_client += 1
+        self._clients[address] = number
+        if len(self._clients) > MAX_TRACKED_CLIENTS:
+            self._clients.popitem(last=False)
+        return number
+
+    def add(self, record: Dict) -> Optional[List[str]]:
+        """記録を追加する。書き込む時期になったら、書き込む行を返す"""
+        self._buffer.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        now = time.monotonic()
+        if len(self._buffer) < FLUSH_RECORDS and now - self._last_flush < FLUSH_INTERVAL:
+            return None
+        lines, self._buffer = self._buffer, []
+        self._last_flush = now
+        return lines
+
+    def write(self, lines: List[str]):
+        """ファイルに追記する（gzip のメンバーを追加するため、途中で止まってもそれまでの分は読める）"""
+        if not lines:
+            return
+        with self._write_lock:
+            try:
+                if self._path is None or self._path.stat().st_size > self.max_bytes:
+                    self._rotate()
+                with gzip.open(self._path, "ab") as f:
+                    f.write(("\n".join(lines) + "\n").encode("utf-8"))
+            except OSError as e:
+                logger.warning("failed to write traffic capture", extra={"error": str(e)})
+
+    def _rotate(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        name = f"{FILE_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}{FILE_SUFFIX}"
+        self._path = self.output_dir / name
+        header = {"v": FORMAT_VERSION, "start": round(self._start, 3), "pid": os.getpid()}
+        with gzip.open(self._path, "wb") as f:
+            f.write((json.dumps(header) + "\n").encode("utf-8"))
+
+        files = sorted(self.output_dir.glob(f"{FILE_PREFIX}*{FILE_SUFFIX}"), key=lambda p: p.stat().st_mtime)
+        for old in files[:max(0, len(files) - self.max_files)]:
+            old.unlink(missing_ok=True)
+
+    def timestamp_ms(self, wall_time: float) -> int:
+        """ヘッダーの start からの時刻（ミリ秒）"""
+        return int((wall_time - self._start) * 1000)
+
+    def close(self):
+        """たまっている記録を書き込む（終了時）"""
+        lines, self._buffer = self._buffer, []
+        self.write(lines)
+
+
+def _anonymize_query(query_string: bytes) -> Dict:
+    query: Dict[str, List] = {}
+    for key, value in parse_qsl(query_string.decode("latin-1"), keep_blank_values=True):
+        query.setdefault(key, []).append(value if key in KEPT_QUERY_PARAMS else len(value))
+    return {key: values[0] if len(values) == 1 else values for key, values in query.items()}
+
+
+class TrafficCaptureMiddleware:
+    """リクエストの形とタイミングを TrafficCapture に記録するASGIミドルウェア"""
+
+    def __init__(self, app, capture: TrafficCapture):
+        self.app = app
+        self.capture = capture
+        self._route_paths: Optional[Dict[object, str]] = None
+
+    def _route(self, scope) -> Optional[str]:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return None
+        if self._route_paths is None:
+            routes = getattr(scope.get("app"), "routes", [])
+            self._route_paths = {getattr(r, "endpoint", None): r.path for r in routes if hasattr(r, "path")}
+        # マウントしたアプリ（/audio など）はマウント先のパス
+        return self._route_paths.get(endpoint) or scope.get("root_path") or None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        client = self.capture.client_number(scope)
+        if client is None:
+            await self.app(scope, receive, send)
+            return
+
+        arrived = time.time()
+        start = time.perf_counter()
+        status = 500
+        received = sent = 0
+
+        async def receive_wrapper():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            elif message["type"] == "http.response.zerocopy":
+                sent += message.get("count", 0)
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            record = {"t": self.capture.timestamp_ms(arrived), "c": client, "m": scope.get("method", "")}
+            route = self._route(scope)
+            if route is not None:
+                record["r"] = route
+                record["p"] = scope.get("path", "")
+            if scope.get("query_string"):
+                record["q"] = _anonymize_query(scope["query_string"])
+            for name, value in scope.get("headers", ()):
+                if name == b"range":
+                    record["h"] = value.decode("latin-1")
+            record.update(s=status, d=round((time.perf_counter() - start) * 1000, 2), i=received, o=sent)
+            lines = self.capture.add(record)
+            if lines:
+                # ファイル書き込みはイベントループを止めないように別スレッドで行う
+                await asyncio.to_thread(self.capture.write, lines)
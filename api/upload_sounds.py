@@ -0,0 +1,59 @@
+"""
+音声ファイルを AUDIO_STORAGE_URL の保存先（S3互換など）にアップロードするスクリプト
+保存先に同じ名前・同じサイズのファイルがあればスキップする
+
+使い方
+  python api/upload_sounds.py                 # soundフォルダのファイルをすべて
+  python api/upload_sounds.py a.mp3 b.mp3     # 指定したファイルだけ
+
+アップロード後に以下を実行してカタログを作り直すこと
+  python api/parse_sound_files.py
+  python api/build_catalog.py
+  python api/build_visuals.py
+
+Dockerfile でデプロイする場合、catalog.arrow と visuals/ はイメージに含まれるため、
+そのままでは録音を追加するたびにイメージの再ビルドが必要（ビルド時の visuals/ はイメージの sound/ から作る）
+再ビルドせずに反映するには CATALOG_PATH・VISUALS_DIR を永続ボリュームに向け、上のコマンドで作った
+catalog.arrow と visuals/ をそこに置く（start.py は catalog.arrow の更新を検知して読み込み直す）
+"""
+
+import sys
+from pathlib import Path
+
+# `python api/upload_sounds.py` として実行しても api パッケージを参照できるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from api.storage import AUDIO_EXTENSIONS, open_storage
+
+
+def main():
+    """メイン処理"""
+    base_dir = Path(__file__).resolve().parent.parent
+    sound_dir = base_dir / "sound"
+    storage = open_storage(sound_dir, base_dir / "data" / "audio_cache")
+
+    if len(sys.argv) > 1:
+        sources = [Path(arg) for arg in sys.argv[1:]]
+    else:
+        sources = sorted(p for p in sound_dir.iterdir() if p.name.lower().endswith(AUDIO_EXTENSIONS))
+
+    print(f"Upload to: {storage}")
+    print()
+
+    existing = storage.list()
+    uploaded = skipped = 0
+    for source in sources:
+        info = existing.get(source.name)
+        if info is not None and info.size == source.stat().st_size:
+            skipped += 1
+            continue
+        storage.put(source.name, source)
+        print(f"  ↑ {source.name}")
+        uploaded += 1
+
+    print()
+    print(f"アップロード: {uploaded}件 / スキップ: {skipped}件")
+
+
+if __name__ == "__main__":
+    main()
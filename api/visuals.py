@@ -0,0 +1,194 @@
+"""
+録音のスペクトログラム画像と波形データ
+取り込み時（api/build_visuals.py）に録音ごとに一度だけ作り、リクエスト時は信号処理をしない
+
+- スペクトログラム: NumPy の STFT（窓関数をかけたフレームをまとめて rfft）をパレットPNGにする
+- 波形: 一定サンプルごとの最小値・最大値（audiowaveform の JSON 形式、8bit）
+
+ファイル名は録音の内容と描画パラメータのハッシュ（<hash>.png / <hash>.json）で、内容が変わらない限り同じURLになる
+どの録音がどのファイルかは manifest.json に保存する
+"""
+
+import hashlib
+import json
+import struct
+import zlib
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+MANIFEST_NAME = "manifest.json"
+
+# 描画パラメータ（変えたら RENDER_VERSION を上げ、ハッシュを変える）
+RENDER_VERSION = 1
+SAMPLE_RATE = 22050
+FFT_SIZE = 512
+SPECTROGRAM_WIDTH = 480
+SPECTROGRAM_HEIGHT = 128
+DYNAMIC_RANGE_DB = 60.0
+# 強度の段階数（減らすほどPNGが小さくなる）
+LEVELS = 32
+PEAK_COUNT = 1000
+
+# スペクトログラムの配色（静か → 大きい）。間は線形補間する
+_COLORMAP_STOPS = [
+    (0.0, (255, 255, 255)),
+    (0.35, (180, 210, 230)),
+    (0.6, (60, 120, 170)),
+    (0.85, (20, 50, 100)),
+    (1.0, (0, 0, 0)),
+]
+
+
+def content_hash(path: Path) -> str:
+    """録音の内容と描画パラメータのハッシュ（ファイル名に使う）"""
+    digest = hashlib.sha256(f"tori-visuals:{RENDER_VERSION}:".encode("ascii"))
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:24]
+
+
+# ----------------------------------------------------------------------
+# スペクトログラム
+# ----------------------------------------------------------------------
+
+def spectrogram(samples: np.ndarray, width: int = SPECTROGRAM_WIDTH, height: int = SPECTROGRAM_HEIGHT) -> np.ndarray:
+    """
+    モノラルの信号から height x width の強度（0〜LEVELS-1、上が高音）を作る
+    フレームは録音の長さに合わせた間隔で width 個だけ取り出し、まとめて FFT する
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    if len(samples) < FFT_SIZE:
+        samples = np.pad(samples, (0, FFT_SIZE - len(samples)))
+
+    starts = np.linspace(0, len(samples) - FFT_SIZE, width).astype(np.int64)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FFT_SIZE)[starts]
+    power = np.abs(np.fft.rfft(frames * np.hanning(FFT_SIZE).astype(np.float32), axis=1)) ** 2
+
+    # 直流成分を除いた周波数ビンを height 行にまとめる
+    bins = power[:, 1:]
+    per_row = bins.shape[1] // height
+    bins = bins[:, :per_row * height].reshape(width, height, per_row).mean(axis=2)
+
+    db = 10 * np.log10(bins + 1e-12)
+    db = np.clip(db - db.max(), -DYNAMIC_RANGE_DB, 0)
+    levels = ((db + DYNAMIC_RANGE_DB) * ((LEVELS - 1) / DYNAMIC_RANGE_DB)).round().astype(np.uint8)
+    return levels.T[::-1]
+
+
+def _palette() -> bytes:
+    positions = np.linspace(0, 1, LEVELS)
+    stops = np.array([p for p, _ in _COLORMAP_STOPS])
+    colors = np.array([c for _, c in _COLORMAP_STOPS], dtype=np.float64)
+    channels = [np.interp(positions, stops, colors[:, i]) for i in range(3)]
+    return np.stack(channels, axis=1).round().astype(np.uint8).tobytes()
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def encode_png(levels: np.ndarray) -> bytes:
+    """強度（uint8 の2次元配列）を配色付きのパレットPNGにする"""
+    height, width = levels.shape
+    # 各行に Sub フィルタ（左の画素との差分）をかけて圧縮しやすくする
+    filtered = np.empty((height, width + 1), dtype=np.uint8)
+    filtered[:, 0] = 1
+    filtered[:, 1] = levels[:, 0]
+    filtered[:, 2:] = np.diff(levels, axis=1)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0))
+        + _png_chunk(b"PLTE", _palette())
+        + _png_chunk(b"IDAT", zlib.compress(filtered.tobytes(), 9))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+# ----------------------------------------------------------------------
+# 波形
+# ----------------------------------------------------------------------
+
+def waveform_peaks(samples: np.ndarray, sample_rate: int = SAMPLE_RATE, count: int = PEAK_COUNT) -> Dict:
+    """
+    波形描画用の最小値・最大値（audiowaveform の JSON 形式、-128〜127）
+    data は [最小, 最大, 最小, 最大, ...] の順
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    per_peak = max(1, -(-len(samples) // count))
+    length = -(-len(samples) // per_peak) if len(samples) else 0
+    padded = np.zeros(length * per_peak, dtype=np.float32)
+    padded[:len(samples)] = samples
+    # 末尾の埋めた部分が最小・最大に混ざらないよう、最後のサンプルで埋める
+    if len(samples):
+        padded[len(samples):] = samples[-1]
+    blocks = padded.reshape(length, per_peak)
+    peaks = np.empty((length, 2), dtype=np.int64)
+    peaks[:, 0] = np.clip(np.floor(blocks.min(axis=1) * 128), -128, 127)
+    peaks[:, 1] = np.clip(np.ceil(blocks.max(axis=1) * 128), -128, 127)
+    return {
+        "version": 2,
+        "channels": 1,
+        "sample_rate": sample_rate,
+        "samples_per_pixel": per_peak,
+        "bits": 8,
+        "length": length,
+        "data": peaks.ravel().tolist(),
+    }
+
+
+# ----------------------------------------------------------------------
+# マニフェスト
+# ----------------------------------------------------------------------
+
+def read_manifest(visuals_dir: Path) -> Dict[str, Dict]:
+    """録音のファイル名 -> {hash, spectrogram, peaks, duration}"""
+    try:
+        with open(visuals_dir / MANIFEST_NAME, "r", encoding="utf-8") as f:
+            return json.load(f).get("files", {})
+    except FileNotFoundError:
+        return {}
+
+
+def write_manifest(visuals_dir: Path, files: Dict[str, Dict]):
+    path = visuals_dir / MANIFEST_NAME
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": RENDER_VERSION, "files": files}, f, ensure_ascii=False, indent=1, sort_keys=True)
+    tmp.replace(path)
+
+
+class VisualIndex:
+    """録音のファイル名・ハッシュからスペクトログラム・波形のURLを引く（API用）"""
+
+    def __init__(self, files: Dict[str, Dict], url_prefix: str = "/visuals"):
+        self.files = files
+        self._hash_by_filename: Dict[str, str] = {filename: entry["hash"] for filename, entry in files.items()}
+        self._urls: Dict[str, Dict] = {
+            entry["hash"]: {
+                "spectrogram_url": f"{url_prefix}/{entry['spectrogram']}",
+                "peaks_url": f"{url_prefix}/{entry['peaks']}",
+                "duration": entry.get("duration"),
+            }
+            for entry in files.values()
+        }
+
+    @classmethod
+    def open(cls, visuals_dir: Path) -> "VisualIndex":
+        return cls(read_manifest(visuals_dir))
+
+    def asset_names(self):
+        """配信するファイル名（ハッシュ付き）の一覧"""
+        for entry in self.files.values():
+            yield entry["spectrogram"]
+            yield entry["peaks"]
+
+    def hash_of(self, filename: str) -> Optional[str]:
+        """録音のハッシュ（取り込み前の録音なら None）"""
+        return self._hash_by_filename.get(filename)
+
+    def urls(self, digest: Optional[str]) -> Dict:
+        """{spectrogram_url, peaks_url, duration}（見つからなければ空）"""
+        return self._urls.get(digest, {}) if digest else {}
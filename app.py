@@ -1,19 +1,35 @@
 import streamlit as st
-import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import requests
 import os
-import pickle
+import json
+from urllib.parse import urlencode
 
-# ファイルのパスを指定
-suntory_pickle_path = "output_suntory.pickle"
-bird_research_pickle_path = "output_bird_research.pickle"
-mokuroku_path = 'mokuroku.pickle'
+# ファイルのパスを指定（api/build_catalog.py で生成）
+catalog_path = "catalog.arrow"
+# 一括ダウンロードに使うAPIサーバーのURL
+api_base_url = os.environ.get("TORI_API_URL", "http://localhost:8000").rstrip("/")
+
+# カタログの読み込み（メモリマップで開き、セッション間で共有する）
+@st.cache_resource
+def load_catalog(path):
+    table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    species_names = json.loads(table.schema.metadata[b"species_names"])
+    return table, species_names
+
+
+catalog, species_names = load_catalog(catalog_path)
+
+
+def find_rows(source, species_name):
+    """指定したデータソースから種名に一致するレコードを取得"""
+    mask = pc.and_(
+        pc.equal(catalog["source"], source),
+        pc.equal(catalog["japanese_name"], species_name),
+    )
+    return catalog.filter(mask).to_pylist()
 
-# 各データの読み込み
-suntory_data = pd.read_pickle(suntory_pickle_path)
-bird_research_data = pd.read_pickle(bird_research_pickle_path)
-mokuroku_data = pd.read_pickle(mokuroku_path)
-st.write(suntory_data.head())
 
 # StreamlitアプリのUI
 st.title("鳥の音声検索アプリ")
@@ -25,9 +41,8 @@ with st.sidebar:
     display_count = st.slider("表示数", min_value=1, max_value=50, value=5)
     st.write("声の種類")
     voice_type = st.radio("声の種類を選択してください", ("地鳴き（call）", "さえずり（song）"))
-# すべてのデータを1つのリストにまとめる
-all_names = pd.concat([mokuroku_data["種名"], suntory_data["名前"], bird_research_data["名前"]])
-selected_species = st.selectbox("種名を選択してください", all_names.unique())
+# 種名一覧はカタログ作成時に重複を除いて保存済み
+selected_species = st.selectbox("種名を選択してください", species_names)
 st.write(f"選択された種名は:{selected_species}")
 
 # 検索結果を表示する関数
@@ -36,12 +51,12 @@ def display_results(species_name, japan_only, display_count, voice_type):
     
     # Suntory検索結果
     st.subheader("Suntoryの検索結果")
-    suntory_result = suntory_data[suntory_data["名前"] == species_name]
+    suntory_result = find_rows("suntory", species_name)
 
-    if not suntory_result.empty:
-        suntory_url = suntory_result.iloc[0]["URL"]
-        suntory_chirp = suntory_result.iloc[0]["地鳴き"]
-        suntory_sing = suntory_result.iloc[0]["さえずり"]
+    if suntory_result:
+        suntory_url = suntory_result[0]["page_url"]
+        suntory_chirp = suntory_result[0]["has_call"]
+        suntory_sing = suntory_result[0]["has_song"]
         # 種類の表示形式を決定
         types = []
         if suntory_chirp:
@@ -60,24 +75,24 @@ def display_results(species_name, japan_only, display_count, voice_type):
     # Bird Research検索結果
     st.subheader("Bird Researchの検索結果")
     
-    bird_research_result = bird_research_data[bird_research_data["名前"] == species_name]
-
-    if not bird_research_result.empty:
-        for _, row in bird_research_result.iterrows():
-            st.write(f"場所: {row['場所']}")
-            st.write(f"種類: {row['種類']}")
-            st.write(f"音声リンク:{row['ファイルURL']}")
-            st.audio(row['ファイルURL'])
-            download_urls.append(row['ファイルURL'])  # ダウンロードURLを追加
+    bird_research_result = find_rows("bird_research", species_name)
+
+    if bird_research_result:
+        for row in bird_research_result:
+            st.write(f"場所: {row['location']}")
+            st.write(f"種類: {row['voice_type']}")
+            st.write(f"音声リンク:{row['file_url']}")
+            st.audio(row['file_url'])
+            download_urls.append(row['file_url'])  # ダウンロードURLを追加
     else:
         st.write("該当するデータが見つかりませんでした。")
 
     # Xeno-Canto検索結果
     st.subheader("Xeno-Cantoの検索結果")
-    xenocant_result = mokuroku_data[mokuroku_data["種名"] == species_name]
+    xenocant_result = find_rows("mokuroku", species_name)
 
-    if not xenocant_result.empty:
-        scientific_name = xenocant_result.iloc[0]["学名"]
+    if xenocant_result:
+        scientific_name = xenocant_result[0]["scientific_name"]
         st.write(f"選択された鳥の学名は: {scientific_name}")
 
         # URLを構築
@@ -109,28 +124,13 @@ def display_results(species_name, japan_only, display_count, voice_type):
     else:
         st.write("該当する鳥の情報が見つかりませんでした。")
 
-    # 一括ダウンロードボタンを表示
-    if st.button("一括ダウンロードのbatを作成"):
-        # バッチファイルを生成
-        bat_content = ""
-        for url in download_urls:
-            bat_content += f"curl -O {url}\n"
-            bat_content += f"timeout /t 5\n"
-        
-        bat_content += "echo end\npause\n"
-        
-        # バッチファイルを保存
-        with open("download_files.bat", "w") as bat_file:
-            bat_file.write(bat_content)
-        
-        # バッチファイルの内容をStreamlitでダウンロード
-        with open("download_files.bat", "rb") as bat_file:
-            btn = st.download_button(
-                label="バッチファイルをダウンロード",
-                data=bat_file,
-                file_name="download_files.bat",
-                mime="application/octet-stream"
-            )
+    # 一括ダウンロード（APIサーバーが録音を並列に取得し、ZIPとしてストリーミング配信する）
+    if download_urls:
+        query = urlencode([("url", url) for url in download_urls])
+        st.link_button(
+            f"一括ダウンロード（ZIP, {len(download_urls)}件）",
+            f"{api_base_url}/api/download/zip?{query}",
+        )
 
 # 選択ボックスの値が変更されたときに結果を更新
 if selected_species:
@@ -4,8 +4,8 @@ import { useState, useRef, useCallback, useEffect } from 'react'
 import { useRouter } from 'next/navigation'
 import Link from 'next/link'
 import { useAuth } from '@/contexts/AuthContext'
-import { ApiQuizQuestion } from '@/lib/quiz/types'
-import { fetchQuizQuestion, submitQuizAnswer } from '@/lib/quiz/api'
+import { ApiQuizQuestion, ApiQuizResult } from '@/lib/quiz/types'
+import { fetchQuizQuestion, submitQuizAnswer, submitQuizScore } from '@/lib/quiz/api'
 import { 
   saveSpeciesAnswer, 
   saveQuizScore, 
@@ -26,6 +26,8 @@ export default function QuizPage() {
   const router = useRouter()
   const { user } = useAuth()
   const audioRef = useRef<HTMLAudioElement>(null)
+  // 出題順のセッション（リトライ後も引き継ぎ、直近に出た種を続けて出題しない）
+  const quizSessionRef = useRef<string | null>(null)
   
   const [currentQuestion, setCurrentQuestion] = useState<ApiQuizQuestion | null>(null)
   const [questionNumber, setQuestionNumber] = useState(0)
@@ -33,6 +35,8 @@ export default function QuizPage() {
   const [selectedAnswer, setSelectedAnswer] = useState<string | null>(null)
   const [showResult, setShowResult] = useState(false)
   const [isCorrect, setIsCorrect] = useState(false)
+  // 回答の結果（正解・学名・科名・スペクトログラムは回答後にサーバーから受け取る）
+  const [result, setResult] = useState<ApiQuizResult | null>(null)
   const [gameFinished, setGameFinished] = useState(false)
   const [isPlaying, setIsPlaying] = useState(false)
   const [isLoading, setIsLoading] = useState(true)
@@ -47,10 +51,12 @@ export default function QuizPage() {
     setError(null)
     setSelectedAnswer(null)
     setShowResult(false)
+    setResult(null)
     setIsPlaying(false)
 
     try {
-      const question = await fetchQuizQuestion()
+      const question = await fetchQuizQuestion(quizSessionRef.current)
+      quizSessionRef.current = question.session ?? null
       setCurrentQuestion(question)
       setQuestionNumber(prev => prev + 1)
     } catch (err) {
@@ -82,13 +88,14 @@ export default function QuizPage() {
     setSelectedAnswer(answer)
     
     try {
-      const result = await submitQuizAnswer({
+      const answerResult = await submitQuizAnswer({
         question_id: currentQuestion.question_id,
         user_answer: answer,
       })
       
-      const correct = result.is_correct
+      const correct = answerResult.is_correct
       setIsCorrect(correct)
+      setResult(answerResult)
       setShowResult(true)
       
       if (correct) {
@@ -97,29 +104,19 @@ export default function QuizPage() {
       
       // 回答履歴を記録
       setAnswerRecords(prev => [...prev, {
-        species: currentQuestion.correct_answer,
+        species: answerResult.correct_answer,
         isCorrect: correct,
       }])
       
-      // ユーザーがログインしている場合、種ごとの回答を保存
-      if (user) {
-        await saveSpeciesAnswer(user.id, currentQuestion.correct_answer, correct)
+      // ユーザーがログインしている場合、種ごとの回答を保存（サーバー側で記録済みなら不要）
+      if (user && !answerResult.recorded) {
+        await saveSpeciesAnswer(user.id, answerResult.correct_answer, correct)
       }
     } catch (err) {
       console.error('Failed to submit answer:', err)
-      // フォールバック: ローカルで判定
-      const correct = answer === currentQuestion.correct_answer
-      setIsCorrect(correct)
-      setShowResult(true)
-      if (correct) {
-        setScore(prev => prev + 1)
-      }
-      
-      // 回答履歴を記録
-      setAnswerRecords(prev => [...prev, {
-        species: currentQuestion.correct_answer,
-        isCorrect: correct,
-      }])
+      // 正解はサーバーだけが知っているため、ローカルでは判定できない。もう一度回答できるようにする
+      setSelectedAnswer(null)
+      setError('回答の送信に失敗しました。もう一度お試しください')
     }
   }
 
@@ -140,8 +137,11 @@ export default function QuizPage() {
     setSavingScore(true)
     
     try {
-      // クイズスコアを保存
-      await saveQuizScore(user.id, score, TOTAL_QUESTIONS)
+      // クイズスコアを保存（サーバー側で記録できなければ直接保存）
+      const recorded = await submitQuizScore(score, TOTAL_QUESTIONS)
+      if (!recorded) {
+        await saveQuizScore(user.id, score, TOTAL_QUESTIONS)
+      }
       
       // バッジをチェックして付与
       const awarded = await checkAndAwardBadges(user.id)
@@ -369,7 +369,7 @@ export default function QuizPage() {
               let buttonStyle = 'bg-gray-100 dark:bg-gray-700 hover:bg-gray-200 dark:hover:bg-gray-600'
               
               if (showResult) {
-                if (choice === currentQuestion.correct_answer) {
+                if (choice === result?.correct_answer) {
                   buttonStyle = 'bg-green-500 text-white'
                 } else if (choice === selectedAnswer && !isCorrect) {
                   buttonStyle = 'bg-red-500 text-white'
@@ -400,19 +400,28 @@ export default function QuizPage() {
                 <div className="text-center">
                   <span className="text-2xl">{isCorrect ? '⭕️' : '❌'}</span>
                   <p className={`font-bold mt-2 ${isCorrect ? 'text-green-700 dark:text-green-300' : 'text-red-700 dark:text-red-300'}`}>
-                    {isCorrect ? '正解！' : `不正解... 答えは「${currentQuestion.correct_answer}」`}
+                    {isCorrect ? '正解！' : `不正解... 答えは「${result?.correct_answer}」`}
                   </p>
-                  {currentQuestion.scientific_name && (
+                  {result?.scientific_name && (
                     <p className="text-sm text-gray-600 dark:text-gray-400 mt-1">
-                      学名: {currentQuestion.scientific_name}
+                      学名: {result.scientific_name}
                     </p>
                   )}
-                  {currentQuestion.family && (
+                  {result?.family && (
                     <p className="text-sm text-gray-600 dark:text-gray-400">
-                      科: {currentQuestion.family}
+                      科: {result.family}
                     </p>
                   )}
                 </div>
+                {result?.spectrogram_url && (
+                  // eslint-disable-next-line @next/next/no-img-element
+                  <img
+                    src={result.spectrogram_url}
+                    alt={`${result.correct_answer}の鳴き声のスペクトログラム`}
+                    className="mt-3 w-full rounded-lg"
+                    loading="lazy"
+                  />
+                )}
               </div>
 
               {/* クレジット表示 (Xeno-Canto Terms of Use準拠) */}
@@ -78,7 +78,7 @@ export default function ScorePage() {
 
   if (!stats) return null
 
-  const highAccuracyCount = stats.speciesAccuracies.filter(a => a.accuracy_percent >= 80).length
+  const highAccuracyCount = stats.masteredSpecies
 
   return (
     <div className="min-h-screen bg-gradient-to-b from-green-50 to-green-100 dark:from-gray-900 dark:to-gray-800 px-4 py-8">
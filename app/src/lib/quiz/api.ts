@@ -1,13 +1,26 @@
+import { createClient } from '@/lib/supabase/client'
 import { ApiQuizQuestion, ApiQuizAnswer, ApiQuizResult } from './types'
 
 // FastAPI のベースURL（開発時はローカル、本番では環境変数から）
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'
 
+/**
+ * ログイン中ならSupabaseのアクセストークンを Authorization ヘッダーに付ける
+ * （サーバー側で回答履歴・スコアを記録するため）
+ */
+async function authHeaders(): Promise<Record<string, string>> {
+  const supabase = createClient()
+  const { data: { session } } = await supabase.auth.getSession()
+  return session ? { Authorization: `Bearer ${session.access_token}` } : {}
+}
+
 /**
  * クイズ問題を取得
+ * session（前の問題の session）を渡すと、全種を出し切るまで同じ種が出題されない
  */
-export async function fetchQuizQuestion(): Promise<ApiQuizQuestion> {
-  const response = await fetch(`${API_BASE_URL}/api/quiz/question`, {
+export async function fetchQuizQuestion(session?: string | null): Promise<ApiQuizQuestion> {
+  const query = session ? `?session=${encodeURIComponent(session)}` : ''
+  const response = await fetch(`${API_BASE_URL}/api/quiz/question${query}`, {
     method: 'GET',
     headers: {
       'Content-Type': 'application/json',
@@ -41,6 +54,7 @@ export async function submitQuizAnswer(answer: ApiQuizAnswer): Promise<ApiQuizRe
     method: 'POST',
     headers: {
       'Content-Type': 'application/json',
+      ...(await authHeaders()),
     },
     body: JSON.stringify(answer),
   })
@@ -50,5 +64,40 @@ export async function submitQuizAnswer(answer: ApiQuizAnswer): Promise<ApiQuizRe
     throw new Error(error.detail || `HTTP error: ${response.status}`)
   }
 
-  return response.json()
+  const data: ApiQuizResult = await response.json()
+
+  // スペクトログラム・波形のURLを絶対URLに変換
+  if (data.spectrogram_url?.startsWith('/')) {
+    data.spectrogram_url = `${API_BASE_URL}${data.spectrogram_url}`
+  }
+  if (data.peaks_url?.startsWith('/')) {
+    data.peaks_url = `${API_BASE_URL}${data.peaks_url}`
+  }
+
+  return data
+}
+
+/**
+ * 1ラウンドのスコアをサーバー側で記録
+ * 記録できなかった場合（未ログイン・サーバー側の記録が無効・混雑時）は false を返す
+ */
+export async function submitQuizScore(score: number, totalQuestions: number): Promise<boolean> {
+  const headers = await authHeaders()
+  if (!headers.Authorization) return false
+
+  try {
+    const response = await fetch(`${API_BASE_URL}/api/quiz/score`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        ...headers,
+      },
+      body: JSON.stringify({ score, total_questions: totalQuestions }),
+    })
+    if (!response.ok) return false
+    const data = await response.json()
+    return data.recorded === true
+  } catch {
+    return false
+  }
 }
@@ -20,15 +20,13 @@ export type ApiQuizQuestion = {
   question_id: string
   audio_url: string
   audio_source: string
-  correct_answer: string
-  choices: string[]
-  scientific_name: string
+  choices: string[]  // 正解・学名・科名は回答の結果（ApiQuizResult）で受け取る
   voice_type: string | null
   location: string | null
-  family: string | null
   recordist: string | null
   license_url: string | null
   xc_id: string | null
+  session?: string  // 次の問題を取得するときに渡す出題順のセッション
 }
 
 export type ApiQuizAnswer = {
@@ -40,6 +38,11 @@ export type ApiQuizResult = {
   is_correct: boolean
   correct_answer: string
   message: string
+  scientific_name?: string | null
+  family?: string | null
+  recorded?: boolean // サーバー側で回答履歴に記録済みか
+  spectrogram_url?: string | null // 出題した録音のスペクトログラム（PNG）
+  peaks_url?: string | null // 出題した録音の波形（audiowaveform 形式のJSON）
 }
 
 // サンプルの鳥データ（Supabaseにデータがない場合のフォールバック）
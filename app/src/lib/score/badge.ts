@@ -64,6 +64,7 @@ export type UserStats = {
   totalCorrect: number
   totalQuestions: number
   overallAccuracy: number
+  masteredSpecies: number // 正答率80%以上の種の数
   speciesAccuracies: SpeciesAccuracy[]
   earnedBadges: BadgeType[]
   nextBadge: Badge | null
@@ -121,15 +122,56 @@ export async function saveQuizScore(
   return { error }
 }
 
+// ユーザーごとの合計（user_stats テーブル、回答時にトリガーで更新される）
+export type UserTotals = {
+  total_quizzes: number
+  total_questions: number
+  total_correct: number
+  total_answers: number
+  mastered_species: number // 正答率80%以上の種の数
+}
+
+const EMPTY_TOTALS: UserTotals = {
+  total_quizzes: 0,
+  total_questions: 0,
+  total_correct: 0,
+  total_answers: 0,
+  mastered_species: 0,
+}
+
 /**
- * ユーザーの種ごとの正答率を取得
+ * ユーザーの合計を取得（1行のみ読む）
+ */
+export async function getUserTotals(userId: string): Promise<UserTotals> {
+  const supabase = createClient()
+  
+  const { data, error } = await supabase
+    .from('user_stats')
+    .select('total_quizzes, total_questions, total_correct, total_answers, mastered_species')
+    .eq('user_id', userId)
+    .maybeSingle()
+  
+  if (error) {
+    console.error('Failed to get user totals:', error)
+    if (error.code === '42P01' || error.message?.includes('does not exist')) {
+      console.warn('user_stats テーブルが存在しません。supabase/schema.sql を実行してください。')
+    }
+    return EMPTY_TOTALS
+  }
+  
+  // まだ回答していないユーザーは行がない
+  return data ?? EMPTY_TOTALS
+}
+
+/**
+ * ユーザーの種ごとの正答率を取得（種ごとの集計テーブルを読む）
  */
 export async function getSpeciesAccuracies(userId: string): Promise<SpeciesAccuracy[]> {
   const supabase = createClient()
   
   const { data, error } = await supabase
-    .from('species_answers')
-    .select('species_name, is_correct')
+    .from('user_species_stats')
+    .select('species_name, total_answers, correct_answers')
     .eq('user_id', userId)
   
   if (error || !data) {
@@ -137,28 +179,12 @@ export async function getSpeciesAccuracies(userId: string): Promise<SpeciesAccur
     return []
   }
   
-  // 種ごとに集計
-  const speciesMap = new Map<string, { correct: number; total: number }>()
-  
-  for (const answer of data) {
-    const current = speciesMap.get(answer.species_name) || { correct: 0, total: 0 }
-    current.total++
-    if (answer.is_correct) {
-      current.correct++
-    }
-    speciesMap.set(answer.species_name, current)
-  }
-  
-  // 正答率を計算
-  const accuracies: SpeciesAccuracy[] = []
-  for (const [species_name, stats] of speciesMap) {
-    accuracies.push({
-      species_name,
-      total_answers: stats.total,
-      correct_answers: stats.correct,
-      accuracy_percent: Math.round((stats.correct / stats.total) * 100 * 10) / 10,
-    })
-  }
+  const accuracies: SpeciesAccuracy[] = data.map(stats => ({
+    species_name: stats.species_name,
+    total_answers: stats.total_answers,
+    correct_answers: stats.correct_answers,
+    accuracy_percent: Math.round((stats.correct_answers / stats.total_answers) * 100 * 10) / 10,
+  }))
   
   return accuracies.sort((a, b) => b.accuracy_percent - a.accuracy_percent)
 }
@@ -206,13 +232,14 @@ export async function awardBadge(userId: string, badgeType: BadgeType) {
  * バッジの獲得条件をチェックして付与
  */
 export async function checkAndAwardBadges(userId: string): Promise<BadgeType[]> {
-  const accuracies = await getSpeciesAccuracies(userId)
-  const earnedBadges = await getEarnedBadges(userId)
+  const [totals, earnedBadges] = await Promise.all([
+    getUserTotals(userId),
+    getEarnedBadges(userId),
+  ])
   const newBadges: BadgeType[] = []
   
-  // 正答率80%以上の種をカウント
-  const highAccuracySpecies = accuracies.filter(a => a.accuracy_percent >= 80)
-  const highAccuracyCount = highAccuracySpecies.length
+  // 正答率80%以上の種の数（集計テーブルで管理）
+  const highAccuracyCount = totals.mastered_species
   
   for (const badge of BADGES) {
     // 必要な種の数を計算
@@ -232,29 +259,22 @@ export async function checkAndAwardBadges(userId: string): Promise<BadgeType[]>
  * ユーザーの統計情報を取得
  */
 export async function getUserStats(userId: string): Promise<UserStats> {
-  const supabase = createClient()
+  // 合計（1行）、種ごとの正答率（種の数だけ）、獲得済みバッジを並行して取得
+  const [totals, speciesAccuracies, earnedBadges] = await Promise.all([
+    getUserTotals(userId),
+    getSpeciesAccuracies(userId),
+    getEarnedBadges(userId),
+  ])
   
-  // スコア履歴を取得
-  const { data: scores } = await supabase
-    .from('scores')
-    .select('score, total_questions')
-    .eq('user_id', userId)
-  
-  const totalQuizzes = scores?.length || 0
-  const totalCorrect = scores?.reduce((sum, s) => sum + s.score, 0) || 0
-  const totalQuestions = scores?.reduce((sum, s) => sum + s.total_questions, 0) || 0
+  const totalQuizzes = totals.total_quizzes
+  const totalCorrect = totals.total_correct
+  const totalQuestions = totals.total_questions
   const overallAccuracy = totalQuestions > 0 
     ? Math.round((totalCorrect / totalQuestions) * 100 * 10) / 10 
     : 0
   
-  // 種ごとの正答率
-  const speciesAccuracies = await getSpeciesAccuracies(userId)
-  
-  // 獲得済みバッジ
-  const earnedBadges = await getEarnedBadges(userId)
-  
   // 次のバッジと進捗を計算
-  const highAccuracyCount = speciesAccuracies.filter(a => a.accuracy_percent >= 80).length
+  const highAccuracyCount = totals.mastered_species
   let nextBadge: Badge | null = null
   let progressToNextBadge = 0
   
@@ -272,6 +292,7 @@ export async function getUserStats(userId: string): Promise<UserStats> {
     totalCorrect,
     totalQuestions,
     overallAccuracy,
+    masteredSpecies: highAccuracyCount,
     speciesAccuracies,
     earnedBadges,
     nextBadge,
@@ -0,0 +1,323 @@
+"""
+APIのエンドポイントベンチマーク
+合成データ（benchmarks/synthetic.py）を規模別に生成し、api/main.py の各エンドポイントを計測する
+
+  inprocess: ASGIアプリを同一プロセス内で直接呼び出す（ハンドラ自体のコスト）
+  uvicorn:   ローカルに起動したuvicornへHTTPで接続する（サーバー・ネットワーク込み）
+
+エンドポイントごとにスループットと p50/p95/p99 レイテンシを表示し、
+保存済みのベースライン（benchmarks/baseline.json）と比較して劣化していれば終了コード1で終わる
+
+使い方:
+  python benchmarks/bench_api.py                           # 既定の規模で計測してベースラインと比較
+  python benchmarks/bench_api.py --files 10,1000,100000 --mode both
+  python benchmarks/bench_api.py --update-baseline         # 計測結果をベースラインとして保存
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import httpx
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+# アクセスログの出力で計測が歪まないようにする
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("LOG_DIR", "")
+# 1つのクライアントから大量に送るため、流入制御を無効にする
+os.environ.setdefault("ADMISSION_MAX_CONCURRENCY", "0")
+os.environ.setdefault("RATE_LIMIT_API_RATE", "0")
+os.environ.setdefault("RATE_LIMIT_AUDIO_RATE", "0")
+
+from benchmarks.synthetic import generate_dataset
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+# ベースラインに対して許容する劣化率と、計測誤差として無視する差（ミリ秒）
+DEFAULT_TOLERANCE = 0.5
+DEFAULT_NOISE_FLOOR_MS = 1.0
+
+
+# ---------------------------------------------------------------------------
+# 集計
+# ---------------------------------------------------------------------------
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """ソート済みの値から最近傍順位法でパーセンタイルを求める"""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int = 0) -> Dict:
+    """レイテンシ（秒）のリストから統計値を計算"""
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "errors": errors,
+        "rps": round(len(values) / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+    }
+
+
+def print_table(title: str, results: Dict[str, Dict]):
+    print(f"\n== {title}")
+    print(f"{'endpoint':<20} {'count':>7} {'err':>5} {'req/s':>9} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9}")
+    for name, r in results.items():
+        print(f"{name:<20} {r['count']:>7} {r['errors']:>5} {r['rps']:>9.1f} "
+              f"{r['p50_ms']:>9.3f} {r['p95_ms']:>9.3f} {r['p99_ms']:>9.3f}")
+
+
+# ---------------------------------------------------------------------------
+# 計測対象のエンドポイント
+# ---------------------------------------------------------------------------
+
+class Endpoint:
+    """
+    計測するリクエストの定義
+    build(client, ctx, rng) は (method, url, kwargs) を返す（計測前の準備リクエストもここで行う）
+    """
+
+    def __init__(self, name: str, build: Callable[..., Awaitable[Tuple[str, str, Dict]]]):
+        self.name = name
+        self.build = build
+
+
+def _static(method: str, url: str, **kwargs):
+    async def build(client, ctx, rng):
+        return method, url, kwargs
+    return build
+
+
+async def _bird(client, ctx, rng):
+    return "GET", f"/api/bird/{rng.choice(ctx['species'])}", {}
+
+
+async def _suggest(client, ctx, rng):
+    name = rng.choice(ctx['species'])
+    return "GET", "/api/search/suggest", {"params": {"q": name[:rng.randint(1, 2)]}}
+
+
+async def _answer(client, ctx, rng):
+    # 回答には問題IDが必要なため、計測前に問題を取得しておく
+    question = (await client.get("/api/quiz/question")).json()
+    answer = rng.choice(question['choices'])
+    return "POST", "/api/quiz/answer", {"json": {"question_id": question['question_id'], "user_answer": answer}}
+
+
+async def _audio(client, ctx, rng):
+    return "GET", f"/audio/{quote(rng.choice(ctx['audio_files']), safe='')}", {}
+
+
+ENDPOINTS = [
+    Endpoint("root", _static("GET", "/")),
+    Endpoint("health", _static("GET", "/api/health")),
+    Endpoint("species", _static("GET", "/api/species")),
+    Endpoint("quiz_question", _static("GET", "/api/quiz/question")),
+    Endpoint("quiz_answer", _answer),
+    Endpoint("quiz_daily", _static("GET", "/api/quiz/daily")),
+    Endpoint("bird", _bird),
+    Endpoint("suggest", _suggest),
+    Endpoint("audio", _audio),
+]
+
+
+async def run_endpoint(client: httpx.AsyncClient, endpoint: Endpoint, ctx: Dict,
+                       requests: int, concurrency: int, seed: int = 0) -> Dict:
+    """1つのエンドポイントに requests 件のリクエストを concurrency 並列で送る"""
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker(worker_id: int, n: int):
+        nonlocal errors
+        rng = random.Random(seed * 1000 + worker_id)
+        for _ in range(n):
+            method, url, kwargs = await endpoint.build(client, ctx, rng)
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    # ウォームアップ
+    await worker(-1, min(10, requests))
+    latencies.clear()
+    errors = 0
+
+    per_worker = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i, n) for i, n in enumerate(per_worker) if n))
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, elapsed, errors)
+
+
+async def run_suite(client: httpx.AsyncClient, ctx: Dict, requests: int, concurrency: int,
+                    only: Optional[List[str]] = None) -> Dict[str, Dict]:
+    results = {}
+    for endpoint in ENDPOINTS:
+        if only and endpoint.name not in only:
+            continue
+        results[endpoint.name] = await run_endpoint(client, endpoint, ctx, requests, concurrency)
+    return results
+
+
+# ---------------------------------------------------------------------------
+# 実行モード
+# ---------------------------------------------------------------------------
+
+def load_app(base_dir: str):
+    """APP_BASE_DIR を切り替えて api.main を読み込み直す"""
+    os.environ["APP_BASE_DIR"] = base_dir
+    if "api.main" in sys.modules:
+        return importlib.reload(sys.modules["api.main"]).app
+    return importlib.import_module("api.main").app
+
+
+async def bench_inprocess(ctx: Dict, requests: int, concurrency: int, only=None) -> Dict[str, Dict]:
+    app = load_app(ctx['base_dir'])
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await run_suite(client, ctx, requests, concurrency, only)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_ready(base_url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/api/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"uvicorn did not become ready at {base_url}")
+
+
+async def bench_uvicorn(ctx: Dict, requests: int, concurrency: int, only=None) -> Dict[str, Dict]:
+    port = _free_port()
+    env = dict(os.environ, APP_BASE_DIR=ctx['base_dir'])
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        cwd=str(BASE_DIR), env=env, stdout=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        await _wait_ready(base_url)
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+            return await run_suite(client, ctx, requests, concurrency, only)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+# ---------------------------------------------------------------------------
+# ベースライン比較
+# ---------------------------------------------------------------------------
+
+def compare_with_baseline(results: Dict[str, Dict], baseline: Dict[str, Dict],
+                          tolerance: float, noise_floor_ms: float,
+                          metrics: Tuple[str, ...] = ("p95_ms",)) -> List[str]:
+    """指定した指標がベースラインの (1 + tolerance) 倍 + noise_floor_ms を超えたものを返す"""
+    regressions = []
+    for key, current in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        for metric in metrics:
+            limit = base[metric] * (1 + tolerance) + noise_floor_ms
+            if current[metric] > limit:
+                regressions.append(
+                    f"{key} {metric}: {current[metric]:.3f}ms > {limit:.3f}ms (baseline {base[metric]:.3f}ms)"
+                )
+        if current["errors"] > base.get("errors", 0):
+            regressions.append(f"{key} errors: {current['errors']} (baseline {base.get('errors', 0)})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="APIエンドポイントのベンチマーク")
+    parser.add_argument("--files", default="10,1000,10000", help="録音ファイル数（カンマ区切り）")
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn", "both"], default="inprocess")
+    parser.add_argument("--format", choices=["catalog", "json"], default="catalog", help="合成データの形式")
+    parser.add_argument("--requests", type=int, default=300, help="エンドポイントあたりのリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時リクエスト数")
+    parser.add_argument("--endpoints", default="", help="計測するエンドポイント名（カンマ区切り、既定: 全て）")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="結果をベースラインとして保存")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="許容する劣化率（0.5 = 50%%）")
+    parser.add_argument("--noise-floor-ms", type=float, default=DEFAULT_NOISE_FLOOR_MS)
+    parser.add_argument("--gate", default="p95_ms",
+                        help="劣化判定に使う指標（カンマ区切り、例: p95_ms,p99_ms）")
+    parser.add_argument("--json-out", type=Path, help="計測結果をJSONで保存")
+    args = parser.parse_args()
+
+    scales = [int(x) for x in args.files.split(",") if x]
+    modes = ["inprocess", "uvicorn"] if args.mode == "both" else [args.mode]
+    only = [x for x in args.endpoints.split(",") if x] or None
+
+    results: Dict[str, Dict] = {}
+    with tempfile.TemporaryDirectory(prefix="tori_bench_") as tmp:
+        for files in scales:
+            ctx = generate_dataset(Path(tmp) / f"files_{files}", files, data_format=args.format)
+            for mode in modes:
+                runner = bench_inprocess if mode == "inprocess" else bench_uvicorn
+                scale_results = asyncio.run(runner(ctx, args.requests, args.concurrency, only))
+                print_table(f"{mode} / {files} files / {ctx['species_count']} species", scale_results)
+                for name, r in scale_results.items():
+                    results[f"{mode}/{files}/{name}"] = r
+
+    if args.json_out:
+        args.json_out.write_text(json.dumps(results, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+
+    if args.update_baseline:
+        baseline = {}
+        if args.baseline.exists():
+            baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        baseline.update(results)
+        args.baseline.write_text(json.dumps(baseline, indent=2, ensure_ascii=False, sort_keys=True) + "\n",
+                                 encoding="utf-8")
+        print(f"\nベースラインを更新しました: {args.baseline}")
+        return
+
+    if not args.baseline.exists():
+        print(f"\nベースラインがありません: {args.baseline}（--update-baseline で作成）")
+        return
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+    gate = tuple(x for x in args.gate.split(",") if x)
+    regressions = compare_with_baseline(results, baseline, args.tolerance, args.noise_floor_ms, gate)
+    if regressions:
+        print("\n性能の劣化を検出しました:")
+        for line in regressions:
+            print(f"  - {line}")
+        sys.exit(1)
+    print("\nベースラインからの劣化はありません")
+
+
+if __name__ == "__main__":
+    main()
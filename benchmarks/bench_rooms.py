@@ -0,0 +1,229 @@
+"""
+クイズルーム（api/quiz_rooms.py）の負荷試験
+ルームを作り、参加者の数だけ WebSocket で接続して出題・回答を繰り返し、次を表示する
+
+  問題の配信遅延: ホストが next を送ってから各参加者が問題を受け取るまで（p50/p99/最大）
+  結果の配信遅延: 最後の回答を送ってから各参加者が結果を受け取るまで
+  配信1件あたりのサーバーCPU時間: 計測中のサーバープロセスのCPU時間（/proc）÷ 参加者が受け取ったメッセージ数
+
+参加者は同じプロセスの asyncio で動かすため、CPUが少ない環境では遅延に参加者側の処理待ちも含まれる
+（CPU時間はサーバーのプロセスだけを計るため、参加者側の影響を受けない）
+
+使い方:
+  python benchmarks/bench_rooms.py                                # 1ワーカー・50ルーム×40人
+  python benchmarks/bench_rooms.py --rooms 10 --members 200 --questions 5
+  python benchmarks/bench_rooms.py --workers 2                    # start.py で起動（ワーカー間の中継を含む）
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import httpx
+import websockets
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.bench_api import BASE_DIR, _free_port, _wait_ready, percentile
+
+# 同時に接続を始める数（接続待ちのキューがあふれないようにする）
+CONNECT_CONCURRENCY = 100
+
+
+def _cpu_seconds(pid: int) -> float:
+    """プロセスのCPU時間（ユーザー + システム、秒）"""
+    fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def _server_pids(pid: int) -> List[int]:
+    """サーバーのプロセス（start.py で起動した場合はワーカーを含む）"""
+    pids = [pid]
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            if int(stat.read_text().rsplit(")", 1)[1].split()[1]) == pid:
+                pids.append(int(stat.parent.name))
+        except (OSError, ValueError, IndexError):
+            continue
+    return pids
+
+
+class Stats:
+    def __init__(self):
+        self.question_latency: List[float] = []
+        self.result_latency: List[float] = []
+        self.received = 0
+        self.errors = 0
+        # ルーム・問題番号ごとの、ホストが next を送った時刻と最後の回答を送った時刻
+        self.sent_next: Dict[tuple, float] = {}
+        self.last_answer: Dict[tuple, float] = {}
+
+
+async def member(ws_url: str, code: str, index: int, stats: Stats, answer_spread: float,
+                 connected: asyncio.Event, semaphore: asyncio.Semaphore, ready: List[int]):
+    async with semaphore:
+        ws = await websockets.connect(f"{ws_url}/ws/rooms/{code}?name=bench{index}", max_queue=None)
+    ready[0] += 1
+    try:
+        async for text in ws:
+            stats.received += 1
+            message = json.loads(text)
+            kind = message["type"]
+            if kind == "joined":
+                connected.set()
+            elif kind == "question":
+                key = (code, message["number"])
+                stats.question_latency.append(time.perf_counter() - stats.sent_next[key])
+                await asyncio.sleep(random.uniform(0, answer_spread))
+                stats.last_answer[key] = max(stats.last_answer.get(key, 0.0), time.perf_counter())
+                await ws.send(json.dumps({"type": "answer", "choice": random.choice(message["choices"])}))
+            elif kind == "result":
+                stats.result_latency.append(time.perf_counter() - stats.last_answer[(code, message["number"])])
+            elif kind in ("closed", "error"):
+                break
+    except websockets.ConnectionClosed:
+        stats.errors += 1
+    finally:
+        await ws.close()
+
+
+async def host(ws_url: str, code: str, token: str, questions: int, stats: Stats, start: asyncio.Event):
+    async with websockets.connect(f"{ws_url}/ws/rooms/{code}?name=host&host_token={token}", max_queue=None) as ws:
+        await start.wait()
+        for number in range(1, questions + 1):
+            stats.sent_next[(code, number)] = time.perf_counter()
+            await ws.send(json.dumps({"type": "next"}))
+            async for text in ws:
+                stats.received += 1
+                if json.loads(text)["type"] == "result":
+                    break
+        await ws.send(json.dumps({"type": "close"}))
+        try:
+            async for text in ws:
+                stats.received += 1
+        except websockets.ConnectionClosed:
+            # ルームの終了（クローズコード 4000）
+            pass
+
+
+async def run(base_url: str, pid: Optional[int], rooms: int, members: int, questions: int,
+              answer_spread: float) -> Dict:
+    ws_url = "ws" + base_url[len("http"):]
+    stats = Stats()
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+    start = asyncio.Event()
+    ready = [0]
+    tasks = []
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        for _ in range(rooms):
+            room = (await client.post("/api/rooms")).json()
+            joined = [asyncio.Event() for _ in range(members)]
+            tasks.append(asyncio.create_task(host(ws_url, room["code"], room["host_token"], questions, stats, start)))
+            tasks += [asyncio.create_task(member(ws_url, room["code"], i, stats, answer_spread, joined[i],
+                                                 semaphore, ready))
+                      for i in range(members)]
+            await asyncio.gather(*(e.wait() for e in joined))
+    print(f"接続: {ready[0]}本（{rooms}ルーム × {members}人 + ホスト）")
+
+    pids = _server_pids(pid) if pid else []
+    cpu_before = sum(_cpu_seconds(p) for p in pids)
+    received_before = stats.received
+    started = time.perf_counter()
+    start.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    cpu = sum(_cpu_seconds(p) for p in pids) - cpu_before if pids else None
+    delivered = stats.received - received_before
+
+    def summary(values: List[float]) -> Dict:
+        values = sorted(values)
+        return {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+        }
+
+    return {
+        "rooms": rooms,
+        "members": members,
+        "questions": questions,
+        "elapsed_s": round(elapsed, 2),
+        "delivered": delivered,
+        "errors": stats.errors,
+        "question_fanout": summary(stats.question_latency),
+        "result_fanout": summary(stats.result_latency),
+        "server_cpu_s": round(cpu, 3) if cpu is not None else None,
+        "server_cpu_us_per_delivery": round(cpu / delivered * 1e6, 1) if cpu is not None and delivered else None,
+    }
+
+
+async def run_with_server(workers: int, **kwargs) -> Dict:
+    """このリポジトリの API を起動して計測する（workers が2以上なら start.py のマルチワーカー起動）"""
+    port = _free_port()
+    env = dict(os.environ, PORT=str(port), WORKERS=str(workers), LOG_LEVEL="WARNING",
+               ADMISSION_MAX_CONCURRENCY="0", RATE_LIMIT_API_RATE="0", TRAFFIC_CAPTURE="0")
+    if workers == 1:
+        command = [sys.executable, "-m", "uvicorn", "api.main:app", "--host", "127.0.0.1",
+                   "--port", str(port), "--log-level", "warning", "--no-access-log"]
+    else:
+        command = [sys.executable, "start.py"]
+    proc = subprocess.Popen(command, cwd=str(BASE_DIR), env=env, stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        await _wait_ready(base_url)
+        if workers > 1:
+            # 全ワーカーの起動を待つ
+            await asyncio.sleep(2)
+        return await run(base_url, proc.pid, **kwargs)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="クイズルームの負荷試験")
+    parser.add_argument("--url", default=None, help="計測するAPI（省略時はローカルに起動する）")
+    parser.add_argument("--workers", type=int, default=1, help="ローカルに起動するワーカー数")
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--members", type=int, default=40, help="ルームあたりの参加者数（ホストを除く）")
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--answer-spread", type=float, default=2.0, help="問題を受け取ってから回答するまでの最大秒数")
+    parser.add_argument("--json-out", type=Path, help="結果をJSONで保存")
+    args = parser.parse_args()
+
+    # 参加者の数だけソケットを開くため、ファイルディスクリプタの上限を引き上げる
+    if resource is not None:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    kwargs = dict(rooms=args.rooms, members=args.members, questions=args.questions, answer_spread=args.answer_spread)
+    if args.url:
+        result = asyncio.run(run(args.url.rstrip("/"), None, **kwargs))
+    else:
+        result = asyncio.run(run_with_server(args.workers, **kwargs))
+
+    print(f"計測時間: {result['elapsed_s']}秒 / 受信メッセージ: {result['delivered']}件 / 切断: {result['errors']}件")
+    for label, key in (("問題の配信遅延", "question_fanout"), ("結果の配信遅延", "result_fanout")):
+        s = result[key]
+        print(f"{label}: p50 {s['p50_ms']}ms / p99 {s['p99_ms']}ms / 最大 {s['max_ms']}ms（{s['count']}件）")
+    if result["server_cpu_s"] is not None:
+        print(f"サーバーCPU時間: {result['server_cpu_s']}秒（配信1件あたり {result['server_cpu_us_per_delivery']}µs）")
+    if args.json_out:
+        args.json_out.write_text(json.dumps(result, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+録音の重複検出（api/fingerprint.py・api/build_fingerprints.py）の回帰チェック
+合成した録音と、それを加工したコピーで索引を作って照合し、次を確認する
+
+  加工したコピーがすべて元の録音との組として検出されること
+    切り出し + 音量の変更 + 雑音（3つを同時に加えたもの）、雑音を減らしたもの、音量だけ変えたもの
+  関係のない録音同士の組が検出されないこと
+
+いずれかを満たさなければ終了コード1で終わる（fingerprint.py のパラメータ・しきい値を変えたら実行する）
+ffmpeg は不要（合成した波形を直接フィンガープリントにする）
+
+使い方:
+  python benchmarks/check_fingerprints.py
+  python benchmarks/check_fingerprints.py --recordings 200 --copies 100 --seed 1
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from api.build_fingerprints import find_pairs
+from api.fingerprint import FingerprintIndex, fingerprint
+from api.visuals import SAMPLE_RATE
+
+BIRDS = ["ウグイス", "メジロ", "シジュウカラ", "ヒヨドリ", "スズメ"]
+
+
+def _calls(rng: np.random.Generator, seconds: float, amplitude: float, gap: Tuple[float, float]) -> np.ndarray:
+    """周波数の変わる短い鳴き声を並べた波形"""
+    x = np.zeros(int(seconds * SAMPLE_RATE), np.float32)
+    t = rng.uniform(0, 0.3)
+    while t < seconds - 0.4:
+        duration = rng.uniform(0.04, 0.25)
+        f0 = rng.uniform(1200, 9000)
+        f1 = np.clip(f0 + rng.uniform(-2000, 2000), 500, 9500)
+        n = int(duration * SAMPLE_RATE)
+        tt = np.arange(n) / SAMPLE_RATE
+        phase = 2 * np.pi * (f0 * tt + (f1 - f0) * tt ** 2 / (2 * duration))
+        start = int(t * SAMPLE_RATE)
+        x[start:start + n] += amplitude * rng.uniform(0.3, 1) * np.sin(phase) * np.hanning(n)
+        t += duration + rng.uniform(*gap)
+    return x
+
+
+def recording(seed: int, seconds: float, noise_level: float = 0.03) -> np.ndarray:
+    """合成した録音（主の鳴き声 + 遠くの鳥の声 + 背景の雑音）"""
+    rng = np.random.default_rng(seed)
+    x = _calls(rng, seconds, 0.5, (0.02, 0.2)) + _calls(rng, seconds, 0.15, (0.0, 0.1))
+    return x + noise_level * rng.standard_normal(len(x)).astype(np.float32)
+
+
+def make_copy(rng: np.random.Generator, kind: str, seed: int, seconds: float) -> np.ndarray:
+    """録音を加工したコピー"""
+    if kind == "denoise":
+        # ノイズ除去の代わりに、背景の雑音を小さくして作り直す
+        return recording(seed, seconds, noise_level=0.005)
+    x = recording(seed, seconds)
+    if kind == "crop_gain_noise":
+        start = rng.uniform(0.3, 8)
+        end = start + rng.uniform(5, 15)
+        x = x[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)] * rng.uniform(0.3, 0.8)
+        return x + rng.uniform(0.02, 0.06) * rng.standard_normal(len(x)).astype(np.float32)
+    return x * rng.uniform(0.3, 0.8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="録音の重複検出の回帰チェック")
+    parser.add_argument("--recordings", type=int, default=80, help="元の録音の数")
+    parser.add_argument("--copies", type=int, default=40, help="加工したコピーの数")
+    parser.add_argument("--seconds", type=float, default=30, help="元の録音の長さ（秒）")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    index = FingerprintIndex()
+    expected: Dict[str, str] = {}
+    started = time.perf_counter()
+
+    for i in range(args.recordings):
+        hashes, times = fingerprint(recording(args.seed * 100000 + i, args.seconds))
+        bird = BIRDS[i % len(BIRDS)]
+        index.add({'filename': f"{bird}　録音{i}.wav", 'content_hash': None, 'bird_name': bird}, hashes, times)
+
+    kinds = ["crop_gain_noise", "crop_gain_noise", "denoise", "gain"]
+    for c in range(args.copies):
+        i = int(rng.integers(args.recordings))
+        kind = kinds[c % len(kinds)]
+        hashes, times = fingerprint(make_copy(rng, kind, args.seed * 100000 + i, args.seconds))
+        bird = BIRDS[i % len(BIRDS)]
+        filename = f"{bird}　録音{i} {kind}{c}.wav"
+        index.add({'filename': filename, 'content_hash': None, 'bird_name': bird}, hashes, times)
+        expected[filename] = f"{bird}　録音{i}.wav"
+    index.build()
+    print(f"録音: {args.recordings}件 + コピー: {args.copies}件（フィンガープリント {time.perf_counter() - started:.1f}秒）")
+
+    pairs = find_pairs(index, {entry['filename'] for entry in index.files})
+    found = {tuple(p["files"]): p for p in pairs}
+
+    missed: List[str] = []
+    weakest = None
+    for copy, original in sorted(expected.items()):
+        pair = found.pop(tuple(sorted((copy, original))), None)
+        if pair is None:
+            missed.append(copy)
+        elif weakest is None or pair["matches"] < weakest["matches"]:
+            weakest = pair
+    # 同じ録音のコピー同士の組は正しい検出
+    false_pairs = [p for key, p in found.items() if len({expected.get(name, name) for name in key}) != 1]
+
+    if weakest is not None:
+        print(f"最も弱い検出: 一致 {weakest['matches']}件・期待値 {weakest['background']}・類似度 {weakest['similarity']}"
+              f"（{weakest['files'][0]} / {weakest['files'][1]}）")
+    print(f"検出: {args.copies - len(missed)}/{args.copies}件 / 関係のない組: {len(false_pairs)}件")
+    for copy in missed:
+        print(f"  ✗ 未検出: {copy}")
+    for pair in false_pairs:
+        print(f"  ✗ 誤検出: {pair['files'][0]} / {pair['files'][1]}（一致 {pair['matches']}件）")
+    if missed or false_pairs:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
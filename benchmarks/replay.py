@@ -0,0 +1,235 @@
+"""
+記録した本番トラフィック（api/traffic_capture.py）の再生
+記録の到着間隔どおり（--speed で N 倍速）にリクエストを送り、ルートごとのスループットと p50/p95/p99 レイテンシを表示する
+
+応答を待たずに記録の時刻どおりに送るため（オープンループ）、サーバーが遅くなると同時に処理中の件数が増える
+送信が予定より遅れた場合は「送信遅れ」として表示する（大きい場合は再生側が追いついていない）
+
+記録に含まれない値は再生時に補う
+- 回答（POST /api/quiz/answer）: 同じクライアントが直前に取得した問題に、選択肢からランダムに答える
+- session: 同じクライアントが直前に受け取ったセッション
+- q（文字数のみ記録）: 記録と同じ文字数の種名の先頭
+
+使い方:
+  python benchmarks/replay.py logs/traffic/traffic_*.jsonl.gz --url http://localhost:8000
+  python benchmarks/replay.py logs/traffic/ --speed 4 --serve     # ローカルにuvicornを起動して4倍速で再生
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.bench_api import BASE_DIR, _free_port, _wait_ready, print_table, summarize
+
+# 同時に処理中にするリクエスト数の上限（再生側のソケットを使い切らないように）
+DEFAULT_MAX_IN_FLIGHT = 1000
+
+
+def load_capture(paths: List[Path]) -> List[Dict]:
+    """記録ファイル（ディレクトリならその中の全ファイル）を読み込み、到着順に並べる"""
+    files: List[Path] = []
+    for path in paths:
+        files.extend(sorted(path.glob("traffic_*.jsonl.gz")) if path.is_dir() else [path])
+
+    events = []
+    for path in files:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = None
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if "v" in record:
+                    header = record
+                    continue
+                if header is None or "p" not in record:
+                    continue
+                # ワーカーごとにクライアントの番号を振っているため、pid と組にする
+                record["client"] = (header["pid"], record["c"])
+                record["at"] = header["start"] + record["t"] / 1000
+                events.append(record)
+    events.sort(key=lambda e: e["at"])
+    return events
+
+
+class ClientState:
+    """再生中のクライアントごとの状態（直前の問題とセッション）"""
+
+    def __init__(self):
+        self.question: Optional[Dict] = None
+        self.session: Optional[str] = None
+
+
+class Replayer:
+    def __init__(self, client: httpx.AsyncClient, species: List[str], seed: int = 0):
+        self.client = client
+        self.species = species or ["ア"]
+        self.rng = random.Random(seed)
+        self.clients: Dict[Tuple, ClientState] = {}
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.status_mismatches = 0
+        self.lags: List[float] = []
+
+    def _query(self, event: Dict, state: ClientState) -> Dict:
+        params: Dict = {}
+        for key, value in event.get("q", {}).items():
+            if key == "session":
+                if state.session:
+                    params[key] = state.session
+            elif key == "q" and isinstance(value, int):
+                name = self.rng.choice(self.species)
+                params[key] = name[:max(1, value)]
+            elif not isinstance(value, int):
+                params[key] = value
+        return params
+
+    async def _build(self, event: Dict, state: ClientState) -> Tuple[str, str, Dict]:
+        kwargs: Dict = {"params": self._query(event, state)}
+        if "h" in event:
+            kwargs["headers"] = {"Range": event["h"]}
+        route = event.get("r")
+        if route == "/api/quiz/answer":
+            if state.question is None:
+                # 記録の最初が回答の場合は問題を取得しておく（計測しない）
+                state.question = (await self.client.get("/api/quiz/question")).json()
+            question = state.question
+            kwargs["json"] = {"question_id": question.get("question_id", ""),
+                              "user_answer": self.rng.choice(question.get("choices") or [""])}
+        elif route == "/api/quiz/score":
+            total = 5
+            kwargs["json"] = {"score": self.rng.randint(0, total), "total_questions": total}
+        return event["m"], event["p"], kwargs
+
+    async def send(self, event: Dict, scheduled: float):
+        self.lags.append(max(0.0, time.perf_counter() - scheduled))
+        state = self.clients.setdefault(event["client"], ClientState())
+        route = event.get("r", "other")
+        try:
+            method, url, kwargs = await self._build(event, state)
+            start = time.perf_counter()
+            response = await self.client.request(method, url, **kwargs)
+            self.latencies.setdefault(route, []).append(time.perf_counter() - start)
+        except httpx.HTTPError:
+            self.errors[route] = self.errors.get(route, 0) + 1
+            return
+        if response.status_code >= 400:
+            self.errors[route] = self.errors.get(route, 0) + 1
+        if (response.status_code >= 400) != (event.get("s", 200) >= 400):
+            self.status_mismatches += 1
+        if route == "/api/quiz/question" and response.status_code == 200:
+            data = response.json()
+            state.question = data
+            state.session = data.get("session") or state.session
+
+    async def run(self, events: List[Dict], speed: float, max_in_flight: int) -> float:
+        """記録の到着間隔を speed で割った間隔で送る（かかった秒数を返す）"""
+        semaphore = asyncio.Semaphore(max_in_flight)
+        tasks = []
+
+        async def guarded(event, scheduled):
+            try:
+                await self.send(event, scheduled)
+            finally:
+                semaphore.release()
+
+        origin = events[0]["at"]
+        start = time.perf_counter()
+        for event in events:
+            scheduled = start + (event["at"] - origin) / speed
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(guarded(event, scheduled)))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - start
+
+    def results(self, elapsed: float) -> Dict[str, Dict]:
+        results = {
+            route: summarize(values, elapsed, self.errors.get(route, 0))
+            for route, values in sorted(self.latencies.items())
+        }
+        every = [v for values in self.latencies.values() for v in values]
+        results["(all)"] = summarize(every, elapsed, sum(self.errors.values()))
+        return results
+
+
+async def replay(base_url: str, events: List[Dict], speed: float, max_in_flight: int) -> Tuple[Dict, Replayer, float]:
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        species_response = await client.get("/api/species")
+        species = [s["japanese_name"] for s in species_response.json().get("species", [])] \
+            if species_response.status_code == 200 else []
+        replayer = Replayer(client, species)
+        elapsed = await replayer.run(events, speed, max_in_flight)
+    return replayer.results(elapsed), replayer, elapsed
+
+
+async def replay_with_server(events: List[Dict], speed: float, max_in_flight: int):
+    """このリポジトリの api.main をuvicornで起動して再生する"""
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        # 再生したリクエストを記録し直さない
+        cwd=str(BASE_DIR), env=dict(os.environ, TRAFFIC_CAPTURE="0"), stdout=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        await _wait_ready(base_url)
+        return await replay(base_url, events, speed, max_in_flight)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="記録したトラフィックの再生")
+    parser.add_argument("paths", nargs="+", type=Path, help="記録ファイルまたはディレクトリ")
+    parser.add_argument("--url", default="http://localhost:8000", help="再生先のAPI")
+    parser.add_argument("--serve", action="store_true", help="ローカルにuvicornを起動して再生する（--url は無視）")
+    parser.add_argument("--speed", type=float, default=1.0, help="再生速度（2 = 到着間隔を半分にする）")
+    parser.add_argument("--limit", type=int, default=0, help="再生するリクエスト数（0 = 全て）")
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT)
+    parser.add_argument("--json-out", type=Path, help="結果をJSONで保存")
+    args = parser.parse_args()
+
+    events = load_capture(args.paths)
+    if args.limit:
+        events = events[:args.limit]
+    if not events:
+        print("再生するリクエストがありません")
+        sys.exit(1)
+    span = events[-1]["at"] - events[0]["at"]
+    print(f"{len(events)}件 / 記録の長さ {span:.1f}秒 / {args.speed:g}倍速（約{span / args.speed:.1f}秒）")
+
+    if args.serve:
+        results, replayer, elapsed = asyncio.run(replay_with_server(events, args.speed, args.max_in_flight))
+    else:
+        results, replayer, elapsed = asyncio.run(replay(args.url, events, args.speed, args.max_in_flight))
+
+    print_table(f"replay x{args.speed:g} / {elapsed:.1f}s", results)
+    lags = sorted(replayer.lags)
+    lag = summarize(lags, elapsed)
+    print(f"\n送信遅れ: p50 {lag['p50_ms']:.1f}ms / p99 {lag['p99_ms']:.1f}ms")
+    print(f"記録とエラーの有無が異なる応答: {replayer.status_mismatches}件")
+
+    if args.json_out:
+        args.json_out.write_text(json.dumps(results, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+ベンチマーク用の合成データを生成するスクリプト
+APP_BASE_DIR に指定できる形のディレクトリを作る
+
+<out_dir>/
+  api/sound_files.json
+  birdVoiceSearch/mokuroku_parsed.json
+  birdVoiceSearch/catalog.arrow   （--format catalog の場合）
+  sound/*.mp3                     （先頭 --audio-sample 件のみダミーの音声を作成）
+"""
+
+import argparse
+import json
+import random
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from api.catalog import sound_file_record, write_catalog
+
+KATAKANA = "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワ"
+
+# ダミー音声のサイズ（バイト）
+DUMMY_AUDIO_SIZE = 32 * 1024
+
+
+def _species_name(i: int) -> str:
+    """重複しないカタカナの種名を作る"""
+    chars = []
+    n = i
+    while True:
+        chars.append(KATAKANA[n % len(KATAKANA)])
+        n //= len(KATAKANA)
+        if n == 0:
+            break
+    return "".join(reversed(chars)) + "ドリ"
+
+
+def generate_mokuroku(species_count: int) -> List[Dict]:
+    """目録（mokuroku_parsed.json 形式）を生成"""
+    records = []
+    for i in range(species_count):
+        family_id = i // 8
+        order_id = family_id // 6
+        records.append({
+            "number": str(i + 1),
+            "scientific_name": f"Genus{i // 3} species{i}",
+            "japanese_name": _species_name(i),
+            "genus": f"GENUS{i // 3}",
+            "genus_jp": f"{_species_name(i - i % 3)}属",
+            "family": f"FAMILY{family_id}IDAE",
+            "family_jp": f"{_species_name(family_id * 8)}科",
+            "order": f"ORDER{order_id}FORMES",
+            "order_jp": f"{_species_name(order_id * 48)}目",
+            "is_subspecies": False,
+        })
+    return records
+
+
+def generate_sound_files(mokuroku: List[Dict], file_count: int, seed: int = 0) -> Dict:
+    """sound_files.json 形式のデータを生成（録音数は種ごとに偏らせる）"""
+    rng = random.Random(seed)
+    # 各種に最低1件を割り当て、残りは実データと同様に一部の種に集中させる
+    weights = [1.0 / (rank + 1) ** 0.8 for rank in range(len(mokuroku))]
+    birds = mokuroku[:file_count] + rng.choices(mokuroku, weights=weights, k=max(0, file_count - len(mokuroku)))
+
+    success = []
+    for i, bird in enumerate(birds):
+        filename = f"{bird['japanese_name']}　synthetic_{i:06d}.mp3"
+        success.append({
+            'filename': filename,
+            'filepath': f"sound/{filename}",
+            'bird_name': bird['japanese_name'],
+            'scientific_name': bird['scientific_name'],
+            'family': bird['family'],
+            'family_jp': bird['family_jp'],
+            'order': bird['order'],
+            'order_jp': bird['order_jp'],
+            'genus': bird['genus'],
+            'genus_jp': bird['genus_jp'],
+        })
+    return {
+        'success': success,
+        'not_found': [],
+        'total_success': len(success),
+        'total_not_found': 0,
+    }
+
+
+def generate_dataset(
+    out_dir: Path,
+    file_count: int,
+    species_count: int = 0,
+    audio_sample: int = 50,
+    data_format: str = "catalog",
+    seed: int = 0,
+) -> Dict:
+    """
+    合成データ一式を書き出す
+    species_count を省略すると録音数に応じて決める（最低4種、最大700種、録音数以下）
+    """
+    if species_count <= 0:
+        species_count = max(4, min(700, file_count // 5))
+    species_count = min(species_count, file_count)
+
+    mokuroku = generate_mokuroku(species_count)
+    sound_files = generate_sound_files(mokuroku, file_count, seed=seed)
+
+    (out_dir / "api").mkdir(parents=True, exist_ok=True)
+    (out_dir / "birdVoiceSearch").mkdir(parents=True, exist_ok=True)
+    sound_dir = out_dir / "sound"
+    sound_dir.mkdir(parents=True, exist_ok=True)
+
+    with open(out_dir / "api" / "sound_files.json", 'w', encoding='utf-8') as f:
+        json.dump(sound_files, f, ensure_ascii=False)
+    with open(out_dir / "birdVoiceSearch" / "mokuroku_parsed.json", 'w', encoding='utf-8') as f:
+        json.dump(mokuroku, f, ensure_ascii=False)
+
+    catalog_path = out_dir / "birdVoiceSearch" / "catalog.arrow"
+    if data_format == "catalog":
+        records = [sound_file_record(f) for f in sound_files['success']]
+        write_catalog(records, [b['japanese_name'] for b in mokuroku], catalog_path)
+    elif catalog_path.exists():
+        catalog_path.unlink()
+
+    # /audio 配信の計測用に先頭の録音だけダミーファイルを作る
+    rng = random.Random(seed)
+    payload = bytes(rng.getrandbits(8) for _ in range(DUMMY_AUDIO_SIZE))
+    sample = sound_files['success'][:audio_sample]
+    for f in sample:
+        path = sound_dir / f['filename']
+        if not path.exists():
+            path.write_bytes(payload)
+
+    return {
+        "base_dir": str(out_dir),
+        "file_count": file_count,
+        "species_count": species_count,
+        "audio_files": [f['filename'] for f in sample],
+        "species": sorted({f['bird_name'] for f in sound_files['success']}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ベンチマーク用の合成データを生成")
+    parser.add_argument("out_dir", type=Path, help="出力先ディレクトリ")
+    parser.add_argument("--files", type=int, default=1000, help="録音ファイル数")
+    parser.add_argument("--species", type=int, default=0, help="種数（0: 録音数から自動決定）")
+    parser.add_argument("--audio-sample", type=int, default=50, help="ダミー音声を作成する件数")
+    parser.add_argument("--format", choices=["catalog", "json"], default="catalog",
+                        help="catalog: catalog.arrow も作成 / json: sound_files.json のみ")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    info = generate_dataset(args.out_dir, args.files, args.species, args.audio_sample, args.format, args.seed)
+    print(f"生成しました: {info['base_dir']}")
+    print(f"  録音: {info['file_count']}件 / 種: {info['species_count']}種")
+
+
+if __name__ == "__main__":
+    main()
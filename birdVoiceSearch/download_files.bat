@@ -1,19 +0,0 @@
-@echo off
-curl -O https://www.bird-research.jp/1_shiryo/onsei/hototogisu-ueta-tokyo060610.mp3
-timeout /t 5
-curl -O https://www.bird-research.jp/1_shiryo/koe/hototogisu_110609_okayama_kaji.mp3
-timeout /t 5
-curl -O https://www.bird-research.jp/1_shiryo/koe/hototogisu_180522_kosado_mju.mp3
-timeout /t 5
-curl -O https://xeno-canto.org/918764/download
-timeout /t 5
-curl -O https://xeno-canto.org/388527/download
-timeout /t 5
-curl -O https://xeno-canto.org/388526/download
-timeout /t 5
-curl -O https://xeno-canto.org/388525/download
-timeout /t 5
-curl -O https://xeno-canto.org/388522/download
-timeout /t 5
-echo end
-pause
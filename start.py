@@ -1,9 +1,278 @@
 #!/usr/bin/env python3
-"""Railway用の起動スクリプト"""
+"""
+Railway用の起動スクリプト
+
+WORKERS=1 なら従来どおり uvicorn を1プロセスで起動する
+2以上（既定の auto は利用可能なCPU数）の場合は、親プロセスでカタログと索引を読み込んでから
+ワーカーを fork する。読み込んだデータはワーカー間でコピーオンライトで共有される
+
+  WORKERS=auto                 ワーカー数（auto: 利用可能なCPU数）
+  CATALOG_WATCH_INTERVAL=5     catalog.arrow の更新を確認する間隔（秒、0で無効）
+  GRACEFUL_TIMEOUT=30          ワーカー停止時に処理中のリクエストを待つ時間（秒）
+
+catalog.arrow が更新されるか親プロセスに SIGHUP を送ると、カタログを読み込み直して
+ワーカーを1つずつ入れ替える（新しいワーカーの起動を待ってから古いワーカーを止める）
+"""
+import gc
+import logging
+import math
 import os
+import select
+import signal
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Optional, Set
+
 import uvicorn
 
+HOST = "0.0.0.0"
+
+# ワーカーの起動完了を待つ時間（秒）
+WORKER_READY_TIMEOUT = 30
+
+logger = logging.getLogger("start")
+
+
+def available_cpus() -> int:
+    """このプロセスが使えるCPU数（CPUアフィニティとcgroupの上限を考慮）"""
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        count = os.cpu_count() or 1
+
+    # コンテナのCPU上限（cgroup v2）
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            count = min(count, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return count
+
+
+def worker_count() -> int:
+    value = os.environ.get("WORKERS", "auto").strip().lower()
+    if value in ("", "auto", "0"):
+        return available_cpus()
+    return max(1, int(value))
+
+
+class _WorkerServer(uvicorn.Server):
+    """起動が完了したらパイプで親プロセスに通知するサーバー"""
+
+    def __init__(self, config: uvicorn.Config, ready_fd: int):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        if not self.should_exit:
+            try:
+                os.write(self.ready_fd, b"1")
+            except BrokenPipeError:
+                # 親が待つのをやめていても起動は続ける
+                pass
+        os.close(self.ready_fd)
+
+
+class PreforkLauncher:
+    """データを読み込んだ親プロセスからワーカーを fork して管理する"""
+
+    def __init__(self, port: int, workers: int):
+        self.port = port
+        self.workers = workers
+        self.watch_interval = float(os.environ.get("CATALOG_WATCH_INTERVAL", 5))
+        self.graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 30))
+        self.children: Dict[int, float] = {}  # pid -> 起動時刻
+        self.retiring: Set[int] = set()
+        self.should_exit = False
+        self.reload_requested = False
+
+    def run(self):
+        # 読み込み中にGCが走ってオブジェクトのヘッダーを書き換えないよう、fork までGCを止めておく
+        gc.disable()
+        # ワーカーのメトリクスを合算する共有のディレクトリ（api.metrics の読み込み前に決める）
+        os.environ.setdefault("METRICS_DIR", str(Path(tempfile.gettempdir()) / f"tori_metrics_{os.getpid()}"))
+        import api.main as main
+        self.main = main
+
+        main.load_data()
+        self._freeze()
+
+        config = uvicorn.Config(main.app, host=HOST, port=self.port)
+        self.sock = config.bind_socket()
+
+        signal.signal(signal.SIGTERM, self._handle_exit)
+        signal.signal(signal.SIGINT, self._handle_exit)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+        logger.info("starting workers", extra={"port": self.port, "workers": self.workers})
+        ready_fds = [self._spawn() for _ in range(self.workers)]
+        for ready_fd in ready_fds:
+            if not self._wait_ready(ready_fd):
+                logger.error("worker did not become ready")
+
+        catalog_mtime = self._catalog_mtime()
+        last_check = time.monotonic()
+        while not self.should_exit:
+            time.sleep(0.5)
+            self._reap()
+
+            if self.watch_interval > 0 and time.monotonic() - last_check >= self.watch_interval:
+                last_check = time.monotonic()
+                if self._catalog_mtime() != catalog_mtime:
+                    logger.info("catalog updated", extra={"path": str(main.CATALOG_PATH)})
+                    self.reload_requested = True
+
+            if self.reload_requested:
+                self.reload_requested = False
+                catalog_mtime = self._catalog_mtime()
+                self._rolling_restart()
+
+        self._shutdown()
+
+    def _handle_exit(self, signum, frame):
+        self.should_exit = True
+
+    def _handle_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def _catalog_mtime(self) -> Optional[int]:
+        try:
+            return self.main.CATALOG_PATH.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def _freeze():
+        # 読み込んだオブジェクトをGCの対象外にし、ワーカーでの走査によるページのコピーを防ぐ
+        gc.collect()
+        gc.freeze()
+
+    def _spawn(self) -> int:
+        """ワーカーを1つ起動し、起動完了を通知するパイプの読み出し側を返す"""
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            self._run_worker(ready_w)
+        os.close(ready_w)
+        self.children[pid] = time.monotonic()
+        logger.info("worker started", extra={"pid": pid})
+        return ready_r
+
+    def _run_worker(self, ready_fd: int):
+        """ワーカープロセスの処理（戻らない）"""
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        gc.enable()
+
+        exit_code = 0
+        try:
+            config = uvicorn.Config(
+                self.main.app, host=HOST, port=self.port, timeout_graceful_shutdown=self.graceful_timeout)
+            _WorkerServer(config, ready_fd).run(sockets=[self.sock])
+        except BaseException:
+            logger.exception("worker failed")
+            exit_code = 1
+        finally:
+            from api.structured_log import shutdown_logging
+            shutdown_logging()
+            os._exit(exit_code)
+
+    def _wait_ready(self, ready_fd: int) -> bool:
+        try:
+            readable, _, _ = select.select([ready_fd], [], [], WORKER_READY_TIMEOUT)
+            return bool(readable) and os.read(ready_fd, 1) == b"1"
+        finally:
+            os.close(ready_fd)
+
+    def _reap(self):
+        """終了したワーカーを回収し、意図せず終了したものは起動し直す"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+
+            started_at = self.children.pop(pid, None)
+            if started_at is None or self.should_exit:
+                continue
+            logger.warning("worker exited", extra={"pid": pid, "exit_code": os.waitstatus_to_exitcode(status)})
+            if time.monotonic() - started_at < 5:
+                # 起動直後に落ち続ける場合に連続で fork しない
+                time.sleep(1)
+            if not self._wait_ready(self._spawn()):
+                logger.error("restarted worker did not become ready")
+
+    def _rolling_restart(self):
+        """カタログを読み込み直し、ワーカーを1つずつ入れ替える"""
+        gc.unfreeze()
+        try:
+            self.main.load_data()
+        except Exception:
+            logger.exception("failed to reload catalog, keeping current workers")
+            return
+        finally:
+            self._freeze()
+
+        for old_pid in list(self.children):
+            if self.should_exit:
+                return
+            if not self._wait_ready(self._spawn()):
+                logger.error("new worker did not become ready, stopping rolling restart")
+                return
+            self.children.pop(old_pid, None)
+            self.retiring.add(old_pid)
+            self._kill(old_pid, signal.SIGTERM)
+        logger.info("rolling restart finished", extra={"workers": len(self.children)})
+
+    @staticmethod
+    def _kill(pid: int, sig: int):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _shutdown(self):
+        """全ワーカーに SIGTERM を送り、処理中のリクエストが終わるのを待つ"""
+        pids = set(self.children) | self.retiring
+        for pid in pids:
+            self._kill(pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while pids and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.1)
+            else:
+                pids.discard(pid)
+        for pid in pids:
+            self._kill(pid, signal.SIGKILL)
+        self.sock.close()
+        from api import metrics
+        metrics.registry.cleanup()
+        logger.info("all workers stopped")
+
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
-    print(f"Starting server on port {port}")
-    uvicorn.run("api.main:app", host="0.0.0.0", port=port)
+    workers = worker_count()
+
+    if workers == 1 or not hasattr(os, "fork"):
+        print(f"Starting server on port {port}")
+        uvicorn.run("api.main:app", host=HOST, port=port)
+    else:
+        PreforkLauncher(port, workers).run()
+        sys.exit(0)
@@ -61,16 +61,191 @@ CREATE POLICY "Users can view their own badges" ON user_badges
 CREATE POLICY "Users can insert their own badges" ON user_badges
     FOR INSERT WITH CHECK (auth.uid() = user_id);
 
--- 種ごとの正答率を計算するビュー
-CREATE OR REPLACE VIEW species_accuracy AS
-SELECT 
+
+-- ============================================================
+-- 集計テーブル（回答履歴への INSERT 時にトリガーで加算する）
+-- バッジ判定・統計表示で回答履歴全体を集計しないようにするため
+-- ============================================================
+
+-- 4. ユーザー×種ごとの回答数・正解数
+CREATE TABLE IF NOT EXISTS user_species_stats (
+    user_id UUID REFERENCES auth.users(id) ON DELETE CASCADE,
+    species_name TEXT NOT NULL,
+    total_answers INTEGER NOT NULL DEFAULT 0,
+    correct_answers INTEGER NOT NULL DEFAULT 0,
+    last_answered_at TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (user_id, species_name)
+);
+
+-- 5. ユーザーごとの合計（1ユーザー1行）
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id UUID PRIMARY KEY REFERENCES auth.users(id) ON DELETE CASCADE,
+    total_quizzes INTEGER NOT NULL DEFAULT 0,     -- scores の行数
+    total_questions INTEGER NOT NULL DEFAULT 0,   -- scores.total_questions の合計
+    total_correct INTEGER NOT NULL DEFAULT 0,     -- scores.score の合計
+    total_answers INTEGER NOT NULL DEFAULT 0,     -- species_answers の行数
+    mastered_species INTEGER NOT NULL DEFAULT 0,  -- 正答率80%以上の種の数（バッジ判定用）
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+ALTER TABLE user_species_stats ENABLE ROW LEVEL SECURITY;
+ALTER TABLE user_stats ENABLE ROW LEVEL SECURITY;
+
+-- 集計テーブルは参照のみ許可（書き込みはトリガーのみ）
+CREATE POLICY "Users can view their own species stats" ON user_species_stats
+    FOR SELECT USING (auth.uid() = user_id);
+
+CREATE POLICY "Users can view their own stats" ON user_stats
+    FOR SELECT USING (auth.uid() = user_id);
+
+-- species_answers の INSERT 文ごとに、追加された行をまとめて集計テーブルに加算する
+-- （API からの複数行 INSERT でも、ユーザー×種ごとに1回の更新で済む）
+CREATE OR REPLACE FUNCTION apply_species_answers_to_stats()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    WITH increments AS (
+        SELECT
+            user_id,
+            species_name,
+            COUNT(*) AS total,
+            COUNT(*) FILTER (WHERE is_correct) AS correct,
+            MAX(answered_at) AS last_at
+        FROM new_rows
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id, species_name
+    ),
+    upserted AS (
+        -- 同時に実行された INSERT とのデッドロックを避けるため、常に同じ順で行ロックを取る
+        INSERT INTO user_species_stats AS s (user_id, species_name, total_answers, correct_answers, last_answered_at)
+        SELECT user_id, species_name, total, correct, last_at
+        FROM increments
+        ORDER BY user_id, species_name
+        ON CONFLICT (user_id, species_name) DO UPDATE SET
+            total_answers = s.total_answers + EXCLUDED.total_answers,
+            correct_answers = s.correct_answers + EXCLUDED.correct_answers,
+            last_answered_at = GREATEST(s.last_answered_at, EXCLUDED.last_answered_at)
+        RETURNING s.user_id, s.species_name, s.total_answers, s.correct_answers
+    ),
+    deltas AS (
+        -- 加算の前後で「正答率80%以上」になった／外れた種の数の差分
+        SELECT
+            u.user_id,
+            SUM(i.total) AS answers,
+            SUM(
+                (u.correct_answers * 100 >= u.total_answers * 80)::INTEGER
+                - (u.total_answers > i.total
+                   AND (u.correct_answers - i.correct) * 100 >= (u.total_answers - i.total) * 80)::INTEGER
+            ) AS mastered
+        FROM upserted u
+        JOIN increments i USING (user_id, species_name)
+        GROUP BY u.user_id
+    )
+    INSERT INTO user_stats AS s (user_id, total_answers, mastered_species)
+    SELECT user_id, answers, mastered
+    FROM deltas
+    ORDER BY user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        total_answers = s.total_answers + EXCLUDED.total_answers,
+        mastered_species = s.mastered_species + EXCLUDED.mastered_species,
+        updated_at = NOW();
+
+    RETURN NULL;
+END;
+$$;
+
+-- scores の INSERT 文ごとに、ユーザーごとの合計に加算する
+CREATE OR REPLACE FUNCTION apply_scores_to_stats()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    INSERT INTO user_stats AS s (user_id, total_quizzes, total_questions, total_correct)
+    SELECT user_id, COUNT(*), SUM(total_questions), SUM(score)
+    FROM new_rows
+    WHERE user_id IS NOT NULL
+    GROUP BY user_id
+    ORDER BY user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        total_quizzes = s.total_quizzes + EXCLUDED.total_quizzes,
+        total_questions = s.total_questions + EXCLUDED.total_questions,
+        total_correct = s.total_correct + EXCLUDED.total_correct,
+        updated_at = NOW();
+
+    RETURN NULL;
+END;
+$$;
+
+-- 既存の履歴から集計テーブルを作り、トリガーを登録する
+-- 集計中に追加された回答が漏れないよう、1トランザクションで書き込みを止めて行う
+BEGIN;
+
+LOCK TABLE species_answers, scores IN SHARE ROW EXCLUSIVE MODE;
+
+INSERT INTO user_species_stats (user_id, species_name, total_answers, correct_answers, last_answered_at)
+SELECT user_id, species_name, COUNT(*), COUNT(*) FILTER (WHERE is_correct), MAX(answered_at)
+FROM species_answers
+WHERE user_id IS NOT NULL
+GROUP BY user_id, species_name
+ON CONFLICT (user_id, species_name) DO NOTHING;
+
+INSERT INTO user_stats (user_id, total_quizzes, total_questions, total_correct, total_answers, mastered_species)
+SELECT
+    u.user_id,
+    COALESCE(sc.quizzes, 0),
+    COALESCE(sc.questions, 0),
+    COALESCE(sc.correct, 0),
+    COALESCE(sp.answers, 0),
+    COALESCE(sp.mastered, 0)
+FROM (
+    SELECT user_id FROM user_species_stats
+    UNION
+    SELECT user_id FROM scores WHERE user_id IS NOT NULL
+) u
+LEFT JOIN (
+    SELECT user_id, COUNT(*) AS quizzes, SUM(total_questions) AS questions, SUM(score) AS correct
+    FROM scores
+    GROUP BY user_id
+) sc USING (user_id)
+LEFT JOIN (
+    SELECT
+        user_id,
+        SUM(total_answers) AS answers,
+        COUNT(*) FILTER (WHERE correct_answers * 100 >= total_answers * 80) AS mastered
+    FROM user_species_stats
+    GROUP BY user_id
+) sp USING (user_id)
+ON CONFLICT (user_id) DO NOTHING;
+
+DROP TRIGGER IF EXISTS trg_species_answers_stats ON species_answers;
+CREATE TRIGGER trg_species_answers_stats
+    AFTER INSERT ON species_answers
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION apply_species_answers_to_stats();
+
+DROP TRIGGER IF EXISTS trg_scores_stats ON scores;
+CREATE TRIGGER trg_scores_stats
+    AFTER INSERT ON scores
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION apply_scores_to_stats();
+
+COMMIT;
+
+-- 種ごとの正答率を計算するビュー（集計テーブルから計算する）
+-- 列の型が変わるため作り直す
+DROP VIEW IF EXISTS species_accuracy;
+CREATE VIEW species_accuracy WITH (security_invoker = true) AS
+SELECT
     user_id,
     species_name,
-    COUNT(*) as total_answers,
-    SUM(CASE WHEN is_correct THEN 1 ELSE 0 END) as correct_answers,
-    ROUND(
-        (SUM(CASE WHEN is_correct THEN 1 ELSE 0 END)::DECIMAL / COUNT(*)) * 100, 
-        1
-    ) as accuracy_percent
-FROM species_answers
-GROUP BY user_id, species_name;
+    total_answers,
+    correct_answers,
+    ROUND((correct_answers::DECIMAL / NULLIF(total_answers, 0)) * 100, 1) AS accuracy_percent
+FROM user_species_stats;